@@ -0,0 +1,85 @@
+"""add entity set chunks
+
+Revision ID: 0c7e52b4a9d8
+Revises: f81c3a6d29e0
+Create Date: 2026-10-16 16:20:31.884120
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "0c7e52b4a9d8"
+down_revision = "f81c3a6d29e0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "entity_set",
+        sa.Column("chunked", sa.Boolean, nullable=False, server_default=sa.false()),
+    )
+    op.alter_column("entity_set", "entity_ids", nullable=True)
+    op.create_check_constraint(
+        "entity_set_entity_ids_storage_check",
+        "entity_set",
+        "(entity_ids IS NULL) = chunked",
+    )
+    op.create_table(
+        "entity_set_chunk",
+        sa.Column(
+            "set_id",
+            sa.String(128),
+            sa.ForeignKey("entity_set.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("chunk_index", sa.Integer, primary_key=True),
+        sa.Column("encoding", sa.Text, nullable=False),
+        sa.Column("entity_count", sa.Integer, nullable=False),
+        sa.Column("min_id", sa.Text(collation="C"), nullable=False),
+        sa.Column("max_id", sa.Text(collation="C"), nullable=False),
+        sa.Column("data", postgresql.BYTEA, nullable=False),
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION entity_set_entity_count() RETURNS trigger AS $$
+        BEGIN
+            -- chunked sets maintain their count when appending chunks
+            IF NEW.entity_ids IS NOT NULL OR NEW.entity_count IS NULL THEN
+                NEW.entity_count := coalesce(cardinality(NEW.entity_ids), 0);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+
+def downgrade():
+    # chunks are compressed and cannot be inlined in SQL
+    op.execute(
+        """
+        DO $$ BEGIN
+            IF EXISTS (SELECT 1 FROM entity_set WHERE chunked) THEN
+                RAISE EXCEPTION 'entity_set contains chunked sets';
+            END IF;
+        END $$
+        """
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION entity_set_entity_count() RETURNS trigger AS $$
+        BEGIN
+            NEW.entity_count := coalesce(cardinality(NEW.entity_ids), 0);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.drop_table("entity_set_chunk")
+    op.drop_constraint(
+        "entity_set_entity_ids_storage_check", "entity_set", type_="check"
+    )
+    op.alter_column("entity_set", "entity_ids", nullable=False)
+    op.drop_column("entity_set", "chunked")
@@ -0,0 +1,50 @@
+"""hash cohort filters in sql
+
+Revision ID: 2e7a9c4f1b83
+Revises: 6c0d8f2e4a19
+Create Date: 2026-10-16 20:05:12.640318
+
+"""
+from alembic import op
+
+revision = "2e7a9c4f1b83"
+down_revision = "6c0d8f2e4a19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION cohort_filter_filters_hash() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.filters_format = 'full' THEN
+                NEW.filters_hash := encode(
+                    sha256(convert_to(NEW.filters::text, 'UTF8')), 'hex'
+                );
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER cohort_filter_filters_hash
+        BEFORE INSERT OR UPDATE OF filters, filters_format ON cohort_filter
+        FOR EACH ROW EXECUTE PROCEDURE cohort_filter_filters_hash()
+        """
+    )
+    # fires the trigger for every full revision; the hashes of patch revisions
+    # were computed in python and are restored by the next compaction run
+    op.execute(
+        "UPDATE cohort_filter SET filters = filters WHERE filters_format = 'full'"
+    )
+    op.execute(
+        "UPDATE cohort_filter SET filters_hash = NULL WHERE filters_format = 'patch'"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER cohort_filter_filters_hash ON cohort_filter")
+    op.execute("DROP FUNCTION cohort_filter_filters_hash()")
@@ -0,0 +1,36 @@
+"""add packed case ids to cohort snapshot
+
+Revision ID: 3f6a2c1d9b04
+Revises: 12dbbcac7a1d
+Create Date: 2026-10-16 09:12:44.318207
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "3f6a2c1d9b04"
+down_revision = "12dbbcac7a1d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "cohort_snapshot",
+        sa.Column("packed_case_ids", postgresql.BYTEA, nullable=True),
+    )
+    op.alter_column("cohort_snapshot", "case_ids", nullable=True)
+    op.create_check_constraint(
+        "cohort_snapshot_case_ids_storage_check",
+        "cohort_snapshot",
+        "num_nonnulls(case_ids, packed_case_ids) = 1",
+    )
+
+
+def downgrade():
+    op.drop_constraint(
+        "cohort_snapshot_case_ids_storage_check", "cohort_snapshot", type_="check"
+    )
+    op.alter_column("cohort_snapshot", "case_ids", nullable=False)
+    op.drop_column("cohort_snapshot", "packed_case_ids")
@@ -0,0 +1,56 @@
+"""add cohort filter content
+
+Revision ID: 3f8a2d6c9b17
+Revises: e7b4c9a1f360
+Create Date: 2026-10-16 23:52:40.318027
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "3f8a2d6c9b17"
+down_revision = "e7b4c9a1f360"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "cohort_filter_content",
+        sa.Column("filters_hash", sa.String(64), primary_key=True),
+        sa.Column("filters", postgresql.JSONB, nullable=False),
+    )
+    op.drop_constraint(
+        "cohort_filter_filters_format_check", "cohort_filter", type_="check"
+    )
+    op.create_check_constraint(
+        "cohort_filter_filters_format_check",
+        "cohort_filter",
+        "(filters_format = 'full' "
+        "AND filters IS NOT NULL AND filters_patch IS NULL) "
+        "OR (filters_format = 'patch' AND parent_id IS NOT NULL "
+        "AND filters IS NULL AND filters_patch IS NOT NULL) "
+        "OR (filters_format = 'shared' AND filters_hash IS NOT NULL "
+        "AND filters IS NULL AND filters_patch IS NULL)",
+    )
+
+
+def downgrade():
+    op.drop_constraint(
+        "cohort_filter_filters_format_check", "cohort_filter", type_="check"
+    )
+    op.execute(
+        "UPDATE cohort_filter f SET filters = c.filters, filters_format = 'full' "
+        "FROM cohort_filter_content c "
+        "WHERE f.filters_format = 'shared' AND c.filters_hash = f.filters_hash"
+    )
+    op.create_check_constraint(
+        "cohort_filter_filters_format_check",
+        "cohort_filter",
+        "(filters_format = 'full' "
+        "AND filters IS NOT NULL AND filters_patch IS NULL) "
+        "OR (filters_format = 'patch' AND parent_id IS NOT NULL "
+        "AND filters IS NULL AND filters_patch IS NOT NULL)",
+    )
+    op.drop_table("cohort_filter_content")
@@ -0,0 +1,53 @@
+"""add cohort filter filters patch
+
+Revision ID: 4b8e1d6a0c52
+Revises: 2e7a9c4f1b83
+Create Date: 2026-10-16 20:48:31.207664
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "4b8e1d6a0c52"
+down_revision = "2e7a9c4f1b83"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("cohort_filter", sa.Column("filters_patch", postgresql.JSONB))
+    op.alter_column("cohort_filter", "filters", nullable=True)
+    op.drop_constraint(
+        "cohort_filter_filters_format_check", "cohort_filter", type_="check"
+    )
+    op.execute(
+        "UPDATE cohort_filter SET filters_patch = filters, filters = NULL "
+        "WHERE filters_format = 'patch'"
+    )
+    op.create_check_constraint(
+        "cohort_filter_filters_format_check",
+        "cohort_filter",
+        "(filters_format = 'full' "
+        "AND filters IS NOT NULL AND filters_patch IS NULL) "
+        "OR (filters_format = 'patch' AND parent_id IS NOT NULL "
+        "AND filters IS NULL AND filters_patch IS NOT NULL)",
+    )
+
+
+def downgrade():
+    op.drop_constraint(
+        "cohort_filter_filters_format_check", "cohort_filter", type_="check"
+    )
+    op.execute(
+        "UPDATE cohort_filter SET filters = filters_patch, filters_patch = NULL "
+        "WHERE filters_format = 'patch'"
+    )
+    op.create_check_constraint(
+        "cohort_filter_filters_format_check",
+        "cohort_filter",
+        "filters_format = 'full' "
+        "OR (filters_format = 'patch' AND parent_id IS NOT NULL)",
+    )
+    op.alter_column("cohort_filter", "filters", nullable=False)
+    op.drop_column("cohort_filter", "filters_patch")
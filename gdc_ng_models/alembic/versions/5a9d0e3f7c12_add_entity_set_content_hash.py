@@ -0,0 +1,30 @@
+"""add entity set content hash
+
+Revision ID: 5a9d0e3f7c12
+Revises: 0c7e52b4a9d8
+Create Date: 2026-10-16 17:05:48.392615
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "5a9d0e3f7c12"
+down_revision = "0c7e52b4a9d8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("entity_set", sa.Column("content_hash", sa.String(64)))
+    op.create_index(
+        "entity_set_frozen_content_hash_idx",
+        "entity_set",
+        ["entity_type", "content_hash"],
+        unique=True,
+        postgresql_where=sa.text("type = 'frozen'"),
+    )
+
+
+def downgrade():
+    op.drop_index("entity_set_frozen_content_hash_idx", table_name="entity_set")
+    op.drop_column("entity_set", "content_hash")
@@ -0,0 +1,27 @@
+"""add accessed datetime indexes
+
+Revision ID: 5d2e8a7f03b1
+Revises: c47d90e15f28
+Create Date: 2026-10-16 12:27:08.772411
+
+"""
+from alembic import op
+
+revision = "5d2e8a7f03b1"
+down_revision = "c47d90e15f28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("cohort_accessed_datetime_idx", "cohort", ["accessed_datetime"])
+    op.create_index(
+        "entity_set_type_accessed_datetime_idx",
+        "entity_set",
+        ["type", "accessed_datetime"],
+    )
+
+
+def downgrade():
+    op.drop_index("entity_set_type_accessed_datetime_idx", table_name="entity_set")
+    op.drop_index("cohort_accessed_datetime_idx", table_name="cohort")
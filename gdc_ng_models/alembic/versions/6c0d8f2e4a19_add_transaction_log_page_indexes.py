@@ -0,0 +1,63 @@
+"""add transaction log page indexes
+
+Revision ID: 6c0d8f2e4a19
+Revises: a3e94d7b5c60
+Create Date: 2026-10-16 18:52:40.316875
+
+"""
+from alembic import op
+
+revision = "6c0d8f2e4a19"
+down_revision = "a3e94d7b5c60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "transaction_logs_created_datetime_id_idx",
+        "transaction_logs",
+        ["created_datetime", "id"],
+    )
+    op.drop_index(
+        "transaction_logs_created_datetime_idx", table_name="transaction_logs"
+    )
+    op.create_index(
+        "transaction_logs_state_created_idx",
+        "transaction_logs",
+        ["state", "created_datetime", "id"],
+    )
+    op.create_index(
+        "transaction_logs_project_created_idx",
+        "transaction_logs",
+        ["program", "project", "created_datetime", "id"],
+    )
+    op.create_index(
+        "transaction_logs_project_state_created_idx",
+        "transaction_logs",
+        ["program", "project", "state", "created_datetime", "id"],
+    )
+    op.create_index(
+        "transaction_logs_project_dry_run_created_idx",
+        "transaction_logs",
+        ["program", "project", "is_dry_run", "created_datetime", "id"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "transaction_logs_project_dry_run_created_idx", table_name="transaction_logs"
+    )
+    op.drop_index(
+        "transaction_logs_project_state_created_idx", table_name="transaction_logs"
+    )
+    op.drop_index("transaction_logs_project_created_idx", table_name="transaction_logs")
+    op.drop_index("transaction_logs_state_created_idx", table_name="transaction_logs")
+    op.create_index(
+        "transaction_logs_created_datetime_idx",
+        "transaction_logs",
+        ["created_datetime"],
+    )
+    op.drop_index(
+        "transaction_logs_created_datetime_id_idx", table_name="transaction_logs"
+    )
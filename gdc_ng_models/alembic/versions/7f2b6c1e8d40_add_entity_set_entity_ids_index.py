@@ -0,0 +1,26 @@
+"""add entity set entity ids index
+
+Revision ID: 7f2b6c1e8d40
+Revises: 5a9d0e3f7c12
+Create Date: 2026-10-16 17:38:12.650937
+
+"""
+from alembic import op
+
+revision = "7f2b6c1e8d40"
+down_revision = "5a9d0e3f7c12"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "entity_set_entity_ids_idx",
+        "entity_set",
+        ["entity_ids"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("entity_set_entity_ids_idx", table_name="entity_set")
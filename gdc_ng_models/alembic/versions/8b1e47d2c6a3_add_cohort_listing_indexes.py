@@ -0,0 +1,23 @@
+"""add cohort listing indexes
+
+Revision ID: 8b1e47d2c6a3
+Revises: 3f6a2c1d9b04
+Create Date: 2026-10-16 10:02:17.541930
+
+"""
+from alembic import op
+
+revision = "8b1e47d2c6a3"
+down_revision = "3f6a2c1d9b04"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("cohort_context_id_idx", "cohort", ["context_id"])
+    op.create_index("cohort_filter_cohort_id_idx", "cohort_filter", ["cohort_id", "id"])
+
+
+def downgrade():
+    op.drop_index("cohort_filter_cohort_id_idx", table_name="cohort_filter")
+    op.drop_index("cohort_context_id_idx", table_name="cohort")
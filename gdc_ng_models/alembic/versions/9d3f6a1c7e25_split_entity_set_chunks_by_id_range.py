@@ -0,0 +1,35 @@
+"""split entity set chunks by id range
+
+Revision ID: 9d3f6a1c7e25
+Revises: 4b8e1d6a0c52
+Create Date: 2026-10-16 21:37:12.482915
+
+"""
+from alembic import context, op
+
+from gdc_ng_models.models import entity_set
+
+revision = "9d3f6a1c7e25"
+down_revision = "4b8e1d6a0c52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "entity_set_chunk_min_id_idx", "entity_set_chunk", ["set_id", "min_id"]
+    )
+    # Chunks used to be filled in append order, with overlapping id ranges
+    # (and possibly duplicate ids); rewrite them as disjoint sorted ranges.
+    if context.is_offline_mode():
+        return
+    connection = op.get_bind()
+    set_ids = connection.execute(
+        "SELECT id FROM entity_set WHERE chunked ORDER BY id"
+    ).fetchall()
+    for (set_id,) in set_ids:
+        entity_set.rechunk(connection, set_id)
+
+
+def downgrade():
+    op.drop_index("entity_set_chunk_min_id_idx", table_name="entity_set_chunk")
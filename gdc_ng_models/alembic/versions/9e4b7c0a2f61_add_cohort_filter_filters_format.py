@@ -0,0 +1,45 @@
+"""add cohort filter filters format
+
+Revision ID: 9e4b7c0a2f61
+Revises: 5d2e8a7f03b1
+Create Date: 2026-10-16 13:12:40.518302
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "9e4b7c0a2f61"
+down_revision = "5d2e8a7f03b1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "cohort_filter",
+        sa.Column("filters_format", sa.Text, nullable=False, server_default="full"),
+    )
+    op.create_check_constraint(
+        "cohort_filter_filters_format_check",
+        "cohort_filter",
+        "filters_format = 'full' "
+        "OR (filters_format = 'patch' AND parent_id IS NOT NULL)",
+    )
+
+
+def downgrade():
+    # patches cannot be applied in SQL, compacted revisions are restored with
+    # ng-models -m cohort compact --checkpoint-interval 1
+    op.execute(
+        """
+        DO $$ BEGIN
+            IF EXISTS (SELECT 1 FROM cohort_filter WHERE filters_format = 'patch') THEN
+                RAISE EXCEPTION 'cohort_filter contains compacted revisions';
+            END IF;
+        END $$
+        """
+    )
+    op.drop_constraint(
+        "cohort_filter_filters_format_check", "cohort_filter", type_="check"
+    )
+    op.drop_column("cohort_filter", "filters_format")
@@ -0,0 +1,23 @@
+"""add entity set json payload
+
+Revision ID: a3e94d7b5c60
+Revises: 7f2b6c1e8d40
+Create Date: 2026-10-16 18:14:27.093521
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+revision = "a3e94d7b5c60"
+down_revision = "7f2b6c1e8d40"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("entity_set", sa.Column("json_payload", postgresql.BYTEA))
+
+
+def downgrade():
+    op.drop_column("entity_set", "json_payload")
@@ -0,0 +1,42 @@
+"""add cohort snapshot packed case ids index
+
+Revision ID: a81d5e3b7f26
+Revises: 3f8a2d6c9b17
+Create Date: 2026-10-17 00:12:27.604813
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "a81d5e3b7f26"
+down_revision = "3f8a2d6c9b17"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION cohort_snapshot_packed_case_ids(packed bytea)
+        RETURNS uuid[] AS $$
+            SELECT CASE WHEN get_byte(packed, 0) = 0 THEN ARRAY(
+                SELECT CAST(encode(
+                    substring(packed FROM 6 + 16 * i FOR 16), 'hex'
+                ) AS uuid)
+                FROM generate_series(0, (length(packed) - 5) / 16 - 1) AS i
+                ORDER BY i
+            ) END
+        $$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+        """
+    )
+    op.create_index(
+        "cohort_snapshot_packed_case_ids_idx",
+        "cohort_snapshot",
+        [sa.text("cohort_snapshot_packed_case_ids(packed_case_ids)")],
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("cohort_snapshot_packed_case_ids_idx", table_name="cohort_snapshot")
+    op.execute("DROP FUNCTION cohort_snapshot_packed_case_ids(bytea)")
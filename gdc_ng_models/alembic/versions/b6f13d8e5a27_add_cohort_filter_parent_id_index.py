@@ -0,0 +1,21 @@
+"""add cohort filter parent id index
+
+Revision ID: b6f13d8e5a27
+Revises: 9e4b7c0a2f61
+Create Date: 2026-10-16 13:58:21.730946
+
+"""
+from alembic import op
+
+revision = "b6f13d8e5a27"
+down_revision = "9e4b7c0a2f61"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("cohort_filter_parent_id_idx", "cohort_filter", ["parent_id"])
+
+
+def downgrade():
+    op.drop_index("cohort_filter_parent_id_idx", table_name="cohort_filter")
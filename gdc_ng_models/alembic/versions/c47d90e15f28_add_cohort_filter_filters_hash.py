@@ -0,0 +1,27 @@
+"""add cohort filter filters hash
+
+Revision ID: c47d90e15f28
+Revises: 8b1e47d2c6a3
+Create Date: 2026-10-16 10:41:53.006215
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "c47d90e15f28"
+down_revision = "8b1e47d2c6a3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "cohort_filter",
+        sa.Column("filters_hash", sa.String(64), nullable=True),
+    )
+    op.create_index("cohort_filter_filters_hash_idx", "cohort_filter", ["filters_hash"])
+
+
+def downgrade():
+    op.drop_index("cohort_filter_filters_hash_idx", table_name="cohort_filter")
+    op.drop_column("cohort_filter", "filters_hash")
@@ -0,0 +1,27 @@
+"""add entity set chunked entity type index
+
+Revision ID: c5a2e8b0d914
+Revises: 9d3f6a1c7e25
+Create Date: 2026-10-16 22:04:51.736208
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "c5a2e8b0d914"
+down_revision = "9d3f6a1c7e25"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "entity_set_chunked_entity_type_idx",
+        "entity_set",
+        ["entity_type"],
+        postgresql_where=sa.text("chunked"),
+    )
+
+
+def downgrade():
+    op.drop_index("entity_set_chunked_entity_type_idx", table_name="entity_set")
@@ -0,0 +1,26 @@
+"""add cohort snapshot case ids index
+
+Revision ID: d2a85c94e1f3
+Revises: b6f13d8e5a27
+Create Date: 2026-10-16 14:47:09.261584
+
+"""
+from alembic import op
+
+revision = "d2a85c94e1f3"
+down_revision = "b6f13d8e5a27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "cohort_snapshot_case_ids_idx",
+        "cohort_snapshot",
+        ["case_ids"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("cohort_snapshot_case_ids_idx", table_name="cohort_snapshot")
@@ -0,0 +1,83 @@
+"""backfill frozen entity set hashes
+
+Revision ID: e7b4c9a1f360
+Revises: c5a2e8b0d914
+Create Date: 2026-10-16 22:31:06.915480
+
+"""
+import sqlalchemy as sa
+from alembic import context, op
+
+from gdc_ng_models.models import entity_set
+
+revision = "e7b4c9a1f360"
+down_revision = "c5a2e8b0d914"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    # Frozen sets created before freeze, or by copy_in, have neither a content
+    # hash nor a JSON payload. The oldest set of each content gets the hash;
+    # later duplicates are left without one, as the hash is unique.
+    if context.is_offline_mode():
+        return
+    connection = op.get_bind()
+    taken = set(
+        connection.execute(
+            "SELECT entity_type::text, content_hash FROM entity_set "
+            "WHERE type = 'frozen' AND content_hash IS NOT NULL"
+        ).fetchall()
+    )
+    set_ids = [
+        row[0]
+        for row in connection.execute(
+            "SELECT id FROM entity_set "
+            "WHERE type = 'frozen' AND NOT chunked "
+            "AND (content_hash IS NULL OR json_payload IS NULL) "
+            "ORDER BY created_datetime, id"
+        )
+    ]
+    select = sa.text(
+        "SELECT id, type::text, entity_type::text, entity_ids, content_hash, "
+        "json_payload IS NULL AS missing_payload, created_datetime, "
+        "updated_datetime FROM entity_set WHERE id = ANY(:ids) "
+        "ORDER BY created_datetime, id"
+    )
+    update = sa.text(
+        "UPDATE entity_set "
+        "SET content_hash = :content_hash, "
+        "json_payload = coalesce(:json_payload, json_payload) "
+        "WHERE id = :id"
+    )
+    for start in range(0, len(set_ids), BATCH_SIZE):
+        updates = []
+        for row in connection.execute(select, ids=set_ids[start : start + BATCH_SIZE]):
+            values = dict(
+                row,
+                type=entity_set.SetType[row.type],
+                entity_type=entity_set.EntityType[row.entity_type],
+            )
+            content_hash = row.content_hash
+            if content_hash is None:
+                key = (
+                    row.entity_type,
+                    entity_set.hash_content(values["entity_type"], row.entity_ids),
+                )
+                if key not in taken:
+                    taken.add(key)
+                    content_hash = key[1]
+            json_payload = None
+            if row.missing_payload:
+                json_payload = entity_set.render_json_payload(values)
+            updates.append(
+                dict(id=row.id, content_hash=content_hash, json_payload=json_payload)
+            )
+        if updates:
+            connection.execute(update, updates)
+
+
+def downgrade():
+    pass
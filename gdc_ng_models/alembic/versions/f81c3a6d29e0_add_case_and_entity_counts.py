@@ -0,0 +1,76 @@
+"""add case and entity counts
+
+Revision ID: f81c3a6d29e0
+Revises: d2a85c94e1f3
+Create Date: 2026-10-16 15:32:55.104718
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "f81c3a6d29e0"
+down_revision = "d2a85c94e1f3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("cohort_snapshot", sa.Column("case_count", sa.Integer))
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION cohort_snapshot_case_count() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.packed_case_ids IS NOT NULL THEN
+                NEW.case_count := (get_byte(NEW.packed_case_ids, 1) << 24)
+                    | (get_byte(NEW.packed_case_ids, 2) << 16)
+                    | (get_byte(NEW.packed_case_ids, 3) << 8)
+                    | get_byte(NEW.packed_case_ids, 4);
+            ELSE
+                NEW.case_count := coalesce(cardinality(NEW.case_ids), 0);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER cohort_snapshot_case_count
+        BEFORE INSERT OR UPDATE OF case_ids, packed_case_ids ON cohort_snapshot
+        FOR EACH ROW EXECUTE PROCEDURE cohort_snapshot_case_count()
+        """
+    )
+    # fires the trigger for every existing row
+    op.execute("UPDATE cohort_snapshot SET case_ids = case_ids")
+    op.alter_column("cohort_snapshot", "case_count", nullable=False)
+
+    op.add_column("entity_set", sa.Column("entity_count", sa.Integer))
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION entity_set_entity_count() RETURNS trigger AS $$
+        BEGIN
+            NEW.entity_count := coalesce(cardinality(NEW.entity_ids), 0);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER entity_set_entity_count
+        BEFORE INSERT OR UPDATE OF entity_ids ON entity_set
+        FOR EACH ROW EXECUTE PROCEDURE entity_set_entity_count()
+        """
+    )
+    op.execute("UPDATE entity_set SET entity_ids = entity_ids")
+    op.alter_column("entity_set", "entity_count", nullable=False)
+
+
+def downgrade():
+    op.execute("DROP TRIGGER entity_set_entity_count ON entity_set")
+    op.execute("DROP FUNCTION entity_set_entity_count()")
+    op.drop_column("entity_set", "entity_count")
+
+    op.execute("DROP TRIGGER cohort_snapshot_case_count ON cohort_snapshot")
+    op.execute("DROP FUNCTION cohort_snapshot_case_count()")
+    op.drop_column("cohort_snapshot", "case_count")
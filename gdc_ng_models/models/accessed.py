@@ -1,7 +1,11 @@
 """Mixin for adding an accessed timestamp column to track the last time a record was accessed."""
 import datetime
+import threading
+import time
 
+import sqlalchemy
 from sqlalchemy import schema, sql
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql import sqltypes
 
 
@@ -21,3 +25,140 @@ class AccessedColumnMixin:
         server_default=sql.text("now()"),
         onupdate=datetime.datetime.utcnow,
     )
+
+
+class AccessTouchBuffer:
+    """Buffers record accesses in memory and writes them in batches.
+
+    Marking a record as accessed on the read path would otherwise take an
+    UPDATE per read, which also bumps the updated_datetime of the record.
+    The buffer keeps only the latest access time per record ID and writes all
+    of them with a single UPDATE ... FROM unnest(...) statement that sets
+    nothing but accessed_datetime and never moves it backwards.
+
+    The buffer is thread safe. Callers invoke flush_if_due periodically, for
+    example at the end of each request or from a timer.
+
+    Attributes:
+        model: A data model using AccessedColumnMixin with a single column key
+            named id.
+        flush_interval: The number of seconds after which a flush is due.
+        max_pending: The number of buffered records after which a flush is due.
+    """
+
+    def __init__(self, model, flush_interval=60, max_pending=10000):
+        self.model = model
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.statement = _touch_statement(model.__table__)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, record_id, accessed_datetime=None):
+        """Records an access to a record.
+
+        Args:
+            record_id: The ID of the accessed record.
+            accessed_datetime: The time of the access, defaults to now.
+        """
+        accessed_datetime = accessed_datetime or datetime.datetime.now(
+            datetime.timezone.utc
+        )
+        with self._lock:
+            _merge_access(self._pending, record_id, accessed_datetime)
+
+    def is_due(self):
+        # type: () -> bool
+        """Indicates whether the buffer is full or the flush interval elapsed."""
+        return (
+            len(self._pending) >= self.max_pending
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush_if_due(self, connectable):
+        # type: (sqlalchemy.engine.Connectable | sqlalchemy.orm.Session) -> int
+        """Flushes the buffer if a flush is due, see flush."""
+        if not self.is_due():
+            return 0
+        return self.flush(connectable)
+
+    def flush(self, connectable):
+        # type: (sqlalchemy.engine.Connectable | sqlalchemy.orm.Session) -> int
+        """Writes all buffered accesses in a single statement.
+
+        Accesses are put back into the buffer if the write fails.
+
+        Args:
+            connectable: An engine, connection or session to write with. The
+                caller is responsible for committing connections and sessions
+                with an open transaction.
+
+        Returns:
+            The number of records updated.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+
+        try:
+            result = connectable.execute(
+                self.statement,
+                {
+                    "record_ids": list(pending.keys()),
+                    "accessed_datetimes": list(pending.values()),
+                },
+            )
+        except Exception:
+            with self._lock:
+                for record_id, accessed_datetime in pending.items():
+                    _merge_access(self._pending, record_id, accessed_datetime)
+            raise
+        return result.rowcount
+
+
+def _merge_access(pending, record_id, accessed_datetime):
+    current = pending.get(record_id)
+    if current is None or accessed_datetime > current:
+        pending[record_id] = accessed_datetime
+
+
+def _touch_statement(table):
+    # type: (sqlalchemy.Table) -> sqlalchemy.sql.Update
+    """Builds the batched accessed_datetime update for a table."""
+    id_type = postgresql.ARRAY(table.c.id.type)
+    accessed_type = postgresql.ARRAY(table.c.accessed_datetime.type)
+    touched = sqlalchemy.select(
+        [
+            sqlalchemy.func.unnest(
+                sqlalchemy.cast(
+                    sqlalchemy.bindparam("record_ids", type_=id_type), id_type
+                )
+            ).label("id"),
+            sqlalchemy.func.unnest(
+                sqlalchemy.cast(
+                    sqlalchemy.bindparam("accessed_datetimes", type_=accessed_type),
+                    accessed_type,
+                )
+            ).label("accessed_datetime"),
+        ]
+    ).alias("touched")
+
+    # assigning columns to themselves keeps their onupdate defaults from firing
+    values = {
+        column.name: column
+        for column in table.c
+        if column.onupdate is not None and column.name != "accessed_datetime"
+    }
+    values["accessed_datetime"] = touched.c.accessed_datetime
+    return (
+        table.update()
+        .values(values)
+        .where(table.c.id == touched.c.id)
+        .where(table.c.accessed_datetime < touched.c.accessed_datetime)
+    )
@@ -6,19 +6,119 @@ cohort data model includes the following entities:
     AnonymousContext: Used to authorize changes to a cohort
     Cohort: Defines the basic properties (name, id, context) of a cohort
     CohortFilter: Defines the filter used to generate a cohort case set
+    CohortFilterContent: Stores the content of shared filter revisions once
     CohortSnapshot: Defines the set of cases for a static cohort
 """
 
+import collections
+import json
+import threading
+import time
 import uuid
 
 import sqlalchemy
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext import declarative
 
-from gdc_ng_models.models import accessed, audit
+from gdc_ng_models.models import accessed, audit, entity_set
+from gdc_ng_models.utils import json_patch, packed_ids
 
 Base = declarative.declarative_base()
 
+LIST_FOR_CONTEXT_INCLUDES = frozenset(["filters", "snapshot", "case_ids"])
+
+
+# The case IDs of a set of snapshots as (snapshot_id, case_id) rows, decoding
+# uncompressed packed snapshots server side. Compressed packed snapshots are
+# not included and have to be handled in python.
+_SNAPSHOT_CASE_IDS = """
+    SELECT s.id AS snapshot_id, u.case_id
+    FROM cohort_snapshot s, unnest(s.case_ids) AS u(case_id)
+    WHERE s.id = ANY(:snapshot_ids)
+    UNION ALL
+    SELECT s.id AS snapshot_id,
+           CAST(encode(substring(s.packed_case_ids FROM {offset} + {size} * i
+                                 FOR {size}), 'hex') AS uuid) AS case_id
+    FROM cohort_snapshot s,
+         generate_series(0, (length(s.packed_case_ids) - {header}) / {size} - 1) AS i
+    WHERE s.id = ANY(:snapshot_ids)
+      AND get_byte(s.packed_case_ids, 0) = {codec}
+""".format(
+    offset=packed_ids.HEADER.size + 1,
+    header=packed_ids.HEADER.size,
+    size=packed_ids.ID_SIZE,
+    codec=packed_ids.COMPRESSION_NONE,
+)
+
+_SNAPSHOT_DIFF = sqlalchemy.text(
+    """
+    WITH case_ids AS ({case_ids}),
+    old AS (
+        SELECT DISTINCT case_id FROM case_ids WHERE snapshot_id = :old_id
+    ),
+    new AS (
+        SELECT DISTINCT case_id FROM case_ids WHERE snapshot_id = :new_id
+    )
+    SELECT count(*) FILTER (WHERE old.case_id IS NULL) AS added,
+           count(*) FILTER (WHERE new.case_id IS NULL) AS removed,
+           count(*) FILTER (WHERE old.case_id IS NOT NULL
+                              AND new.case_id IS NOT NULL) AS unchanged,
+           CASE WHEN :include_ids THEN
+               array_agg(new.case_id) FILTER (WHERE old.case_id IS NULL)
+           END AS added_ids,
+           CASE WHEN :include_ids THEN
+               array_agg(old.case_id) FILTER (WHERE new.case_id IS NULL)
+           END AS removed_ids
+    FROM old FULL OUTER JOIN new ON old.case_id = new.case_id
+    """.format(
+        case_ids=_SNAPSHOT_CASE_IDS
+    )
+).columns(
+    added_ids=postgresql.ARRAY(postgresql.UUID(as_uuid=True)),
+    removed_ids=postgresql.ARRAY(postgresql.UUID(as_uuid=True)),
+)
+
+JSON_CHUNK_SIZE = 64 * 1024
+
+FILTERS_FORMAT_FULL = "full"
+FILTERS_FORMAT_PATCH = "patch"
+FILTERS_FORMAT_SHARED = "shared"
+
+# Filter revisions and all their ancestors up to the closest full or shared
+# revisions, whose filters are read from cohort_filter_content; applying the
+# patches in order onto those filters materializes them.
+_FILTER_CHAINS = sqlalchemy.text(
+    """
+    WITH RECURSIVE chain AS (
+        SELECT id, parent_id, filters_format
+        FROM cohort_filter
+        WHERE id = ANY(:filter_ids)
+        UNION
+        SELECT f.id, f.parent_id, f.filters_format
+        FROM cohort_filter f JOIN chain ON f.id = chain.parent_id
+        WHERE chain.filters_format = :patch
+    )
+    SELECT f.id, f.parent_id, coalesce(f.filters, c.filters) AS filters,
+           f.filters_patch, f.filters_format
+    FROM cohort_filter f
+    JOIN chain ON f.id = chain.id
+    LEFT JOIN cohort_filter_content c
+        ON f.filters_format = :shared AND c.filters_hash = f.filters_hash
+    """
+).columns(filters=postgresql.JSONB, filters_patch=postgresql.JSONB)
+
+SnapshotDiff = collections.namedtuple(
+    "SnapshotDiff", ["added", "removed", "unchanged", "added_ids", "removed_ids"]
+)
+
+_STREAM_CASE_IDS = sqlalchemy.text(
+    "SELECT u.case_id "
+    "FROM cohort_snapshot s, "
+    "unnest(s.case_ids) WITH ORDINALITY AS u(case_id, ordinality) "
+    "WHERE s.id = :snapshot_id "
+    "ORDER BY u.ordinality"
+).columns(case_id=postgresql.UUID(as_uuid=True))
+
 
 class AnonymousContext(Base, audit.AuditColumnsMixin):
     """An anonymous context to drive authorization for cohort manipulation.
@@ -47,6 +147,59 @@ class AnonymousContext(Base, audit.AuditColumnsMixin):
         "Cohort", back_populates="context", lazy="selectin"
     )
 
+    @classmethod
+    def exists(cls, session, context_id, cache=None):
+        # type: (Session, uuid.UUID, AuthorizationCache | None) -> bool
+        """Checks whether a context exists without loading it or its cohorts.
+
+        Args:
+            session: The database session to query with.
+            context_id: The ID of the context.
+            cache: An optional cache of known valid contexts.
+
+        Returns:
+            True if the context exists.
+        """
+        key = (context_id, None)
+        if cache is not None and key in cache:
+            return True
+        found = session.query(
+            session.query(cls).filter(cls.id == context_id).exists()
+        ).scalar()
+        if found and cache is not None:
+            cache.add(key)
+        return found
+
+    @classmethod
+    def authorize(cls, session, context_id, cohort_id, cache=None):
+        # type: (Session, uuid.UUID, uuid.UUID, AuthorizationCache | None) -> bool
+        """Checks whether a cohort belongs to a context.
+
+        Ownership is checked with a single existence query on the cohort
+        primary key; neither the context nor any cohort is loaded.
+
+        Args:
+            session: The database session to query with.
+            context_id: The ID of the context requesting the change.
+            cohort_id: The ID of the cohort to change.
+            cache: An optional cache of known valid context/cohort pairs.
+                Only successful authorizations are cached.
+
+        Returns:
+            True if the cohort exists and belongs to the context.
+        """
+        key = (context_id, cohort_id)
+        if cache is not None and key in cache:
+            return True
+        found = session.query(
+            session.query(Cohort)
+            .filter(Cohort.id == cohort_id, Cohort.context_id == context_id)
+            .exists()
+        ).scalar()
+        if found and cache is not None:
+            cache.add(key)
+        return found
+
     def __repr__(self):
         return (
             "<AnonymousContext("
@@ -75,6 +228,74 @@ class AnonymousContext(Base, audit.AuditColumnsMixin):
         }
 
 
+class AuthorizationCache:
+    """A bounded, thread safe cache of known valid authorizations.
+
+    Entries expire ttl seconds after they were added, and the least recently
+    used entries are evicted once more than max_size are held. Since only
+    successful authorizations are cached, a deleted cohort may still pass
+    authorization until its entry expires or is invalidated.
+
+    Attributes:
+        max_size: The maximum number of cached entries.
+        ttl: The number of seconds an entry stays valid.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        if max_size < 1:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key):
+        """Caches a valid authorization.
+
+        Args:
+            key: A (context_id, cohort_id) pair, cohort_id being None for a
+                valid context.
+        """
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, context_id, cohort_id=None):
+        """Removes cached authorizations.
+
+        Args:
+            context_id: The context to invalidate.
+            cohort_id: The cohort to invalidate. If None, all entries of the
+                context are removed.
+        """
+        with self._lock:
+            if cohort_id is not None:
+                self._entries.pop((context_id, cohort_id), None)
+                return
+            for key in [key for key in self._entries if key[0] == context_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class Cohort(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
     """A base definition for a cohort entity.
 
@@ -82,12 +303,17 @@ class Cohort(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
         id: A unique identifier for the cohort.
         context_id: The ID of the associated context.
         name: A user defined name for the cohort.
+        current_filter: The latest filter associated with the cohort.
         created_datetime: The date and time when the record is created.
         updated_datetime: The date and time when the record is last updated.
         accessed_datetime: The date and time when the record is last accessed.
     """
 
     __tablename__ = "cohort"
+    __table_args__ = (
+        sqlalchemy.Index("cohort_context_id_idx", "context_id"),
+        sqlalchemy.Index("cohort_accessed_datetime_idx", "accessed_datetime"),
+    )
     id = sqlalchemy.Column(
         postgresql.UUID(as_uuid=True),
         primary_key=True,
@@ -114,8 +340,91 @@ class Cohort(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
 
     def get_current_filter(self):
         # type: (self) -> CohortFilter
-        """Retrieves the latest filter associated with the cohort."""
-        return self.filters[0]
+        """Retrieves the latest filter associated with the cohort.
+
+        Uses the filter history when it is already loaded, otherwise loads only
+        the latest filter through the current_filter relationship.
+        """
+        if "filters" in sqlalchemy.inspect(self).unloaded:
+            return self.current_filter
+        return self.filters[0] if self.filters else None
+
+    @classmethod
+    def get_current_filters(cls, session, cohort_ids):
+        # type: (sqlalchemy.orm.Session, typing.Iterable[uuid.UUID]) -> dict
+        """Retrieves the latest filter of many cohorts in a single query.
+
+        Args:
+            session: A database session.
+            cohort_ids: The IDs of the cohorts.
+
+        Returns:
+            A mapping of cohort ID to its latest filter. Cohorts without any
+            filters are omitted.
+        """
+        cohort_filters = (
+            session.query(CohortFilter)
+            .filter(CohortFilter.cohort_id.in_(list(cohort_ids)))
+            .distinct(CohortFilter.cohort_id)
+            .order_by(CohortFilter.cohort_id, CohortFilter.id.desc())
+        )
+        return {
+            cohort_filter.cohort_id: cohort_filter for cohort_filter in cohort_filters
+        }
+
+    @classmethod
+    def list_for_context(cls, session, context_id, include=()):
+        # type: (sqlalchemy.orm.Session, uuid.UUID, typing.Iterable[str]) -> list
+        """Lists the cohorts of a context along with their current filter.
+
+        Unlike loading AnonymousContext.cohorts, this does not pull in the
+        filter history or any case IDs. Only the current filter of each cohort
+        is loaded and its filters JSONB is deferred unless requested; shared
+        revisions then come with their content, so materialize does not
+        query.
+
+        Args:
+            session: A database session.
+            context_id: The ID of the context to list cohorts for.
+            include: Optional extra data to load, any of:
+                filters: The filters JSONB of the current filter, read with
+                    CohortFilter.materialize.
+                snapshot: The snapshot of the current filter, without case IDs.
+                case_ids: The case IDs of the snapshot (implies snapshot).
+
+        Returns:
+            A list of (cohort, current filter) tuples ordered by creation time.
+            The current filter is None for cohorts without filters.
+        """
+        include = set(include)
+        unknown = include - LIST_FOR_CONTEXT_INCLUDES
+        if unknown:
+            raise ValueError(
+                "invalid include specified: {}".format(", ".join(sorted(unknown)))
+            )
+
+        current_filter = sqlalchemy.orm.contains_eager(cls.current_filter)
+        options = [sqlalchemy.orm.lazyload(cls.filters), current_filter]
+        if "filters" in include:
+            options.append(current_filter.joinedload("content"))
+        else:
+            options.append(current_filter.defer("filters"))
+        if include & {"snapshot", "case_ids"}:
+            snapshot = current_filter.selectinload("snapshot")
+            if "case_ids" not in include:
+                snapshot = snapshot.defer("case_ids").defer("packed_case_ids")
+            options.append(snapshot)
+        else:
+            options.append(current_filter.lazyload("snapshot"))
+
+        cohorts = (
+            session.query(cls)
+            .outerjoin(cls.current_filter)
+            .filter(cls.context_id == context_id)
+            .options(*options)
+            .order_by(cls.created_datetime, cls.id)
+        )
+        return [(cohort, cohort.current_filter) for cohort in cohorts]
 
     def __repr__(self):
         return (
@@ -157,6 +466,11 @@ class Cohort(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
             else None,
         }
 
+    def iter_json(self, chunk_size=JSON_CHUNK_SIZE):
+        # type: (int) -> typing.Iterator[bytes]
+        """Serializes the cohort as JSON, see CohortSnapshot.iter_json."""
+        return _iter_json_object(self.to_json().items(), chunk_size)
+
 
 class CohortFilter(Base, audit.AuditColumnsMixin):
     """A filter defining the set of cases in a cohort.
@@ -165,17 +479,48 @@ class CohortFilter(Base, audit.AuditColumnsMixin):
     itself, a cohort type indicator, and a self-referential foreign key to maintain
     a history of changes.
 
+    Revisions recorded with find_or_create_by_filters are shared: their
+    filters are stored once in cohort_filter_content, keyed by filters_hash,
+    so identical filters (reverts, shared default cohorts) cost a row of
+    metadata per revision. Revisions with their own copy of the filters are
+    full, and old ones can be shrunk to patches by compact_history. Shared and
+    patch revisions have no filters of their own and are read with
+    materialize.
+
     Attributes:
         id: A unique identifier for the cohort.
         parent_id: A self-referential key to maintain parent-child history.
         cohort_id: The ID of the cohort associated with the filter.
-        filters: A representation of the filters defining the case set
+        filters: A representation of the filters defining the case set, None
+            for patch and shared revisions.
+        filters_patch: A JSON patch against the filters of the parent, set
+            for patch revisions only.
+        filters_format: Either full, patch or shared; patch revisions are
+            produced by compact_history, shared ones by
+            find_or_create_by_filters, and both are read with materialize.
+        filters_hash: A SHA-256 content hash of the full filters (see
+            hash_filters), maintained by a trigger on write for full
+            revisions. Shared revisions reference their content with it.
         cohort_type: A cohort type designation.
         created_datetime: The date and time when the record is created.
         updated_datetime: The date and time when the record is updated.
     """
 
     __tablename__ = "cohort_filter"
+    __table_args__ = (
+        sqlalchemy.Index("cohort_filter_cohort_id_idx", "cohort_id", "id"),
+        sqlalchemy.Index("cohort_filter_filters_hash_idx", "filters_hash"),
+        sqlalchemy.Index("cohort_filter_parent_id_idx", "parent_id"),
+        sqlalchemy.CheckConstraint(
+            "(filters_format = 'full' "
+            "AND filters IS NOT NULL AND filters_patch IS NULL) "
+            "OR (filters_format = 'patch' AND parent_id IS NOT NULL "
+            "AND filters IS NULL AND filters_patch IS NOT NULL) "
+            "OR (filters_format = 'shared' AND filters_hash IS NOT NULL "
+            "AND filters IS NULL AND filters_patch IS NULL)",
+            name="cohort_filter_filters_format_check",
+        ),
+    )
     id_seq = sqlalchemy.schema.Sequence(
         name="cohort_filter_id_seq",
         metadata=Base.metadata,
@@ -194,7 +539,19 @@ class CohortFilter(Base, audit.AuditColumnsMixin):
         sqlalchemy.ForeignKey("cohort.id"),
         nullable=False,
     )
-    filters = sqlalchemy.Column(postgresql.JSONB, nullable=False)
+    filters = sqlalchemy.Column(postgresql.JSONB)
+    filters_patch = sqlalchemy.Column(postgresql.JSONB)
+    filters_format = sqlalchemy.Column(
+        sqlalchemy.Text,
+        nullable=False,
+        default=FILTERS_FORMAT_FULL,
+        server_default=FILTERS_FORMAT_FULL,
+    )
+    filters_hash = sqlalchemy.Column(
+        sqlalchemy.String(64),
+        server_default=sqlalchemy.schema.FetchedValue(),
+        server_onupdate=sqlalchemy.schema.FetchedValue(),
+    )
     cohort_type = sqlalchemy.Column(sqlalchemy.Text, nullable=False, default="static")
 
     # establishes a many-to-one relationship with Cohort
@@ -212,6 +569,359 @@ class CohortFilter(Base, audit.AuditColumnsMixin):
     # establishes an adjacency relationship (i.e. self-referential key)
     parent = sqlalchemy.orm.relationship("CohortFilter")
 
+    # the stored content of a shared revision, see materialize
+    content = sqlalchemy.orm.relationship(
+        "CohortFilterContent",
+        primaryjoin="and_(CohortFilter.filters_format == 'shared', "
+        "foreign(CohortFilter.filters_hash) == CohortFilterContent.filters_hash)",
+        lazy="noload",
+        viewonly=True,
+    )
+
+    @property
+    def is_patch(self):
+        # type: () -> bool
+        return self.filters_format == FILTERS_FORMAT_PATCH
+
+    def materialize(self, session=None):
+        # type: (sqlalchemy.orm.Session) -> typing.Any
+        """Rebuilds the full filters of this revision, see materialize_all."""
+        return self.materialize_all(session, [self])[self.id]
+
+    @classmethod
+    def materialize_all(cls, session, cohort_filters):
+        # type: (sqlalchemy.orm.Session, typing.Iterable[CohortFilter]) -> dict
+        """Rebuilds the full filters of a number of revisions.
+
+        Full revisions are returned as is. Shared revisions are read from
+        cohort_filter_content, and patch revisions are rebuilt by fetching
+        their chains up to the closest full or shared ancestors with a single
+        recursive query and applying the patches in order, oldest first, so
+        a whole filter history costs one query.
+
+        Args:
+            session: The database session to query with, defaults to the
+                session of the filters.
+            cohort_filters: The filter revisions.
+
+        Returns:
+            A dict of the filters defining the case set by filter ID.
+        """
+        cohort_filters = list(cohort_filters)
+        materialized = {
+            f.id: f.filters
+            for f in cohort_filters
+            if f.filters_format == FILTERS_FORMAT_FULL
+        }
+        materialized.update(
+            (f.id, f.content.filters)
+            for f in cohort_filters
+            if f.filters_format == FILTERS_FORMAT_SHARED and f.content is not None
+        )
+        filter_ids = [f.id for f in cohort_filters if f.id not in materialized]
+        if not filter_ids:
+            return materialized
+
+        session = session or sqlalchemy.orm.object_session(cohort_filters[0])
+        rows = {
+            row.id: row
+            for row in session.execute(
+                _FILTER_CHAINS,
+                {
+                    "filter_ids": filter_ids,
+                    "patch": FILTERS_FORMAT_PATCH,
+                    "shared": FILTERS_FORMAT_SHARED,
+                },
+            )
+        }
+        for filter_id in filter_ids:
+            chain = []
+            row = rows.get(filter_id)
+            while row is not None and row.id not in materialized:
+                if row.filters_format != FILTERS_FORMAT_PATCH:
+                    materialized[row.id] = row.filters
+                    break
+                chain.append(row)
+                row = rows.get(row.parent_id)
+            if row is None:
+                raise ValueError(
+                    "cohort filter {} has no full ancestor revision".format(filter_id)
+                )
+            for patch in reversed(chain):
+                materialized[patch.id] = json_patch.apply(
+                    materialized[patch.parent_id], patch.filters_patch
+                )
+        return materialized
+
+    @classmethod
+    def compact_history(cls, connectable, cohort_id, checkpoint_interval=10):
+        # type: (sqlalchemy.engine.Connectable | sqlalchemy.orm.Session, uuid.UUID, int) -> int
+        """Rewrites the filter history of a cohort as deltas against parents.
+
+        Every revision except the current one is stored as a JSON patch
+        against its parent, unless the patch is not smaller than the filters
+        themselves. Every checkpoint_interval revisions along a chain the
+        filters are kept in full, which bounds the number of rows read by
+        materialize. Running it again converts revisions back to full as the
+        layout requires, so it can be re-run with a different interval.
+        Shared revisions already store no filters of their own and are left
+        as they are; they count as full revisions along a chain.
+
+        The filter rows of the cohort are locked for the duration of the
+        transaction of the caller. Content hashes are kept (and backfilled
+        where missing, which rewrites the revision); updated_datetime is left
+        unchanged.
+
+        Args:
+            connectable: An engine, connection or session to use.
+            cohort_id: The ID of the cohort.
+            checkpoint_interval: The maximum number of rows in a chain.
+
+        Returns:
+            The number of revisions rewritten.
+        """
+        if checkpoint_interval < 1:
+            raise ValueError("checkpoint_interval must be positive")
+
+        table = cls.__table__
+        content = CohortFilterContent.__table__
+        rows = connectable.execute(
+            sqlalchemy.select(
+                [
+                    table.c.id,
+                    table.c.parent_id,
+                    table.c.filters,
+                    table.c.filters_patch,
+                    table.c.filters_format,
+                    table.c.filters_hash,
+                    content.c.filters.label("shared_filters"),
+                ]
+            )
+            .select_from(
+                table.outerjoin(
+                    content,
+                    (table.c.filters_format == FILTERS_FORMAT_SHARED)
+                    & (content.c.filters_hash == table.c.filters_hash),
+                )
+            )
+            .where(table.c.cohort_id == cohort_id)
+            .order_by(table.c.id)
+            .with_for_update(of=table)
+        ).fetchall()
+        if len(rows) < 2:
+            return 0
+
+        current_id = rows[-1].id
+        materialized = {}
+        chain_length = {}
+        updates = []
+        for row in rows:
+            if row.filters_format == FILTERS_FORMAT_PATCH:
+                if row.parent_id not in materialized:
+                    raise ValueError(
+                        "cohort filter {} has no full ancestor revision".format(row.id)
+                    )
+                filters = json_patch.apply(
+                    materialized[row.parent_id], row.filters_patch
+                )
+            elif row.filters_format == FILTERS_FORMAT_SHARED:
+                materialized[row.id] = row.shared_filters
+                chain_length[row.id] = 1
+                continue
+            else:
+                filters = row.filters
+            materialized[row.id] = filters
+
+            filters_format, stored = FILTERS_FORMAT_FULL, filters
+            length = chain_length.get(row.parent_id, checkpoint_interval) + 1
+            if row.id != current_id and length <= checkpoint_interval:
+                patch = json_patch.diff(materialized[row.parent_id], filters)
+                if len(json.dumps(patch)) < len(json.dumps(filters)):
+                    filters_format, stored = FILTERS_FORMAT_PATCH, patch
+            chain_length[row.id] = (
+                length if filters_format == FILTERS_FORMAT_PATCH else 1
+            )
+
+            is_patch = filters_format == FILTERS_FORMAT_PATCH
+            if (
+                filters_format != row.filters_format
+                or stored != (row.filters_patch if is_patch else row.filters)
+                or row.filters_hash is None
+            ):
+                updates.append(
+                    {
+                        "filter_id": row.id,
+                        "new_filters": None if is_patch else stored,
+                        "new_filters_patch": stored if is_patch else None,
+                        "new_filters_format": filters_format,
+                        "full_filters": filters,
+                    }
+                )
+
+        if updates:
+            nullable = postgresql.JSONB(none_as_null=True)
+            connectable.execute(
+                table.update()
+                .where(table.c.id == sqlalchemy.bindparam("filter_id"))
+                .values(
+                    filters=sqlalchemy.bindparam("new_filters", type_=nullable),
+                    filters_patch=sqlalchemy.bindparam(
+                        "new_filters_patch", type_=nullable
+                    ),
+                    filters_format=sqlalchemy.bindparam("new_filters_format"),
+                    # the trigger only hashes full revisions
+                    filters_hash=hash_filters(
+                        sqlalchemy.bindparam("full_filters", type_=postgresql.JSONB)
+                    ),
+                    updated_datetime=table.c.updated_datetime,
+                ),
+                updates,
+            )
+        return len(updates)
+
+    @classmethod
+    def lineage(cls, session, filter_id, max_depth=None):
+        # type: (sqlalchemy.orm.Session, int, int) -> list[CohortFilter]
+        """Loads a filter and its ancestors with a single recursive query.
+
+        Args:
+            session: A database session.
+            filter_id: The ID of the filter to start from.
+            max_depth: An optional limit on the number of ancestors.
+
+        Returns:
+            The filter followed by its parent, grandparent and so on. The list
+            is empty if the filter does not exist. The filters of compacted
+            revisions are read with materialize_all.
+        """
+        return cls._walk(session, filter_id, max_depth, ancestors=True)
+
+    @classmethod
+    def descendants(cls, session, filter_id, max_depth=None):
+        # type: (sqlalchemy.orm.Session, int, int) -> list[CohortFilter]
+        """Loads the revisions derived from a filter with a single recursive query.
+
+        Args:
+            session: A database session.
+            filter_id: The ID of the filter to start from.
+            max_depth: An optional limit on the number of generations.
+
+        Returns:
+            The children, grandchildren and so on of the filter, ordered by
+            generation and ID. The filter itself is not included.
+        """
+        return cls._walk(session, filter_id, max_depth, ancestors=False)[1:]
+
+    @classmethod
+    def _walk(cls, session, filter_id, max_depth, ancestors):
+        table = cls.__table__
+        chain = (
+            sqlalchemy.select(
+                [
+                    table.c.id,
+                    table.c.parent_id,
+                    sqlalchemy.literal(0).label("depth"),
+                ]
+            )
+            .where(table.c.id == filter_id)
+            .cte("chain", recursive=True)
+        )
+        step = table.alias("step")
+        join = (
+            step.c.id == chain.c.parent_id
+            if ancestors
+            else step.c.parent_id == chain.c.id
+        )
+        recursive = sqlalchemy.select(
+            [step.c.id, step.c.parent_id, (chain.c.depth + 1).label("depth")]
+        ).where(join)
+        if max_depth is not None:
+            recursive = recursive.where(chain.c.depth < max_depth)
+        chain = chain.union_all(recursive)
+
+        # the snapshots of a history are not needed to walk it
+        return (
+            session.query(cls)
+            .options(sqlalchemy.orm.lazyload(cls.snapshot))
+            .join(chain, cls.id == chain.c.id)
+            .order_by(chain.c.depth, cls.id)
+            .all()
+        )
+
+    @classmethod
+    def find_by_filters(cls, session, filters, cohort_id=None):
+        # type: (sqlalchemy.orm.Session, typing.Any, uuid.UUID) -> sqlalchemy.orm.Query
+        """Queries the filters with the same content, using the content hash.
+
+        Args:
+            session: A database session.
+            filters: The filters to look up.
+            cohort_id: Optionally restricts the lookup to a single cohort.
+
+        Returns:
+            A query over the matching filters, latest first. Patch and shared
+            revisions only match by hash; use materialize to read them.
+        """
+        query = session.query(cls).filter(
+            cls.filters_hash == hash_filters(filters),
+            sqlalchemy.or_(
+                cls.filters_format != FILTERS_FORMAT_FULL,
+                cls.filters == sqlalchemy.cast(filters, postgresql.JSONB),
+            ),
+        )
+        if cohort_id is not None:
+            query = query.filter(cls.cohort_id == cohort_id)
+        return query.order_by(cls.id.desc())
+
+    @classmethod
+    def find_or_create_by_filters(
+        cls, session, cohort_id, filters, cohort_type="static"
+    ):
+        # type: (sqlalchemy.orm.Session, uuid.UUID, typing.Any, str) -> tuple
+        """Records a filter revision for a cohort, storing its content once.
+
+        When the current filter of the cohort already has the same content and
+        type it is returned as is. Otherwise a new shared revision is added as
+        a child of the current one: its filters are stored in
+        cohort_filter_content under their filters_hash, unless a revision of
+        any cohort stored the same content before, so reverts and default
+        filters shared by many cohorts are not copied again.
+
+        Args:
+            session: A database session.
+            cohort_id: The ID of the cohort.
+            filters: The filters defining the case set.
+            cohort_type: A cohort type designation.
+
+        Returns:
+            A (filter, created) tuple, where created indicates a new filter.
+            The filters of a new revision are read with materialize.
+        """
+        filters_hash = session.scalar(hash_filters(filters))
+        current = Cohort.get_current_filters(session, [cohort_id]).get(cohort_id)
+        if (
+            current is not None
+            and current.filters_hash == filters_hash
+            and current.cohort_type == cohort_type
+        ):
+            return current, False
+
+        session.execute(
+            postgresql.insert(CohortFilterContent.__table__)
+            .values(filters_hash=filters_hash, filters=filters)
+            .on_conflict_do_nothing()
+        )
+        cohort_filter = cls(
+            cohort_id=cohort_id,
+            parent_id=current.id if current is not None else None,
+            filters_format=FILTERS_FORMAT_SHARED,
+            filters_hash=filters_hash,
+            cohort_type=cohort_type,
+        )
+        session.add(cohort_filter)
+        session.flush()
+        return cohort_filter, True
+
     def __repr__(self):
         return (
             "<CohortFilter("
@@ -225,7 +935,7 @@ class CohortFilter(Base, audit.AuditColumnsMixin):
                 id=self.id,
                 parent_id=self.parent_id,
                 cohort_id=self.cohort_id,
-                filters=self.filters,
+                filters=self.materialize(),
                 cohort_type=self.cohort_type,
                 created_datetime=self.created_datetime.isoformat()
                 if self.created_datetime
@@ -241,7 +951,7 @@ class CohortFilter(Base, audit.AuditColumnsMixin):
             "id": self.id,
             "parent_id": self.parent_id,
             "cohort_id": str(self.cohort_id),
-            "filters": self.filters,
+            "filters": self.materialize(),
             "cohort_type": self.cohort_type,
             "created_datetime": self.created_datetime.isoformat()
             if self.created_datetime
@@ -251,6 +961,32 @@ class CohortFilter(Base, audit.AuditColumnsMixin):
             else None,
         }
 
+    def iter_json(self, chunk_size=JSON_CHUNK_SIZE):
+        # type: (int) -> typing.Iterator[bytes]
+        """Serializes the filter as JSON, see CohortSnapshot.iter_json."""
+        return _iter_json_object(self.to_json().items(), chunk_size)
+
+
+class CohortFilterContent(Base):
+    """The content of shared cohort filter revisions, stored once.
+
+    Rows are written by CohortFilter.find_or_create_by_filters and are never
+    changed. They are not deleted along with the revisions referencing them,
+    as other cohorts may share them.
+
+    Attributes:
+        filters_hash: The SHA-256 content hash of the filters, see
+            hash_filters.
+        filters: A representation of the filters defining the case set.
+    """
+
+    __tablename__ = "cohort_filter_content"
+    filters_hash = sqlalchemy.Column(sqlalchemy.String(64), primary_key=True)
+    filters = sqlalchemy.Column(postgresql.JSONB, nullable=False)
+
+    def __repr__(self):
+        return "<CohortFilterContent(filters_hash={})>".format(self.filters_hash)
+
 
 class CohortSnapshot(Base, audit.AuditColumnsMixin):
     """A static snapshot of cases associated with a cohort filter.
@@ -258,16 +994,37 @@ class CohortSnapshot(Base, audit.AuditColumnsMixin):
     In the event a cohort is static, this provides a list of cases associated
     with the cohort and the data release in which they were generated.
 
+    Case IDs are stored in exactly one of two ways: as a UUID array in case_ids,
+    or as sorted 16 byte values in packed_case_ids (see the packed_ids module).
+    The packed form is cheaper to load for large cohorts, and get_case_ids
+    exposes it as a lazily decoded sequence.
+
     Attributes:
         id: A unique identifier for the snapshot.
         filter_id: The ID of the filter associated with the snapshot.
         data_release: The ID of the data release when the snapshot was created.
         case_ids: A set of case IDs.
+        packed_case_ids: A set of case IDs in the packed binary format.
+        case_count: The number of case IDs, maintained by a trigger on write.
         created_datetime: The date and time when the record is created.
         updated_datetime: The date and time when the record is updated.
     """
 
     __tablename__ = "cohort_snapshot"
+    __table_args__ = (
+        sqlalchemy.CheckConstraint(
+            "num_nonnulls(case_ids, packed_case_ids) = 1",
+            name="cohort_snapshot_case_ids_storage_check",
+        ),
+        sqlalchemy.Index(
+            "cohort_snapshot_case_ids_idx", "case_ids", postgresql_using="gin"
+        ),
+        sqlalchemy.Index(
+            "cohort_snapshot_packed_case_ids_idx",
+            sqlalchemy.text("cohort_snapshot_packed_case_ids(packed_case_ids)"),
+            postgresql_using="gin",
+        ),
+    )
     id_seq = sqlalchemy.schema.Sequence(
         name="cohort_snapshot_id_seq",
         metadata=Base.metadata,
@@ -284,14 +1041,250 @@ class CohortSnapshot(Base, audit.AuditColumnsMixin):
         unique=True,
     )
     data_release = sqlalchemy.Column(postgresql.UUID(as_uuid=True), nullable=False)
-    case_ids = sqlalchemy.Column(
-        postgresql.ARRAY(postgresql.UUID(as_uuid=True)),
+    case_ids = sqlalchemy.Column(postgresql.ARRAY(postgresql.UUID(as_uuid=True)))
+    packed_case_ids = sqlalchemy.Column(postgresql.BYTEA)
+    case_count = sqlalchemy.Column(
+        sqlalchemy.Integer,
         nullable=False,
+        server_default=sqlalchemy.schema.FetchedValue(),
+        server_onupdate=sqlalchemy.schema.FetchedValue(),
     )
 
     # establishes a one-to-one relationship with CohortFilter
     filter = sqlalchemy.orm.relationship("CohortFilter", back_populates="snapshot")
 
+    @classmethod
+    def packed(cls, case_ids, compression=None, **kwargs):
+        """Creates a snapshot storing its case IDs in the packed binary format.
+
+        Args:
+            case_ids: The case IDs of the snapshot.
+            compression: An optional compression codec, "zlib" or "zstd".
+            kwargs: Any other snapshot attributes (filter_id, data_release).
+
+        Returns:
+            A new, transient snapshot.
+        """
+        return cls(
+            packed_case_ids=packed_ids.pack(case_ids, compression=compression), **kwargs
+        )
+
+    @classmethod
+    def containing_case(cls, session, case_id):
+        # type: (sqlalchemy.orm.Session, uuid.UUID) -> list[CohortSnapshot]
+        """Finds the snapshots containing a case.
+
+        Array snapshots are matched with the containment operator, served by
+        the cohort_snapshot_case_ids_idx GIN index. Uncompressed packed
+        snapshots are matched the same way on their case IDs decoded by the
+        cohort_snapshot_packed_case_ids function, served by the
+        cohort_snapshot_packed_case_ids_idx GIN index. Compressed packed
+        snapshots cannot be decoded in postgresql, so they cannot be indexed
+        and are never found: snapshots that must be searchable by case should
+        not be compressed.
+
+        Args:
+            session: A database session.
+            case_id: The case to look for.
+
+        Returns:
+            The matching snapshots ordered by ID, with their case IDs deferred.
+        """
+        case_ids = sqlalchemy.cast([uuid.UUID(str(case_id))], cls.case_ids.type)
+        return (
+            session.query(cls)
+            .options(
+                sqlalchemy.orm.defer(cls.case_ids),
+                sqlalchemy.orm.defer(cls.packed_case_ids),
+            )
+            .filter(
+                sqlalchemy.or_(
+                    cls.case_ids.contains(case_ids),
+                    sqlalchemy.func.cohort_snapshot_packed_case_ids(
+                        cls.packed_case_ids, type_=cls.case_ids.type
+                    ).contains(case_ids),
+                )
+            )
+            .order_by(cls.id)
+            .all()
+        )
+
+    @property
+    def is_packed(self):
+        # type: (self) -> bool
+        """Indicates whether the case IDs use the packed binary storage."""
+        return self.packed_case_ids is not None
+
+    def get_case_ids(self):
+        # type: (self) -> typing.Sequence[uuid.UUID]
+        """Retrieves the case IDs regardless of the storage used.
+
+        Packed snapshots return a lazily decoded packed_ids.PackedIds, which
+        supports len(), slicing and membership tests without decoding the
+        full set. Array snapshots return the case_ids list.
+        """
+        if not self.is_packed:
+            return self.case_ids
+
+        view = getattr(self, "_packed_view", None)
+        if view is None or view.data is not self.packed_case_ids:
+            view = packed_ids.PackedIds(self.packed_case_ids)
+            self._packed_view = view
+        return view
+
+    def _case_ids_loaded(self):
+        # type: (self) -> bool
+        """Indicates whether the case IDs can be read without a query."""
+        state = sqlalchemy.inspect(self)
+        if not state.persistent:
+            return True
+        return not state.unloaded & {"case_ids", "packed_case_ids"}
+
+    def case_ids_page(self, offset, limit):
+        # type: (self, int, int) -> list[uuid.UUID]
+        """Retrieves a page of case IDs without loading the whole set.
+
+        Case IDs already loaded on the instance are sliced in memory. When they
+        are deferred (see list_for_context and containing_case), the slice is
+        pushed into postgresql: an array subscript for array snapshots, or a
+        substring of the payload for uncompressed packed snapshots. Compressed packed snapshots are fetched whole (they are
+        compact) and decoded lazily. Packed case IDs are in sorted order.
+
+        Args:
+            offset: The zero based index of the first case ID to return.
+            limit: The maximum number of case IDs to return.
+
+        Returns:
+            The case IDs in the requested page.
+        """
+        if offset < 0 or limit < 0:
+            raise ValueError("offset and limit must not be negative")
+        if limit == 0:
+            return []
+        if self._case_ids_loaded():
+            return list(self.get_case_ids()[offset : offset + limit])
+
+        packed = CohortSnapshot.packed_case_ids
+        codec = sqlalchemy.func.get_byte(packed, 0)
+        packed_page = sqlalchemy.case(
+            [
+                (
+                    codec == packed_ids.COMPRESSION_NONE,
+                    sqlalchemy.func.substring(
+                        packed,
+                        packed_ids.HEADER.size + 1 + offset * packed_ids.ID_SIZE,
+                        limit * packed_ids.ID_SIZE,
+                    ),
+                )
+            ],
+            else_=packed,
+        )
+        session = sqlalchemy.orm.object_session(self)
+        array_page, packed_page, codec = (
+            session.query(
+                CohortSnapshot.case_ids[offset + 1 : offset + limit],
+                packed_page,
+                codec,
+            )
+            .filter(CohortSnapshot.id == self.id)
+            .one()
+        )
+
+        if codec is None:
+            return array_page or []
+        if codec == packed_ids.COMPRESSION_NONE:
+            raw = bytes(packed_page)
+            return [
+                uuid.UUID(bytes=raw[i : i + packed_ids.ID_SIZE])
+                for i in range(0, len(raw), packed_ids.ID_SIZE)
+            ]
+        return packed_ids.PackedIds(packed_page)[offset : offset + limit]
+
+    def iter_case_ids(self, batch_size=1000):
+        # type: (self, int) -> typing.Iterator[uuid.UUID]
+        """Iterates over the case IDs without materializing the whole set.
+
+        Array case IDs that are not already loaded are streamed from a server
+        side cursor, batch_size rows per round trip. Packed case IDs are read
+        in their compact form and decoded as they are iterated.
+
+        Args:
+            batch_size: The number of case IDs to fetch per round trip.
+
+        Yields:
+            The case IDs of the snapshot.
+        """
+        if self._case_ids_loaded() or self.is_packed:
+            for case_id in self.get_case_ids():
+                yield case_id
+            return
+
+        session = sqlalchemy.orm.object_session(self)
+        result = (
+            session.connection()
+            .execution_options(stream_results=True)
+            .execute(_STREAM_CASE_IDS, snapshot_id=self.id)
+        )
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row.case_id
+        finally:
+            result.close()
+
+    def diff(self, session, other_id, include_ids=False):
+        # type: (self, sqlalchemy.orm.Session, int, bool) -> SnapshotDiff
+        """Compares the case IDs of this snapshot with another snapshot.
+
+        Array and uncompressed packed snapshots are compared in postgresql, so
+        neither set of case IDs is loaded. When either snapshot is compressed
+        the comparison is a sorted merge over the packed bytes instead.
+
+        Args:
+            session: A database session.
+            other_id: The ID of the snapshot to compare against.
+            include_ids: Whether to also return the added and removed case IDs.
+
+        Returns:
+            A SnapshotDiff of the cases added in, removed from and unchanged in
+            the other snapshot relative to this one. added_ids and removed_ids
+            are only set when include_ids is requested.
+        """
+        codecs = dict(
+            session.query(
+                CohortSnapshot.id,
+                sqlalchemy.func.get_byte(CohortSnapshot.packed_case_ids, 0),
+            ).filter(CohortSnapshot.id.in_([self.id, other_id]))
+        )
+        if other_id not in codecs:
+            raise ValueError("snapshot {} does not exist".format(other_id))
+
+        if all(c in (None, packed_ids.COMPRESSION_NONE) for c in codecs.values()):
+            row = session.execute(
+                _SNAPSHOT_DIFF,
+                {
+                    "snapshot_ids": [self.id, other_id],
+                    "old_id": self.id,
+                    "new_id": other_id,
+                    "include_ids": include_ids,
+                },
+            ).first()
+            return SnapshotDiff(
+                row.added,
+                row.removed,
+                row.unchanged,
+                (row.added_ids or []) if include_ids else None,
+                (row.removed_ids or []) if include_ids else None,
+            )
+
+        other = session.query(CohortSnapshot).get(other_id)
+        return _merge_diff(
+            _sorted_raw_case_ids(self), _sorted_raw_case_ids(other), include_ids
+        )
+
     def __repr__(self):
         return (
             "<CohortSnapshot("
@@ -304,7 +1297,7 @@ class CohortSnapshot(Base, audit.AuditColumnsMixin):
                 id=self.id,
                 filter_id=self.filter_id,
                 data_release=self.data_release,
-                case_ids=self.case_ids,
+                case_ids=self.get_case_ids(),
                 created_datetime=self.created_datetime.isoformat()
                 if self.created_datetime
                 else None,
@@ -315,11 +1308,16 @@ class CohortSnapshot(Base, audit.AuditColumnsMixin):
         )
 
     def to_json(self):
+        if self.is_packed:
+            case_ids = list(self.get_case_ids().iter_strings())
+        else:
+            case_ids = [str(case_id) for case_id in self.case_ids]
+
         return {
             "id": self.id,
             "filter_id": self.filter_id,
             "data_release": str(self.data_release),
-            "case_ids": [str(case_id) for case_id in self.case_ids],
+            "case_ids": case_ids,
             "created_datetime": self.created_datetime.isoformat()
             if self.created_datetime
             else None,
@@ -327,3 +1325,523 @@ class CohortSnapshot(Base, audit.AuditColumnsMixin):
             if self.updated_datetime
             else None,
         }
+
+    def iter_json(self, chunk_size=JSON_CHUNK_SIZE, batch_size=1000):
+        # type: (int, int) -> typing.Iterator[bytes]
+        """Serializes the snapshot as JSON in chunks of bytes.
+
+        Produces the same document as to_json, without building the list of
+        case ID strings: packed case IDs are formatted straight from their
+        bytes and unloaded array case IDs are streamed from the database (see
+        iter_case_ids). The response can be sent as soon as the first chunk is
+        ready, and memory use is bounded by the chunk size.
+
+        Args:
+            chunk_size: The approximate size of each chunk in bytes.
+            batch_size: The number of case IDs fetched per round trip.
+
+        Yields:
+            The UTF-8 encoded JSON document.
+        """
+        if self.is_packed:
+            case_ids = self.get_case_ids().iter_strings()
+        else:
+            case_ids = (str(case_id) for case_id in self.iter_case_ids(batch_size))
+
+        return _iter_json_object(
+            [
+                ("id", self.id),
+                ("filter_id", self.filter_id),
+                ("data_release", str(self.data_release)),
+                ("case_ids", _JsonStrings(case_ids)),
+                (
+                    "created_datetime",
+                    self.created_datetime.isoformat()
+                    if self.created_datetime
+                    else None,
+                ),
+                (
+                    "updated_datetime",
+                    self.updated_datetime.isoformat()
+                    if self.updated_datetime
+                    else None,
+                ),
+            ],
+            chunk_size,
+        )
+
+
+def bulk_create(session, specs, batch_size=1000):
+    # type: (sqlalchemy.orm.Session, typing.Sequence[dict], int) -> list[uuid.UUID]
+    """Creates many cohorts, each with a single filter and optional snapshot.
+
+    Filter and snapshot IDs are allocated from their sequences in one round
+    trip each, and every table is written with multi-row INSERT statements of
+    up to batch_size rows, bypassing the unit of work. Created rows are not
+    added to the session.
+
+    Args:
+        session: A database session.
+        specs: One dict per cohort with the keys:
+            name: The name of the cohort (required).
+            filters: The filters of the cohort (required).
+            id: The ID of the cohort, generated when omitted.
+            context_id: The ID of the context, a new context is created when
+                omitted. Missing contexts are created.
+            cohort_type: A cohort type designation, defaults to static.
+            data_release: The data release of the snapshot.
+            case_ids or packed_case_ids: The case IDs of the snapshot, either
+                as a sequence or in the packed binary format. The snapshot is
+                only created when one of them is provided.
+        batch_size: The maximum number of rows per INSERT statement.
+
+    Returns:
+        The IDs of the created cohorts, in the order of specs.
+    """
+    specs = list(specs)
+    with_snapshot = [
+        spec for spec in specs if "case_ids" in spec or "packed_case_ids" in spec
+    ]
+    filter_ids = _allocate_ids(session, CohortFilter.id_seq, len(specs))
+    snapshot_ids = _allocate_ids(session, CohortSnapshot.id_seq, len(with_snapshot))
+
+    contexts, cohorts, cohort_filters, snapshots = {}, [], [], []
+    for spec, filter_id in zip(specs, filter_ids):
+        context_id = spec.get("context_id") or uuid.uuid4()
+        contexts[context_id] = {"id": context_id}
+        cohorts.append(
+            {
+                "id": spec.get("id") or uuid.uuid4(),
+                "name": spec["name"],
+                "context_id": context_id,
+            }
+        )
+        cohort_filters.append(
+            {
+                "id": filter_id,
+                "parent_id": None,
+                "cohort_id": cohorts[-1]["id"],
+                "filters": spec["filters"],
+                "cohort_type": spec.get("cohort_type", "static"),
+            }
+        )
+        if "case_ids" in spec or "packed_case_ids" in spec:
+            snapshots.append(
+                {
+                    "id": snapshot_ids[len(snapshots)],
+                    "filter_id": filter_id,
+                    "data_release": spec["data_release"],
+                    "case_ids": spec.get("case_ids"),
+                    "packed_case_ids": spec.get("packed_case_ids"),
+                }
+            )
+
+    statements = [
+        (
+            postgresql.insert(AnonymousContext.__table__).on_conflict_do_nothing(),
+            list(contexts.values()),
+        ),
+        (Cohort.__table__.insert(), cohorts),
+        (CohortFilter.__table__.insert(), cohort_filters),
+        (CohortSnapshot.__table__.insert(), snapshots),
+    ]
+    for stmt, rows in statements:
+        for start in range(0, len(rows), batch_size):
+            session.execute(stmt.values(rows[start : start + batch_size]))
+
+    return [row["id"] for row in cohorts]
+
+
+COMBINE_OPERATIONS = frozenset(["union", "intersection", "difference"])
+
+
+def combine(session, op, snapshot_ids, into=None, packed=False):
+    # type: (sqlalchemy.orm.Session, str, typing.Sequence[int], typing.Any, bool) -> typing.Any
+    """Combines the case sets of snapshots with set algebra in postgresql.
+
+    The case IDs of each snapshot are unnested (and decoded from the packed
+    format) server side, grouped and aggregated into a sorted array. With into
+    the result is inserted as a new record by an INSERT ... SELECT, so the case
+    IDs never enter python.
+
+    Args:
+        session: A database session.
+        op: One of union, intersection or difference. A difference is the
+            cases of the first snapshot that are in none of the others.
+        snapshot_ids: The IDs of the snapshots to combine. Compressed packed
+            snapshots are not supported.
+        into: An optional transient CohortSnapshot or EntitySet used as a
+            template for the new record: its attributes other than the case
+            IDs are inserted as they are. It is not added to the session. A
+            frozen EntitySet is created by EntitySet.freeze instead, with the
+            ID and entity type of the template, so that it gets its content
+            hash and JSON payload.
+        packed: Whether a CohortSnapshot result is stored in the packed format.
+
+    Returns:
+        The sorted case IDs of the result, or the primary key of the inserted
+        record when into is given. For a frozen EntitySet, that is the ID of
+        an existing set with the same content if there is one.
+
+    Raises:
+        ValueError: If the operation is unsupported, or a snapshot does not
+            exist or is compressed.
+    """
+    if op not in COMBINE_OPERATIONS:
+        raise ValueError("unsupported set operation: {}".format(op))
+    snapshot_ids = list(snapshot_ids)
+    if not snapshot_ids:
+        raise ValueError("no snapshots to combine")
+
+    codecs = dict(
+        session.query(
+            CohortSnapshot.id,
+            sqlalchemy.func.get_byte(CohortSnapshot.packed_case_ids, 0),
+        ).filter(CohortSnapshot.id.in_(snapshot_ids))
+    )
+    missing = set(snapshot_ids) - set(codecs)
+    if missing:
+        raise ValueError("snapshots do not exist: {}".format(sorted(missing)))
+    compressed = [
+        i for i, c in codecs.items() if c not in (None, packed_ids.COMPRESSION_NONE)
+    ]
+    if compressed:
+        raise ValueError(
+            "compressed snapshots cannot be combined: {}".format(sorted(compressed))
+        )
+
+    case_ids = (
+        sqlalchemy.text(_SNAPSHOT_CASE_IDS)
+        .bindparams(snapshot_ids=snapshot_ids)
+        .columns(
+            snapshot_id=sqlalchemy.BigInteger,
+            case_id=postgresql.UUID(as_uuid=True),
+        )
+        .alias("case_ids")
+    )
+    result = sqlalchemy.select([case_ids.c.case_id]).group_by(case_ids.c.case_id)
+    if op == "intersection":
+        result = result.having(
+            sqlalchemy.func.count(case_ids.c.snapshot_id.distinct())
+            == len(set(snapshot_ids))
+        )
+    elif op == "difference":
+        first = snapshot_ids[0]
+        result = result.having(
+            sqlalchemy.func.bool_and(case_ids.c.snapshot_id == first)
+            if first not in snapshot_ids[1:]
+            else sqlalchemy.false()
+        )
+    result = result.alias("result")
+
+    if into is None or (
+        isinstance(into, entity_set.EntitySet)
+        and into.type == entity_set.SetType.frozen
+    ):
+        combined = [
+            row.case_id
+            for row in session.execute(
+                sqlalchemy.select([result.c.case_id]).order_by(result.c.case_id)
+            )
+        ]
+        if into is None:
+            return combined
+        # frozen sets are hashed and rendered in python, see freeze
+        frozen_set, _ = entity_set.EntitySet.freeze(
+            session,
+            into.entity_type,
+            [str(case_id) for case_id in combined],
+            set_id=into.id,
+        )
+        return frozen_set.id
+
+    table = sqlalchemy.inspect(into).mapper.local_table
+    if table.name == CohortSnapshot.__tablename__ and packed:
+        ids_column = table.c.packed_case_ids
+        aggregate = _packed_aggregate(result.c.case_id)
+    else:
+        ids_column = table.c[_COMBINE_TARGETS[table.name]]
+        aggregate = sqlalchemy.func.coalesce(
+            sqlalchemy.func.array_agg(
+                postgresql.aggregate_order_by(
+                    sqlalchemy.cast(result.c.case_id, ids_column.type.item_type),
+                    result.c.case_id,
+                )
+            ),
+            sqlalchemy.cast(postgresql.array([]), ids_column.type),
+        )
+
+    columns = [aggregate.label(ids_column.name)]
+    for column in table.c:
+        value = getattr(into, column.key, None)
+        if column is not ids_column and value is not None:
+            columns.append(sqlalchemy.literal(value, column.type).label(column.name))
+
+    insert = (
+        table.insert()
+        .from_select([c.name for c in columns], sqlalchemy.select(columns))
+        .returning(*table.primary_key.columns)
+    )
+    return session.execute(insert).scalar()
+
+
+# the record column receiving combined case IDs, keyed by table name
+_COMBINE_TARGETS = {"cohort_snapshot": "case_ids", "entity_set": "entity_ids"}
+
+
+def _packed_aggregate(case_id):
+    # type: (sqlalchemy.sql.ColumnElement) -> sqlalchemy.sql.ColumnElement
+    """Aggregates sorted UUIDs into the uncompressed packed format."""
+    header = sqlalchemy.func.decode(
+        "{:02x}".format(packed_ids.COMPRESSION_NONE), "hex"
+    ).op("||")(
+        sqlalchemy.func.int4send(
+            sqlalchemy.cast(sqlalchemy.func.count(), sqlalchemy.Integer)
+        )
+    )
+    payload = sqlalchemy.func.decode(
+        sqlalchemy.func.coalesce(
+            sqlalchemy.func.string_agg(
+                sqlalchemy.func.replace(
+                    sqlalchemy.cast(case_id, sqlalchemy.Text), "-", ""
+                ),
+                postgresql.aggregate_order_by(sqlalchemy.literal(""), case_id),
+            ),
+            "",
+        ),
+        "hex",
+    )
+    return sqlalchemy.type_coerce(header.op("||")(payload), postgresql.BYTEA)
+
+
+def _allocate_ids(session, sequence, count):
+    # type: (sqlalchemy.orm.Session, sqlalchemy.Sequence, int) -> list[int]
+    """Draws count values from a sequence in a single round trip."""
+    if not count:
+        return []
+    query = sqlalchemy.select([sequence.next_value()]).select_from(
+        sqlalchemy.func.generate_series(1, count)
+    )
+    return [row[0] for row in session.execute(query)]
+
+
+def _sorted_raw_case_ids(snapshot):
+    # type: (CohortSnapshot) -> typing.Iterable[bytes]
+    """Returns the sorted, unique case IDs of a snapshot as 16 byte values."""
+    if snapshot.is_packed:
+        return snapshot.get_case_ids().iter_raw()
+    return sorted({case_id.bytes for case_id in snapshot.case_ids})
+
+
+def _merge_diff(old, new, include_ids):
+    # type: (typing.Iterable[bytes], typing.Iterable[bytes], bool) -> SnapshotDiff
+    """Diffs two sorted, unique sequences of 16 byte case IDs in one pass."""
+    added, removed = [], []
+    added_count = removed_count = unchanged = 0
+    old, new = iter(old), iter(new)
+    old_id, new_id = next(old, None), next(new, None)
+
+    while old_id is not None or new_id is not None:
+        if new_id is None or (old_id is not None and old_id < new_id):
+            removed_count += 1
+            if include_ids:
+                removed.append(uuid.UUID(bytes=old_id))
+            old_id = next(old, None)
+        elif old_id is None or new_id < old_id:
+            added_count += 1
+            if include_ids:
+                added.append(uuid.UUID(bytes=new_id))
+            new_id = next(new, None)
+        else:
+            unchanged += 1
+            old_id, new_id = next(old, None), next(new, None)
+
+    return SnapshotDiff(
+        added_count,
+        removed_count,
+        unchanged,
+        added if include_ids else None,
+        removed if include_ids else None,
+    )
+
+
+class _JsonStrings:
+    """Marks an iterable of strings to be streamed as a JSON array."""
+
+    def __init__(self, strings):
+        self.strings = strings
+
+
+def _iter_json_object(items, chunk_size):
+    # type: (typing.Iterable[tuple[str, typing.Any]], int) -> typing.Iterator[bytes]
+    """Serializes key/value pairs as a JSON object in chunks of bytes.
+
+    Values are serialized with json.dumps, except for _JsonStrings, which are
+    written one string at a time so that only the current chunk is held.
+    """
+    buffer = bytearray(b"{")
+    for index, (key, value) in enumerate(items):
+        if index:
+            buffer += b","
+        buffer += json.dumps(key).encode("utf-8") + b":"
+        if not isinstance(value, _JsonStrings):
+            buffer += json.dumps(value).encode("utf-8")
+            continue
+
+        buffer += b"["
+        for position, string in enumerate(value.strings):
+            if position:
+                buffer += b","
+            buffer += json.dumps(string).encode("utf-8")
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += b"]"
+    buffer += b"}"
+    yield bytes(buffer)
+
+
+def hash_filters(filters):
+    # type: (typing.Any) -> sqlalchemy.sql.ColumnElement
+    """Builds the SQL expression computing the content hash of a cohort filter.
+
+    The hash is the SHA-256 digest of the text of the filters as JSONB, which
+    postgresql normalizes (key order, whitespace), so that equal filters
+    always produce the same hash, and existing rows can be hashed in SQL. The
+    cohort_filter_filters_hash trigger computes the same expression.
+
+    Args:
+        filters: The filters defining a case set, or a JSONB expression.
+
+    Returns:
+        An expression evaluating to the hex encoded digest of the filters.
+    """
+    if not isinstance(filters, sqlalchemy.sql.ClauseElement):
+        filters = sqlalchemy.cast(filters, postgresql.JSONB)
+    return sqlalchemy.func.encode(
+        sqlalchemy.func.sha256(
+            sqlalchemy.func.convert_to(
+                sqlalchemy.cast(filters, sqlalchemy.Text), "UTF8"
+            )
+        ),
+        "hex",
+    )
+
+
+# keeps the content hash of full revisions up to date, including for writes
+# that bypass the ORM; patch revisions keep the hash of their full content
+sqlalchemy.event.listen(
+    CohortFilter.__table__,
+    "after_create",
+    sqlalchemy.DDL(
+        """
+        CREATE OR REPLACE FUNCTION cohort_filter_filters_hash() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.filters_format = 'full' THEN
+                NEW.filters_hash := encode(
+                    sha256(convert_to(NEW.filters::text, 'UTF8')), 'hex'
+                );
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER cohort_filter_filters_hash
+        BEFORE INSERT OR UPDATE OF filters, filters_format ON cohort_filter
+        FOR EACH ROW EXECUTE PROCEDURE cohort_filter_filters_hash();
+        """
+    ).execute_if(dialect="postgresql"),
+)
+sqlalchemy.event.listen(
+    CohortFilter.__table__,
+    "after_drop",
+    sqlalchemy.DDL("DROP FUNCTION IF EXISTS cohort_filter_filters_hash()").execute_if(
+        dialect="postgresql"
+    ),
+)
+
+# establishes a one-to-one relationship with the latest CohortFilter of a cohort,
+# served by the cohort_filter_cohort_id_idx index regardless of history length
+_latest_filter = CohortFilter.__table__.alias("latest_filter")
+Cohort.current_filter = sqlalchemy.orm.relationship(
+    CohortFilter,
+    primaryjoin=sqlalchemy.and_(
+        Cohort.id == CohortFilter.cohort_id,
+        CohortFilter.id
+        == sqlalchemy.select([sqlalchemy.func.max(_latest_filter.c.id)])
+        .where(_latest_filter.c.cohort_id == CohortFilter.cohort_id)
+        .as_scalar(),
+    ),
+    uselist=False,
+    viewonly=True,
+)
+
+
+# decodes the case IDs of uncompressed packed snapshots (see the packed_ids
+# module), NULL for compressed ones; immutable, so that it can be indexed
+sqlalchemy.event.listen(
+    CohortSnapshot.__table__,
+    "before_create",
+    sqlalchemy.DDL(
+        """
+        CREATE OR REPLACE FUNCTION cohort_snapshot_packed_case_ids(packed bytea)
+        RETURNS uuid[] AS $$
+            SELECT CASE WHEN get_byte(packed, 0) = {codec} THEN ARRAY(
+                SELECT CAST(encode(
+                    substring(packed FROM {offset} + {size} * i FOR {size}), 'hex'
+                ) AS uuid)
+                FROM generate_series(0, (length(packed) - {header}) / {size} - 1) AS i
+                ORDER BY i
+            ) END
+        $$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+        """.format(
+            offset=packed_ids.HEADER.size + 1,
+            header=packed_ids.HEADER.size,
+            size=packed_ids.ID_SIZE,
+            codec=packed_ids.COMPRESSION_NONE,
+        )
+    ).execute_if(dialect="postgresql"),
+)
+sqlalchemy.event.listen(
+    CohortSnapshot.__table__,
+    "after_drop",
+    sqlalchemy.DDL(
+        "DROP FUNCTION IF EXISTS cohort_snapshot_packed_case_ids(bytea)"
+    ).execute_if(dialect="postgresql"),
+)
+
+# keeps case_count in sync for every write, including the bulk inserts and
+# INSERT ... SELECT statements that bypass the ORM; the count of a packed
+# snapshot is read from its header (see the packed_ids module)
+sqlalchemy.event.listen(
+    CohortSnapshot.__table__,
+    "after_create",
+    sqlalchemy.DDL(
+        """
+        CREATE OR REPLACE FUNCTION cohort_snapshot_case_count() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.packed_case_ids IS NOT NULL THEN
+                NEW.case_count := (get_byte(NEW.packed_case_ids, 1) << 24)
+                    | (get_byte(NEW.packed_case_ids, 2) << 16)
+                    | (get_byte(NEW.packed_case_ids, 3) << 8)
+                    | get_byte(NEW.packed_case_ids, 4);
+            ELSE
+                NEW.case_count := coalesce(cardinality(NEW.case_ids), 0);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER cohort_snapshot_case_count
+        BEFORE INSERT OR UPDATE OF case_ids, packed_case_ids ON cohort_snapshot
+        FOR EACH ROW EXECUTE PROCEDURE cohort_snapshot_case_count();
+        """
+    ).execute_if(dialect="postgresql"),
+)
+sqlalchemy.event.listen(
+    CohortSnapshot.__table__,
+    "after_drop",
+    sqlalchemy.DDL("DROP FUNCTION IF EXISTS cohort_snapshot_case_count()").execute_if(
+        dialect="postgresql"
+    ),
+)
@@ -17,15 +17,33 @@ Sets can be discussed in this context
 * Mutable Set: a set that needs to be persistent but can also be updated. 
   This is initially targeted to not be an external feature but only used
   by the cohort service in the backend system.
+
+Entity ids are stored inline in the entity_ids array by default. Very large
+sets can instead be chunked: their ids are kept sorted in entity_set_chunk rows
+of up to CHUNK_SIZE ids each, every chunk covering a disjoint range of ids, so
+that a lookup decodes a single chunk and changes only rewrite the chunks whose
+range covers the changed ids. Chunks overflowing CHUNK_SIZE are split in two.
 """
 
+import bisect
+import collections
+import csv
+import datetime
 import enum
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import uuid
+import zlib
 
 import sqlalchemy
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext import declarative
 
 from gdc_ng_models.models import accessed, audit
+from gdc_ng_models.utils import packed_ids
 
 
 @enum.unique
@@ -45,6 +63,173 @@ class EntityType(enum.Enum):
 
 Base = declarative.declarative_base()
 
+CHUNK_SIZE = 10000
+
+# chunk payload encodings: sorted UUIDs in the packed_ids format, or sorted
+# newline separated ids compressed with zlib for any other kind of id
+CHUNK_ENCODING_UUID = "uuid"
+CHUNK_ENCODING_TEXT = "text"
+
+CopyResult = collections.namedtuple("CopyResult", ["inserted", "updated", "skipped"])
+
+# gzipped payloads are told apart by their magic number, which no JSON
+# document starts with
+GZIP_MAGIC = b"\x1f\x8b"
+
+COPY_COLUMNS = ("id", "type", "entity_type", "entity_ids")
+
+# the values render_json_payload needs, in the order copy_in reads them
+_PAYLOAD_COLUMNS = (
+    "id",
+    "type",
+    "entity_type",
+    "entity_ids",
+    "created_datetime",
+    "updated_datetime",
+)
+
+# Upserts the staged sets, the last row winning for repeated IDs. Frozen sets
+# are immutable and are left as they are. New frozen sets get the content hash
+# staged for them, unless another frozen set already has the same content, in
+# which case they are kept as a duplicate without a hash (see freeze). Whether
+# a row was inserted or updated is told apart by xmax, which is 0 for freshly
+# inserted rows.
+_COPY_UPSERT = """
+    INSERT INTO entity_set (
+        id, type, entity_type, entity_ids, content_hash, json_payload,
+        created_datetime, updated_datetime
+    )
+    SELECT id, type, entity_type, entity_ids,
+        CASE
+            WHEN row_number() OVER (
+                PARTITION BY entity_type, content_hash ORDER BY id
+            ) = 1
+            AND NOT EXISTS (
+                SELECT 1 FROM entity_set e
+                WHERE e.type = 'frozen'
+                    AND e.entity_type = s.entity_type
+                    AND e.content_hash = s.content_hash
+                    AND e.id <> s.id
+            )
+            THEN content_hash
+        END,
+        json_payload, %(now)s, %(now)s
+    FROM (
+        SELECT DISTINCT ON (id) *
+        FROM entity_set_copy
+        ORDER BY id, position DESC
+    ) AS s
+    ON CONFLICT (id) DO UPDATE
+    SET type = EXCLUDED.type,
+        entity_type = EXCLUDED.entity_type,
+        entity_ids = EXCLUDED.entity_ids,
+        chunked = false,
+        content_hash = EXCLUDED.content_hash,
+        json_payload = NULL,
+        updated_datetime = now()
+    WHERE entity_set.type <> 'frozen'
+    RETURNING id, xmax = 0 AS inserted, type = 'frozen' AS frozen
+"""
+
+# Adds the ids not yet in an inline set, in their given order, returning the
+# number of ids added. The set has to be locked beforehand for the count to be
+# accurate. Ids are filtered with an anti-join, hashing the current ids once,
+# rather than comparing each new id to the whole array.
+_INLINE_ADD_IDS = sqlalchemy.text(
+    """
+    WITH current AS (
+        SELECT entity_count FROM entity_set WHERE id = :set_id
+    )
+    UPDATE entity_set
+    SET entity_ids = entity_ids || ARRAY(
+            SELECT u.entity_id
+            FROM unnest(CAST(:entity_ids AS varchar[]))
+                 WITH ORDINALITY AS u(entity_id, ordinality)
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM unnest(entity_set.entity_ids) AS e(entity_id)
+                WHERE e.entity_id = u.entity_id
+            )
+            ORDER BY u.ordinality
+        ),
+        updated_datetime = now()
+    WHERE id = :set_id
+    RETURNING entity_count - (SELECT entity_count FROM current)
+    """
+)
+
+# Removes ids from an inline set, keeping the order of the others, returning
+# the number of ids removed (given the set is locked, as above).
+_INLINE_REMOVE_IDS = sqlalchemy.text(
+    """
+    WITH current AS (
+        SELECT entity_count FROM entity_set WHERE id = :set_id
+    )
+    UPDATE entity_set
+    SET entity_ids = ARRAY(
+            SELECT u.entity_id
+            FROM unnest(entity_set.entity_ids)
+                 WITH ORDINALITY AS u(entity_id, ordinality)
+            WHERE NOT EXISTS (
+                SELECT 1
+                FROM unnest(CAST(:entity_ids AS varchar[])) AS r(entity_id)
+                WHERE r.entity_id = u.entity_id
+            )
+            ORDER BY u.ordinality
+        ),
+        updated_datetime = now()
+    WHERE id = :set_id
+    RETURNING (SELECT entity_count FROM current) - entity_count
+    """
+)
+
+# The (entity_id, set_id) pairs of inline sets of an entity type holding any of
+# the given ids, one GIN index lookup per id.
+_INLINE_MEMBERSHIP = sqlalchemy.text(
+    """
+    SELECT u.entity_id, e.id AS set_id
+    FROM unnest(CAST(:entity_ids AS varchar[])) AS u(entity_id)
+    JOIN entity_set e ON e.entity_ids @> ARRAY[u.entity_id]
+    WHERE e.entity_type = CAST(:entity_type AS entity_type)
+    """
+)
+
+# The chunks of chunked sets of an entity type that may hold any of the given
+# ids, along with those ids. Chunks cover disjoint id ranges, so for each id and
+# set only the chunk with the largest min_id not above the id is looked up, with
+# the entity_set_chunk_min_id_idx index; it is kept if its range includes the id
+# and, for packed UUIDs, a byte search of its payload finds the id. The result
+# still has to be checked by decoding the chunk.
+_CHUNKED_MEMBERSHIP = sqlalchemy.text(
+    """
+    WITH candidates AS (
+        SELECT c.set_id, c.chunk_index, array_agg(u.entity_id) AS entity_ids
+        FROM entity_set e
+        CROSS JOIN unnest(CAST(:entity_ids AS text[])) AS u(entity_id)
+        CROSS JOIN LATERAL (
+            SELECT c.set_id, c.chunk_index, c.encoding, c.max_id, c.data
+            FROM entity_set_chunk c
+            WHERE c.set_id = e.id AND c.min_id <= u.entity_id COLLATE "C"
+            ORDER BY c.min_id DESC
+            LIMIT 1
+        ) AS c
+        WHERE e.chunked
+            AND e.entity_type = CAST(:entity_type AS entity_type)
+            AND u.entity_id COLLATE "C" <= c.max_id
+            AND CASE
+                WHEN c.encoding <> :uuid_encoding THEN true
+                WHEN u.entity_id ~ '^[0-9a-f]{8}-([0-9a-f]{4}-){3}[0-9a-f]{12}$' THEN
+                    position(decode(replace(u.entity_id, '-', ''), 'hex') IN c.data) > 0
+                ELSE false
+            END
+        GROUP BY c.set_id, c.chunk_index
+    )
+    SELECT c.set_id, c.encoding, c.data, candidates.entity_ids
+    FROM candidates
+    JOIN entity_set_chunk c USING (set_id, chunk_index)
+    """
+).columns(entity_ids=postgresql.ARRAY(sqlalchemy.Text))
+
 
 class EntitySet(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
     """A base definition for the entity_set.
@@ -54,13 +239,40 @@ class EntitySet(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
        type: ephmeral, frozen, mutable
        entity_type: case, file, gene, ssm used to route to the indices in elasticsearch
          e.g., gdc_case_set, gdc_file_set, gdc_gene_set, gdc_ssm_set
-       entity_ids: array of node UUIDs of entity_type
+       entity_ids: array of node UUIDs of entity_type, None for chunked sets
+       chunked: whether the entity ids are stored in entity_set_chunk rows
+       content_hash: hash of the entity type and ids of a frozen set, see freeze
+       json_payload: pre-rendered JSON of a frozen set, see to_json_bytes
+       entity_count: number of entity_ids, maintained by a trigger on write
        created_datetime: The date and time when the record is created.
        updated_datetime: The date and time when the record is last updated.
        accessed_datetime: The date and time when the record is last accessed.
     """
 
     __tablename__ = "entity_set"
+    __table_args__ = (
+        sqlalchemy.Index(
+            "entity_set_type_accessed_datetime_idx", "type", "accessed_datetime"
+        ),
+        sqlalchemy.CheckConstraint(
+            "(entity_ids IS NULL) = chunked", name="entity_set_entity_ids_storage_check"
+        ),
+        sqlalchemy.Index(
+            "entity_set_entity_ids_idx", "entity_ids", postgresql_using="gin"
+        ),
+        sqlalchemy.Index(
+            "entity_set_frozen_content_hash_idx",
+            "entity_type",
+            "content_hash",
+            unique=True,
+            postgresql_where=sqlalchemy.text("type = 'frozen'"),
+        ),
+        sqlalchemy.Index(
+            "entity_set_chunked_entity_type_idx",
+            "entity_type",
+            postgresql_where=sqlalchemy.text("chunked"),
+        ),
+    )
 
     # Requirement: custom IDs
     # Requirement: support sha256 outputlength (64hex characters) and longest id as identified by the front end.
@@ -80,7 +292,627 @@ class EntitySet(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
 
     # entity_ids are UUIDs that are 36 characters long.
     #  However, postgres does not use lengths in its arrays
-    entity_ids = sqlalchemy.Column(postgresql.ARRAY(sqlalchemy.String), nullable=False)
+    entity_ids = sqlalchemy.Column(postgresql.ARRAY(sqlalchemy.String))
+    chunked = sqlalchemy.Column(
+        sqlalchemy.Boolean,
+        nullable=False,
+        default=False,
+        server_default=sqlalchemy.false(),
+    )
+    entity_count = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        nullable=False,
+        server_default=sqlalchemy.schema.FetchedValue(),
+        server_onupdate=sqlalchemy.schema.FetchedValue(),
+    )
+
+    content_hash = sqlalchemy.Column(sqlalchemy.String(64))
+    json_payload = sqlalchemy.orm.deferred(sqlalchemy.Column(postgresql.BYTEA))
+
+    # establishes a one-to-many relationship with EntitySetChunk
+    chunks = sqlalchemy.orm.relationship(
+        "EntitySetChunk",
+        order_by="EntitySetChunk.min_id",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    @classmethod
+    def create_chunked(
+        cls, session, id, type, entity_type, entity_ids=(), chunk_size=CHUNK_SIZE
+    ):
+        # type: (sqlalchemy.orm.Session, str, SetType, EntityType, typing.Iterable[str], int) -> EntitySet
+        """Creates a set storing its entity ids in chunks.
+
+        Args:
+            session: A database session.
+            id: The ID of the set.
+            type: The set type.
+            entity_type: The type of the entities.
+            entity_ids: The initial entity ids.
+            chunk_size: The maximum number of ids per chunk.
+
+        Returns:
+            The new set, flushed.
+        """
+        entity_set = cls(id=id, type=type, entity_type=entity_type, chunked=True)
+        session.add(entity_set)
+        session.flush()
+        entity_set.append_ids(session, entity_ids, chunk_size=chunk_size)
+        return entity_set
+
+    def append_ids(self, session, entity_ids, chunk_size=CHUNK_SIZE):
+        # type: (sqlalchemy.orm.Session, typing.Iterable[str], int) -> int
+        """Appends entity ids to the set.
+
+        Chunked sets merge the ids into the chunks whose range covers them,
+        skipping the ids they already hold, and split chunks growing beyond
+        chunk_size; none of the other chunks are read or rewritten. Inline
+        sets are concatenated server side; duplicates within entity_ids are
+        skipped, but ids already in an inline set are not checked (see
+        add_ids).
+
+        Args:
+            session: A database session.
+            entity_ids: The ids to append.
+            chunk_size: The maximum number of ids per chunk.
+
+        Returns:
+            The number of ids appended.
+        """
+        entity_ids = list(dict.fromkeys(entity_ids))
+        if not entity_ids:
+            return 0
+
+        table = EntitySet.__table__
+        if not self.chunked:
+            session.execute(
+                table.update()
+                .where(table.c.id == self.id)
+                .values(
+                    entity_ids=table.c.entity_ids.op("||")(
+                        sqlalchemy.cast(entity_ids, table.c.entity_ids.type)
+                    )
+                )
+            )
+            session.expire(self, ["entity_ids", "entity_count", "updated_datetime"])
+            return len(entity_ids)
+
+        self._lock(session)
+        chunks = EntitySetChunk.__table__
+        bounds = _chunk_bounds(session, self.id)
+        next_index = max((b.chunk_index for b in bounds), default=-1) + 1
+        if not bounds:
+            pieces = _split_sorted(sorted(entity_ids), chunk_size, fill=True)
+            session.execute(
+                chunks.insert(),
+                [
+                    dict(_encode_chunk(piece), set_id=self.id, chunk_index=index)
+                    for index, piece in enumerate(pieces)
+                ],
+            )
+            appended = len(entity_ids)
+        else:
+            appended = 0
+            targets = _group_by_chunk(bounds, entity_ids, extend=True)
+            for row in _load_chunks(session, self.id, targets):
+                current = list(_decode_chunk(row.encoding, row.data))
+                merged = sorted(set(current).union(targets[row.chunk_index]))
+                appended += len(merged) - len(current)
+                if len(merged) == len(current):
+                    continue
+                first, *rest = _split_sorted(merged, chunk_size)
+                session.execute(
+                    chunks.update()
+                    .where(chunks.c.set_id == self.id)
+                    .where(chunks.c.chunk_index == row.chunk_index)
+                    .values(_encode_chunk(first))
+                )
+                if rest:
+                    session.execute(
+                        chunks.insert(),
+                        [
+                            dict(
+                                _encode_chunk(piece),
+                                set_id=self.id,
+                                chunk_index=next_index + offset,
+                            )
+                            for offset, piece in enumerate(rest)
+                        ],
+                    )
+                    next_index += len(rest)
+
+        session.execute(
+            table.update()
+            .where(table.c.id == self.id)
+            .values(entity_count=table.c.entity_count + appended)
+        )
+        session.expire(self, ["chunks", "entity_count", "updated_datetime"])
+        return appended
+
+    @classmethod
+    def freeze(
+        cls, session, entity_type, entity_ids, set_id=None, compress_payload=False
+    ):
+        # type: (sqlalchemy.orm.Session, EntityType, typing.Iterable[str], str, bool) -> tuple
+        """Creates a frozen set, unless one with the same content exists.
+
+        Frozen sets are identified by a content hash of their entity type and
+        sorted, de-duplicated ids (see hash_content), which is unique among
+        frozen sets. The ids are stored sorted and de-duplicated, and the JSON
+        payload served by to_json_bytes is rendered once, here.
+
+        Args:
+            session: A database session.
+            entity_type: The type of the entities.
+            entity_ids: The ids of the set.
+            set_id: The ID for a new set, defaults to the content hash.
+            compress_payload: Whether to store the JSON payload gzipped.
+
+        Returns:
+            A (set, created) tuple, where created indicates a new set. When
+            created is False, the set has the same content but may have a
+            different ID than requested.
+
+        Raises:
+            ValueError: If set_id is taken by a set with different content.
+        """
+        entity_ids = sorted(set(entity_ids))
+        content_hash = hash_content(entity_type, entity_ids)
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        values = dict(
+            id=set_id or content_hash,
+            type=SetType.frozen,
+            entity_type=entity_type,
+            entity_ids=entity_ids,
+            content_hash=content_hash,
+            created_datetime=now,
+            updated_datetime=now,
+        )
+        values["json_payload"] = render_json_payload(values, compress_payload)
+
+        table = cls.__table__
+        inserted = session.execute(
+            postgresql.insert(table)
+            .values(values)
+            .on_conflict_do_nothing()
+            .returning(table.c.id)
+        ).scalar()
+        if inserted is not None:
+            return session.query(cls).get(inserted), True
+
+        existing = (
+            session.query(cls)
+            .filter(
+                cls.type == SetType.frozen,
+                cls.entity_type == entity_type,
+                cls.content_hash == content_hash,
+            )
+            .one_or_none()
+        )
+        if existing is None:
+            raise ValueError("entity set {} already exists".format(set_id))
+        return existing, False
+
+    @classmethod
+    def sets_containing(cls, session, entity_type, entity_id):
+        # type: (sqlalchemy.orm.Session, EntityType, str) -> list[EntitySet]
+        """Finds the sets of an entity type containing an entity id.
+
+        See sets_containing_any.
+
+        Returns:
+            The matching sets ordered by ID, with their entity ids deferred.
+        """
+        set_ids = cls.sets_containing_any(session, entity_type, [entity_id])
+        if not set_ids.get(entity_id):
+            return []
+        return (
+            session.query(cls)
+            .options(sqlalchemy.orm.defer(cls.entity_ids))
+            .filter(cls.id.in_(set_ids[entity_id]))
+            .order_by(cls.id)
+            .all()
+        )
+
+    @classmethod
+    def sets_containing_any(cls, session, entity_type, entity_ids):
+        # type: (sqlalchemy.orm.Session, EntityType, typing.Iterable[str]) -> dict
+        """Finds the sets of an entity type containing any of the entity ids.
+
+        Inline sets are matched with the array containment operator, served
+        by the entity_set_entity_ids_idx GIN index. Chunked sets, found with
+        the entity_set_chunked_entity_type_idx index, look up the one chunk
+        whose range may include each id (narrowed down further by a byte
+        search for packed UUIDs), then confirm the ids by decoding it.
+
+        Args:
+            session: A database session.
+            entity_type: The type of the entities.
+            entity_ids: The entity ids to look up.
+
+        Returns:
+            A mapping of each entity id found to the sorted IDs of the sets
+            containing it.
+        """
+        entity_ids = list(set(entity_ids))
+        if not entity_ids:
+            return {}
+        params = {
+            "entity_ids": entity_ids,
+            "entity_type": entity_type.name,
+            "uuid_encoding": CHUNK_ENCODING_UUID,
+        }
+
+        found = collections.defaultdict(set)
+        for row in session.execute(_INLINE_MEMBERSHIP, params):
+            found[row.entity_id].add(row.set_id)
+        for row in session.execute(_CHUNKED_MEMBERSHIP, params):
+            if row.encoding == CHUNK_ENCODING_UUID:
+                packed = packed_ids.PackedIds(row.data)
+                matches = [i for i in row.entity_ids if i in packed]
+            else:
+                decoded = set(_decode_chunk(row.encoding, row.data))
+                matches = [i for i in row.entity_ids if i in decoded]
+            for entity_id in matches:
+                found[entity_id].add(row.set_id)
+        return {entity_id: sorted(set_ids) for entity_id, set_ids in found.items()}
+
+    def add_ids(self, session, entity_ids, chunk_size=CHUNK_SIZE):
+        # type: (sqlalchemy.orm.Session, typing.Iterable[str], int) -> int
+        """Adds the entity ids that are not in the set yet.
+
+        The current ids are never loaded into python: inline sets are updated
+        with a single server side statement, and chunked sets only decode the
+        chunks whose range covers one of the ids (see append_ids).
+
+        Args:
+            session: A database session.
+            entity_ids: The ids to add.
+            chunk_size: The maximum number of ids per new chunk.
+
+        Returns:
+            The number of ids added.
+
+        Raises:
+            ValueError: If the set is frozen.
+        """
+        self._check_mutable()
+        entity_ids = list(dict.fromkeys(entity_ids))
+        if not entity_ids:
+            return 0
+
+        if self.chunked:
+            return self.append_ids(session, entity_ids, chunk_size=chunk_size)
+
+        self._lock(session)
+        added = session.execute(
+            _INLINE_ADD_IDS, {"set_id": self.id, "entity_ids": entity_ids}
+        ).scalar()
+        session.expire(self, ["entity_ids", "entity_count", "updated_datetime"])
+        return added
+
+    def remove_ids(self, session, entity_ids):
+        # type: (sqlalchemy.orm.Session, typing.Iterable[str]) -> int
+        """Removes entity ids from the set.
+
+        Inline sets are updated with a single server side statement. Chunked
+        sets only rewrite the chunks whose range covers one of the ids, and
+        delete the chunks left empty.
+
+        Args:
+            session: A database session.
+            entity_ids: The ids to remove. Ids not in the set are ignored.
+
+        Returns:
+            The number of ids removed.
+
+        Raises:
+            ValueError: If the set is frozen.
+        """
+        self._check_mutable()
+        entity_ids = list(dict.fromkeys(entity_ids))
+        if not entity_ids:
+            return 0
+
+        table = EntitySet.__table__
+        self._lock(session)
+        if not self.chunked:
+            removed = session.execute(
+                _INLINE_REMOVE_IDS, {"set_id": self.id, "entity_ids": entity_ids}
+            ).scalar()
+            session.expire(self, ["entity_ids", "entity_count", "updated_datetime"])
+            return removed
+
+        chunks = EntitySetChunk.__table__
+        targets = _group_by_chunk(_chunk_bounds(session, self.id), entity_ids)
+        removed = 0
+        for row in _load_chunks(session, self.id, targets):
+            current = list(_decode_chunk(row.encoding, row.data))
+            found = set(targets[row.chunk_index])
+            remaining = [entity_id for entity_id in current if entity_id not in found]
+            if len(remaining) == len(current):
+                continue
+            chunk = (chunks.c.set_id == self.id) & (
+                chunks.c.chunk_index == row.chunk_index
+            )
+            if remaining:
+                session.execute(
+                    chunks.update().where(chunk).values(_encode_chunk(remaining))
+                )
+            else:
+                session.execute(chunks.delete().where(chunk))
+            removed += len(current) - len(remaining)
+
+        if removed:
+            session.execute(
+                table.update()
+                .where(table.c.id == self.id)
+                .values(entity_count=table.c.entity_count - removed)
+            )
+            session.expire(self, ["chunks", "entity_count", "updated_datetime"])
+        return removed
+
+    def _lock(self, session):
+        """Serializes changes to the set until the end of the transaction."""
+        table = EntitySet.__table__
+        session.execute(
+            sqlalchemy.select([table.c.id])
+            .where(table.c.id == self.id)
+            .with_for_update()
+        )
+
+    def _check_mutable(self):
+        if self.type == SetType.frozen:
+            raise ValueError("frozen set {} cannot be changed".format(self.id))
+
+    def contains_id(self, session, entity_id):
+        # type: (sqlalchemy.orm.Session, str) -> bool
+        """Checks whether an entity id is in the set.
+
+        Inline sets use the array containment operator. Chunked sets find the
+        single chunk whose range may include the entity id with the
+        entity_set_chunk_min_id_idx index, and decode only that chunk.
+        """
+        table = EntitySet.__table__
+        if not self.chunked:
+            return session.execute(
+                sqlalchemy.select(
+                    [
+                        table.c.entity_ids.contains(
+                            sqlalchemy.cast([entity_id], table.c.entity_ids.type)
+                        )
+                    ]
+                ).where(table.c.id == self.id)
+            ).scalar()
+
+        chunks = EntitySetChunk.__table__
+        row = session.execute(
+            sqlalchemy.select([chunks.c.encoding, chunks.c.max_id, chunks.c.data])
+            .where(chunks.c.set_id == self.id)
+            .where(chunks.c.min_id <= entity_id)
+            .order_by(chunks.c.min_id.desc())
+            .limit(1)
+        ).first()
+        return (
+            row is not None
+            and entity_id <= row.max_id
+            and _chunk_contains(row.encoding, row.data, entity_id)
+        )
+
+    def iter_entity_ids(self, session=None, batch_size=10):
+        # type: (sqlalchemy.orm.Session, int) -> typing.Iterator[str]
+        """Iterates over the entity ids, in sorted order for chunked sets.
+
+        Args:
+            session: The database session to query with, defaults to the
+                session of the set.
+            batch_size: The number of chunks fetched per round trip.
+        """
+        if not self.chunked:
+            for entity_id in self.entity_ids:
+                yield entity_id
+            return
+
+        session = session or sqlalchemy.orm.object_session(self)
+        rows = (
+            session.query(EntitySetChunk.encoding, EntitySetChunk.data)
+            .filter(EntitySetChunk.set_id == self.id)
+            .order_by(EntitySetChunk.min_id)
+            .yield_per(batch_size)
+        )
+        for encoding, data in rows:
+            for entity_id in _decode_chunk(encoding, data):
+                yield entity_id
+
+    def get_entity_ids(self, session=None):
+        # type: (sqlalchemy.orm.Session) -> list[str]
+        """Returns the entity ids regardless of storage, see iter_entity_ids."""
+        if not self.chunked:
+            return self.entity_ids
+        return list(self.iter_entity_ids(session))
+
+    @classmethod
+    def copy_in(cls, connection, records, compress_payload=False):
+        # type: (sqlalchemy.engine.Connection, typing.Iterable[typing.Any], bool) -> CopyResult
+        """Upserts entity sets in bulk with COPY.
+
+        The records are streamed as CSV into a temporary staging table and
+        upserted from there with a single statement. Existing sets are
+        replaced, including chunked sets, which become inline sets; frozen
+        sets are immutable and skipped. Must be run in a transaction.
+
+        Frozen sets get their content hash and JSON payload like sets created
+        by freeze, both computed while streaming the records. A frozen set
+        with the same content as another one is still copied, but without a
+        content hash, so that freeze keeps finding the first one.
+
+        Args:
+            connection: A database connection or session.
+            records: Inline EntitySet instances or mappings with the id,
+                type, entity_type and entity_ids of each set. Types can be
+                given by enum member or name.
+            compress_payload: Whether to store the JSON payloads gzipped.
+
+        Returns:
+            The number of sets inserted, updated and skipped.
+
+        Raises:
+            ValueError: If a record is a chunked EntitySet instance.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cursor = _dbapi_connection(connection).cursor()
+        try:
+            cursor.execute(
+                "DROP TABLE IF EXISTS pg_temp.entity_set_copy;"
+                "CREATE TEMP TABLE entity_set_copy ("
+                "  position bigserial,"
+                "  id varchar(128) NOT NULL,"
+                "  type entity_set_type NOT NULL,"
+                "  entity_type entity_type NOT NULL,"
+                "  entity_ids varchar[] NOT NULL,"
+                "  content_hash varchar(64),"
+                "  json_payload bytea"
+                ") ON COMMIT DROP"
+            )
+            reader = _CsvReader(
+                _copy_row(record, now, compress_payload) for record in records
+            )
+            try:
+                cursor.copy_expert(
+                    "COPY entity_set_copy ({}) FROM STDIN WITH (FORMAT csv)".format(
+                        ", ".join(COPY_COLUMNS + ("content_hash", "json_payload"))
+                    ),
+                    reader,
+                )
+            except Exception:
+                if reader.error is None:
+                    raise
+                raise reader.error
+            cursor.execute("SELECT count(DISTINCT id) FROM entity_set_copy")
+            (staged,) = cursor.fetchone()
+            cursor.execute(_COPY_UPSERT, {"now": now})
+            upserted = cursor.fetchall()
+            # sets replaced by frozen ones keep their created_datetime, which
+            # their payload could not be rendered with while streaming
+            refrozen = [row[0] for row in upserted if row[2] and not row[1]]
+            if refrozen:
+                cursor.execute(
+                    "SELECT id, type, entity_type, entity_ids, created_datetime, "
+                    "updated_datetime FROM entity_set WHERE id = ANY(%s)",
+                    (refrozen,),
+                )
+                payloads = [
+                    (
+                        render_json_payload(
+                            dict(
+                                zip(_PAYLOAD_COLUMNS, row),
+                                type=SetType[row[1]],
+                                entity_type=EntityType[row[2]],
+                            ),
+                            compress_payload,
+                        ),
+                        row[0],
+                    )
+                    for row in cursor.fetchall()
+                ]
+                cursor.executemany(
+                    "UPDATE entity_set SET json_payload = %s WHERE id = %s", payloads
+                )
+            cursor.execute(
+                "DELETE FROM entity_set_chunk c USING entity_set_copy s "
+                "WHERE c.set_id = s.id "
+                "AND NOT (SELECT chunked FROM entity_set WHERE id = s.id)"
+            )
+            cursor.execute("DROP TABLE entity_set_copy")
+        finally:
+            cursor.close()
+
+        inserted = sum(1 for row in upserted if row[1])
+        return CopyResult(inserted, len(upserted) - inserted, staged - len(upserted))
+
+    @classmethod
+    def copy_out(cls, connection, file, *criteria):
+        # type: (sqlalchemy.engine.Connection, typing.IO, sqlalchemy.sql.ClauseElement) -> int
+        """Writes entity sets in bulk with COPY.
+
+        The sets are streamed as CSV rows of id, type, entity_type and
+        entity_ids (a postgresql array literal), which read_copy parses.
+        Inline sets are copied by the server; chunked sets follow them, their
+        chunks decoded and written one set at a time.
+
+        Args:
+            connection: A database connection or session.
+            file: A text or binary file to write to.
+            criteria: SQL criteria restricting the sets to copy, for example
+                EntitySet.type == SetType.frozen.
+
+        Returns:
+            The number of sets written.
+        """
+        table = cls.__table__
+        query = (
+            sqlalchemy.select([table.c[name] for name in COPY_COLUMNS])
+            .where(sqlalchemy.not_(table.c.chunked))
+            .order_by(table.c.id)
+        )
+        chunked = (
+            sqlalchemy.select([table.c.id, table.c.type, table.c.entity_type])
+            .where(table.c.chunked)
+            .order_by(table.c.id)
+        )
+        for criterion in criteria:
+            query = query.where(criterion)
+            chunked = chunked.where(criterion)
+        sql = query.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+
+        cursor = _dbapi_connection(connection).cursor()
+        try:
+            cursor.copy_expert(
+                "COPY ({}) TO STDOUT WITH (FORMAT csv)".format(sql), file
+            )
+            written = cursor.rowcount
+        finally:
+            cursor.close()
+
+        chunks = EntitySetChunk.__table__
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for set_id, set_type, entity_type in connection.execute(chunked).fetchall():
+            rows = connection.execute(
+                sqlalchemy.select([chunks.c.encoding, chunks.c.data])
+                .where(chunks.c.set_id == set_id)
+                .order_by(chunks.c.min_id)
+            )
+            entity_ids = [
+                entity_id
+                for encoding, data in rows
+                for entity_id in _decode_chunk(encoding, data)
+            ]
+            writer.writerow(
+                [set_id, set_type.name, entity_type.name, _array_literal(entity_ids)]
+            )
+            row = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            file.write(row if isinstance(file, io.TextIOBase) else row.encode("utf-8"))
+            written += 1
+        return written
+
+    @staticmethod
+    def read_copy(file):
+        # type: (typing.Iterable[str]) -> typing.Iterator[dict]
+        """Parses the CSV output of copy_out into mappings accepted by copy_in."""
+        for set_id, set_type, entity_type, entity_ids in csv.reader(file):
+            yield {
+                "id": set_id,
+                "type": SetType[set_type],
+                "entity_type": EntityType[entity_type],
+                "entity_ids": _parse_array(entity_ids),
+            }
 
     def __repr__(self):
         return (
@@ -95,7 +927,7 @@ class EntitySet(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
                 id=self.id,
                 type=self.type.name,
                 entity_type=self.entity_type.name,
-                entity_ids=self.entity_ids,
+                entity_ids=self.get_entity_ids(),
                 created_datetime=self.created_datetime.isoformat()
                 if self.created_datetime
                 else None,
@@ -108,12 +940,73 @@ class EntitySet(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
             )
         )
 
+    def cache_json(self, compress=False):
+        # type: (bool) -> None
+        """Renders the JSON payload of a frozen set.
+
+        The payload is served by to_json_bytes. Sets frozen by freeze or
+        copy_in already carry it; this is for frozen sets created by other
+        means. Storing the payload updates the set, so updated_datetime is
+        set explicitly to match it.
+
+        Raises:
+            ValueError: If the set is not frozen.
+        """
+        if self.type != SetType.frozen:
+            raise ValueError("only frozen sets carry a JSON payload")
+        self.updated_datetime = datetime.datetime.now(datetime.timezone.utc)
+        self.json_payload = render_json_payload(
+            {
+                "id": self.id,
+                "type": self.type,
+                "entity_type": self.entity_type,
+                "entity_ids": self.get_entity_ids(),
+                "created_datetime": self.created_datetime,
+                "updated_datetime": self.updated_datetime,
+            },
+            compress,
+        )
+
+    def to_json_bytes(self, decompress=True):
+        # type: (bool) -> bytes
+        """Returns the set as UTF-8 encoded JSON.
+
+        Frozen sets never change, so their payload is rendered once and stored
+        in json_payload, which is loaded on first access; serving it costs a
+        single column fetch and no serialization. Unlike to_json,
+        accessed_datetime is left out of the cached payload: it changes on
+        reads and could not be added to a gzipped payload without
+        recompressing it. Sets without a
+        payload are rendered on the fly, in the same shape.
+
+        Args:
+            decompress: Whether to decompress gzipped payloads. When False,
+                gzipped payloads are returned as is, for example to be sent
+                with a gzip content encoding.
+
+        Returns:
+            The JSON document, gzipped if stored so and decompress is False.
+        """
+        payload = self.json_payload
+        if payload is None:
+            return json.dumps(
+                {
+                    key: value
+                    for key, value in self.to_json().items()
+                    if key != "accessed_datetime"
+                },
+                separators=(",", ":"),
+            ).encode("utf-8")
+        if decompress and payload[:2] == GZIP_MAGIC:
+            return gzip.decompress(payload)
+        return bytes(payload)
+
     def to_json(self):
         return {
             "id": str(self.id),
             "type": self.type.name,
             "entity_type": self.entity_type.name,
-            "entity_ids": [str(entity_id) for entity_id in self.entity_ids],
+            "entity_ids": [str(entity_id) for entity_id in self.get_entity_ids()],
             "created_datetime": self.created_datetime.isoformat()
             if self.created_datetime
             else None,
@@ -124,3 +1017,432 @@ class EntitySet(Base, audit.AuditColumnsMixin, accessed.AccessedColumnMixin):
             if self.accessed_datetime
             else None,
         }
+
+
+class EntitySetChunk(Base):
+    """A chunk of the entity ids of a chunked entity set.
+
+    The ids of a chunk are sorted and encoded as a whole. The chunks of a set
+    cover disjoint ranges of ids, from min_id to max_id, so the chunk that may
+    hold an id is the one with the largest min_id not above it. Ids are
+    compared in byte order (the C collation), as python does.
+
+    Attributes:
+        set_id: The ID of the entity set.
+        chunk_index: Identifies the chunk within the set; chunks are ordered
+            by min_id.
+        encoding: The encoding of data, uuid or text.
+        entity_count: The number of ids in the chunk.
+        min_id: The smallest id in the chunk.
+        max_id: The largest id in the chunk.
+        data: The encoded ids.
+    """
+
+    __tablename__ = "entity_set_chunk"
+    __table_args__ = (
+        sqlalchemy.Index("entity_set_chunk_min_id_idx", "set_id", "min_id"),
+    )
+    set_id = sqlalchemy.Column(
+        sqlalchemy.String(128),
+        sqlalchemy.ForeignKey("entity_set.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    chunk_index = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    encoding = sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    entity_count = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    min_id = sqlalchemy.Column(sqlalchemy.Text(collation="C"), nullable=False)
+    max_id = sqlalchemy.Column(sqlalchemy.Text(collation="C"), nullable=False)
+    data = sqlalchemy.Column(postgresql.BYTEA, nullable=False)
+
+    def get_entity_ids(self):
+        # type: () -> list[str]
+        return list(_decode_chunk(self.encoding, self.data))
+
+    def __repr__(self):
+        return (
+            "<EntitySetChunk("
+            "set_id={set_id}, "
+            "chunk_index={chunk_index}, "
+            "encoding={encoding}, "
+            "entity_count={entity_count})>".format(
+                set_id=self.set_id,
+                chunk_index=self.chunk_index,
+                encoding=self.encoding,
+                entity_count=self.entity_count,
+            )
+        )
+
+
+def hash_content(entity_type, entity_ids):
+    # type: (EntityType, typing.Iterable[str]) -> str
+    """Computes the content hash of a set.
+
+    Args:
+        entity_type: The type of the entities.
+        entity_ids: The ids of the set, in any order and with duplicates.
+
+    Returns:
+        The hex encoded SHA-256 digest of the entity type name followed by
+        the sorted, unique ids, each on a line of its own.
+    """
+    digest = hashlib.sha256(entity_type.name.encode("utf-8"))
+    for entity_id in sorted(set(entity_ids)):
+        digest.update(b"\n" + entity_id.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def render_json_payload(values, compress=False):
+    # type: (dict, bool) -> bytes
+    """Renders the JSON payload of a frozen set, without accessed_datetime.
+
+    Args:
+        values: The id, type, entity_type, entity_ids, created_datetime and
+            updated_datetime of the set.
+        compress: Whether to gzip the payload.
+
+    Returns:
+        The compact, UTF-8 encoded JSON document.
+    """
+    payload = json.dumps(
+        {
+            "id": str(values["id"]),
+            "type": values["type"].name,
+            "entity_type": values["entity_type"].name,
+            "entity_ids": [str(entity_id) for entity_id in values["entity_ids"]],
+            "created_datetime": values["created_datetime"].isoformat(),
+            "updated_datetime": values["updated_datetime"].isoformat(),
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return gzip.compress(payload) if compress else payload
+
+
+def _dbapi_connection(connection):
+    """Returns the psycopg2 connection of a session or connection."""
+    if isinstance(connection, sqlalchemy.orm.Session):
+        connection = connection.connection()
+    return connection.connection
+
+
+def _copy_row(record, now, compress_payload=False):
+    # type: (typing.Any, datetime.datetime, bool) -> list[str | None]
+    """Formats an entity set as a CSV row for copy_in.
+
+    Frozen sets also get their content hash and their JSON payload, rendered
+    as created and last updated at now.
+
+    Raises:
+        ValueError: If the record is a chunked set, whose ids cannot be
+            queried while the COPY is in progress.
+    """
+    if isinstance(record, collections.abc.Mapping):
+        values = [record[name] for name in COPY_COLUMNS]
+    elif getattr(record, "chunked", False):
+        raise ValueError(
+            "chunked set {} cannot be copied in, pass a mapping with the ids "
+            "from get_entity_ids instead".format(record.id)
+        )
+    else:
+        values = [getattr(record, name) for name in COPY_COLUMNS]
+    set_id, set_type, entity_type, entity_ids = values
+    set_type = SetType[getattr(set_type, "name", set_type)]
+    entity_type = EntityType[getattr(entity_type, "name", entity_type)]
+    entity_ids = [str(entity_id) for entity_id in entity_ids]
+
+    content_hash = payload = None
+    if set_type == SetType.frozen:
+        content_hash = hash_content(entity_type, entity_ids)
+        payload = (
+            "\\x"
+            + render_json_payload(
+                {
+                    "id": set_id,
+                    "type": set_type,
+                    "entity_type": entity_type,
+                    "entity_ids": entity_ids,
+                    "created_datetime": now,
+                    "updated_datetime": now,
+                },
+                compress_payload,
+            ).hex()
+        )
+    return [
+        set_id,
+        set_type.name,
+        entity_type.name,
+        _array_literal(entity_ids),
+        content_hash,
+        payload,
+    ]
+
+
+def _array_literal(values):
+    # type: (typing.Iterable[str]) -> str
+    """Formats strings as a one dimensional postgresql array literal."""
+    return (
+        "{"
+        + ",".join(
+            '"{}"'.format(i.replace("\\", "\\\\").replace('"', '\\"')) for i in values
+        )
+        + "}"
+    )
+
+
+def _parse_array(literal):
+    # type: (str) -> list[str]
+    """Parses a one dimensional postgresql text array literal."""
+    values = []
+    reader = iter(literal[1:-1])
+    for char in reader:
+        if char == ",":
+            continue
+        if char != '"':
+            value = char
+            for char in reader:
+                if char == ",":
+                    break
+                value += char
+            values.append(value)
+            continue
+        value = ""
+        for char in reader:
+            if char == "\\":
+                value += next(reader)
+            elif char == '"':
+                break
+            else:
+                value += char
+        values.append(value)
+    return values
+
+
+class _CsvReader(io.TextIOBase):
+    """A file-like object reading CSV rows from an iterable, as COPY needs."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+        # psycopg2 reports errors raised while reading as a cancelled COPY
+        self.error = None
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            try:
+                row = next(self._rows, None)
+            except Exception as error:
+                self.error = error
+                raise
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        if size < 0:
+            size = len(self._pending)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+
+def rechunk(connectable, set_id, chunk_size=CHUNK_SIZE):
+    # type: (sqlalchemy.engine.Connectable | sqlalchemy.orm.Session, str, int) -> int
+    """Rewrites the chunks of a set as full chunks of disjoint id ranges.
+
+    Also removes duplicate ids and corrects the entity count of the set. The
+    chunks are merged as they are decoded, so only their encoded form is held
+    in memory. updated_datetime is left unchanged.
+
+    Args:
+        connectable: An engine, connection or session to use.
+        set_id: The ID of a chunked set.
+        chunk_size: The number of ids per chunk.
+
+    Returns:
+        The number of ids in the set.
+    """
+    table = EntitySet.__table__
+    chunks = EntitySetChunk.__table__
+    connectable.execute(
+        sqlalchemy.select([table.c.id]).where(table.c.id == set_id).with_for_update()
+    )
+    rows = connectable.execute(
+        sqlalchemy.select([chunks.c.encoding, chunks.c.data]).where(
+            chunks.c.set_id == set_id
+        )
+    ).fetchall()
+    connectable.execute(chunks.delete().where(chunks.c.set_id == set_id))
+
+    count = 0
+    piece, last = [], None
+    merged = heapq.merge(*(_decode_chunk(row.encoding, row.data) for row in rows))
+    for entity_id in merged:
+        if entity_id == last:
+            continue
+        last = entity_id
+        piece.append(entity_id)
+        if len(piece) == chunk_size:
+            connectable.execute(
+                chunks.insert().values(
+                    _encode_chunk(piece), set_id=set_id, chunk_index=count // chunk_size
+                )
+            )
+            count, piece = count + len(piece), []
+    if piece:
+        connectable.execute(
+            chunks.insert().values(
+                _encode_chunk(piece), set_id=set_id, chunk_index=count // chunk_size
+            )
+        )
+        count += len(piece)
+
+    connectable.execute(
+        table.update()
+        .where(table.c.id == set_id)
+        .values(entity_count=count, updated_datetime=table.c.updated_datetime)
+    )
+    return count
+
+
+def _chunk_bounds(session, set_id):
+    # type: (sqlalchemy.orm.Session, str) -> list
+    """Reads the index and id range of the chunks of a set, ordered by range."""
+    chunks = EntitySetChunk.__table__
+    return session.execute(
+        sqlalchemy.select([chunks.c.chunk_index, chunks.c.min_id, chunks.c.max_id])
+        .where(chunks.c.set_id == set_id)
+        .order_by(chunks.c.min_id)
+    ).fetchall()
+
+
+def _group_by_chunk(bounds, entity_ids, extend=False):
+    # type: (list, list[str], bool) -> dict[int, list[str]]
+    """Groups ids by the index of the chunk whose range covers them.
+
+    With extend, ids outside of every range are assigned to the chunk whose
+    range is the closest, which is then extended to cover them; otherwise
+    they are left out.
+    """
+    min_ids = [bound.min_id for bound in bounds]
+    groups = collections.defaultdict(list)
+    for entity_id in entity_ids:
+        position = bisect.bisect_right(min_ids, entity_id) - 1
+        if position < 0:
+            if not extend:
+                continue
+            position = 0
+        bound = bounds[position]
+        if extend or entity_id <= bound.max_id:
+            groups[bound.chunk_index].append(entity_id)
+    return groups
+
+
+def _load_chunks(session, set_id, chunk_indexes):
+    # type: (sqlalchemy.orm.Session, str, typing.Iterable[int]) -> list
+    """Loads the chunks of a set with the given indexes."""
+    chunk_indexes = list(chunk_indexes)
+    if not chunk_indexes:
+        return []
+    chunks = EntitySetChunk.__table__
+    return session.execute(
+        sqlalchemy.select([chunks.c.chunk_index, chunks.c.encoding, chunks.c.data])
+        .where(chunks.c.set_id == set_id)
+        .where(chunks.c.chunk_index.in_(chunk_indexes))
+    ).fetchall()
+
+
+def _split_sorted(entity_ids, chunk_size, fill=False):
+    # type: (list[str], int, bool) -> list[list[str]]
+    """Splits sorted ids into chunks of at most chunk_size ids.
+
+    New sets are split into full chunks (fill). Overflowing chunks are split
+    into chunks of even size instead, leaving room for later additions.
+    """
+    count = -(-len(entity_ids) // chunk_size)
+    if fill:
+        size = chunk_size
+    else:
+        size = -(-len(entity_ids) // count)
+    return [
+        entity_ids[start : start + size] for start in range(0, len(entity_ids), size)
+    ]
+
+
+def _is_uuid(entity_id):
+    # type: (str) -> bool
+    try:
+        return str(uuid.UUID(entity_id)) == entity_id
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+
+def _encode_chunk(entity_ids):
+    # type: (list[str]) -> dict
+    """Encodes ids as the column values of a chunk."""
+    entity_ids = sorted(entity_ids)
+    if all(_is_uuid(entity_id) for entity_id in entity_ids):
+        encoding, data = CHUNK_ENCODING_UUID, packed_ids.pack(entity_ids)
+    else:
+        if any("\n" in entity_id for entity_id in entity_ids):
+            raise ValueError("entity ids cannot contain newlines")
+        encoding = CHUNK_ENCODING_TEXT
+        data = zlib.compress("\n".join(entity_ids).encode("utf-8"))
+    return {
+        "encoding": encoding,
+        "entity_count": len(entity_ids),
+        "min_id": entity_ids[0],
+        "max_id": entity_ids[-1],
+        "data": data,
+    }
+
+
+def _decode_chunk(encoding, data):
+    # type: (str, bytes) -> typing.Iterable[str]
+    if encoding == CHUNK_ENCODING_UUID:
+        return packed_ids.PackedIds(data).iter_strings()
+    if encoding == CHUNK_ENCODING_TEXT:
+        return zlib.decompress(data).decode("utf-8").split("\n")
+    raise ValueError("unsupported chunk encoding: {}".format(encoding))
+
+
+def _chunk_contains(encoding, data, entity_id):
+    # type: (str, bytes, str) -> bool
+    if encoding == CHUNK_ENCODING_UUID:
+        return entity_id in packed_ids.PackedIds(data)
+    return entity_id in _decode_chunk(encoding, data)
+
+
+# keeps entity_count of inline sets in sync for every write, including those
+# bypassing the ORM
+sqlalchemy.event.listen(
+    EntitySet.__table__,
+    "after_create",
+    sqlalchemy.DDL(
+        """
+        CREATE OR REPLACE FUNCTION entity_set_entity_count() RETURNS trigger AS $$
+        BEGIN
+            -- chunked sets maintain their count when appending chunks
+            IF NEW.entity_ids IS NOT NULL OR NEW.entity_count IS NULL THEN
+                NEW.entity_count := coalesce(cardinality(NEW.entity_ids), 0);
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER entity_set_entity_count
+        BEFORE INSERT OR UPDATE OF entity_ids ON entity_set
+        FOR EACH ROW EXECUTE PROCEDURE entity_set_entity_count();
+        """
+    ).execute_if(dialect="postgresql"),
+)
+sqlalchemy.event.listen(
+    EntitySet.__table__,
+    "after_drop",
+    sqlalchemy.DDL("DROP FUNCTION IF EXISTS entity_set_entity_count()").execute_if(
+        dialect="postgresql"
+    ),
+)
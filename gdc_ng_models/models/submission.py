@@ -5,9 +5,12 @@ gdcdatamodel.models.submission
 Models for submission TransactionLogs
 """
 
+from collections import namedtuple
 from datetime import datetime
 from distutils.version import StrictVersion
+from functools import lru_cache
 from json import dumps, loads
+from operator import attrgetter
 
 import pytz
 import sqlalchemy as db
@@ -23,10 +26,11 @@ from sqlalchemy import (
     Text,
     func,
     text,
+    tuple_,
 )
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import deferred, relationship
+from sqlalchemy.orm import deferred, load_only, relationship, selectinload
 
 if StrictVersion(db.__version__) >= StrictVersion("1.3.4"):
     from sqlalchemy.dialects.postgresql.json import JSONB
@@ -41,6 +45,82 @@ def datetime_to_unix(dt):
     return (dt - datetime(1970, 1, 1, tzinfo=pytz.utc)).total_seconds()
 
 
+#: Columns TransactionLog.page can filter on by equality
+PAGE_FILTERS = frozenset({"program", "project", "state", "is_dry_run"})
+
+#: A page of TransactionLogs and the cursor of the next page, None on the last
+TransactionLogPage = namedtuple("TransactionLogPage", ["logs", "next_cursor"])
+
+
+def format_cursor(log):
+    """Formats the position of a TransactionLog as a page cursor."""
+    return f"{log.created_datetime.isoformat()}_{log.id}"
+
+
+def parse_cursor(cursor):
+    """Parses a page cursor into a (created_datetime, id) tuple."""
+    try:
+        created_datetime, log_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_datetime), int(log_id)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid page cursor: {cursor}")
+
+
+class Projection:
+    """A validated to_json field selection, see compile_projection.
+
+    Attributes:
+        keys: The attributes copied as they are.
+        converters: Maps attributes to functions converting their values.
+        children: Maps relationships to the projections of their rows.
+    """
+
+    def __init__(self, keys, converters=None, children=None):
+        self.keys = tuple(sorted(keys))
+        self.converters = dict(converters or {})
+        self.children = dict(children or {})
+        self._get = attrgetter(*self.keys) if self.keys else None
+
+    @property
+    def columns(self):
+        """The column attributes the projection reads."""
+        return self.keys + tuple(sorted(self.converters))
+
+    def serialize(self, row):
+        """Serializes a row into a JSON compatible dict."""
+        if len(self.keys) == 1:
+            doc = {self.keys[0]: self._get(row)}
+        elif self.keys:
+            doc = dict(zip(self.keys, self._get(row)))
+        else:
+            doc = {}
+        for key, convert in self.converters.items():
+            doc[key] = convert(getattr(row, key))
+        for key, projection in self.children.items():
+            doc[key] = [projection.serialize(child) for child in getattr(row, key)]
+        return doc
+
+
+@lru_cache(maxsize=256)
+def compile_projection(model, fields=frozenset()):
+    """Compiles the to_json projection of a model for a set of fields.
+
+    Validating and splitting the fields is done once per distinct field set;
+    the projection is cached and can be reused across rows and requests.
+
+    Args:
+        model: TransactionLog, TransactionSnapshot or TransactionDocument.
+        fields: A frozenset of fields, as accepted by the model's to_json.
+
+    Returns:
+        A Projection.
+
+    Raises:
+        RuntimeError: If a field does not exist.
+    """
+    return model._compile_projection(fields)
+
+
 class TransactionLog(Base):
     __tablename__ = "transaction_logs"
 
@@ -55,24 +135,93 @@ class TransactionLog(Base):
             Index(f"{tbl}_closed_idx", "closed"),
             Index(f"{tbl}_state_idx", "state"),
             Index(f"{tbl}_submitter_idx", "submitter"),
-            Index(f"{tbl}_created_datetime_idx", "created_datetime"),
             Index(f"{tbl}_project_id_idx", cls.program + "-" + cls.project),
+            # keyset pagination, see page: equality filters, then the sort key
+            Index(f"{tbl}_created_datetime_id_idx", "created_datetime", "id"),
+            Index(f"{tbl}_state_created_idx", "state", "created_datetime", "id"),
+            Index(
+                f"{tbl}_project_created_idx",
+                "program",
+                "project",
+                "created_datetime",
+                "id",
+            ),
+            Index(
+                f"{tbl}_project_state_created_idx",
+                "program",
+                "project",
+                "state",
+                "created_datetime",
+                "id",
+            ),
+            Index(
+                f"{tbl}_project_dry_run_created_idx",
+                "program",
+                "project",
+                "is_dry_run",
+                "created_datetime",
+                "id",
+            ),
+        )
+
+    @classmethod
+    def page(cls, session, filters=None, after=None, limit=100):
+        """Lists TransactionLogs newest first, a page at a time.
+
+        Pages are found by keyset pagination on (created_datetime, id)
+        rather than OFFSET, so deep pages cost as much as the first one. The
+        composite indexes in __table_args__ cover the common filters followed
+        by the sort key.
+
+        Args:
+            session: A database session.
+            filters: Optional equality filters on program, project, state and
+                is_dry_run.
+            after: The next_cursor of the previous page, None for the first.
+            limit: The maximum number of TransactionLogs per page.
+
+        Returns:
+            A TransactionLogPage.
+
+        Raises:
+            ValueError: If a filter, the cursor or the limit is invalid.
+        """
+        filters = filters or {}
+        if set(filters) - PAGE_FILTERS:
+            raise ValueError(
+                "Filters do not exist: {}".format(
+                    ", ".join(sorted(set(filters) - PAGE_FILTERS))
+                )
+            )
+        if limit < 1:
+            raise ValueError(f"Invalid page limit: {limit}")
+
+        query = session.query(cls).filter_by(**filters)
+        if after is not None:
+            query = query.filter(
+                tuple_(cls.created_datetime, cls.id) < parse_cursor(after)
+            )
+        logs = (
+            query.order_by(cls.created_datetime.desc(), cls.id.desc())
+            .limit(limit + 1)
+            .all()
         )
+        if len(logs) <= limit:
+            return TransactionLogPage(logs, None)
+        return TransactionLogPage(logs[:limit], format_cursor(logs[limit - 1]))
 
     def __repr__(self):
         return f"<TransactionLog({self.id}, {self.created_datetime})>"
 
-    def to_json(self, fields=None):
-
-        fields = fields or set()
+    @classmethod
+    def _compile_projection(cls, fields):
         # Source fields
-        existing_fields = [c.name for c in self.__table__.c] + ["entities", "documents"]
-        custom_fields = {"created_datetime", "entities", "documents"}
+        existing_fields = [c.name for c in cls.__table__.c] + ["entities", "documents"]
 
         # Pull out child fields
         entity_fields = {f for f in fields if f.startswith("entities.")}
         document_fields = {f for f in fields if f.startswith("documents.")}
-        fields = fields - entity_fields - document_fields
+        fields = set(fields) - entity_fields - document_fields
 
         # Reformat child fields
         entity_fields = {f.replace("entities.", "") for f in entity_fields}
@@ -90,18 +239,55 @@ class TransactionLog(Base):
                 )
             )
 
-        # Set standard fields
-        doc = {key: getattr(self, key) for key in fields if key not in custom_fields}
-
-        # Add custom fields
+        # Set custom fields
+        converters = {}
+        if "created_datetime" in fields:
+            converters["created_datetime"] = lambda value: value.isoformat("T")
+        children = {}
         if "entities" in fields or entity_fields:
-            doc["entities"] = [n.to_json(entity_fields) for n in self.entities]
+            children["entities"] = compile_projection(
+                TransactionSnapshot, frozenset(entity_fields)
+            )
         if "documents" in fields or document_fields:
-            doc["documents"] = [n.to_json(document_fields) for n in self.documents]
-        if "created_datetime" in fields:
-            doc["created_datetime"] = self.created_datetime.isoformat("T")
+            children["documents"] = compile_projection(
+                TransactionDocument, frozenset(document_fields)
+            )
+        keys = fields - {"created_datetime", "entities", "documents"}
+        return Projection(keys, converters, children)
+
+    @classmethod
+    def load_for_json(cls, session, ids, fields=None):
+        """Loads TransactionLogs for serialization with to_json(fields).
+
+        Loading entities and documents lazily takes two queries per
+        TransactionLog. Instead, the logs are loaded with one query, and the
+        requested children with one selectin query each, restricted to the
+        requested columns. Deferred columns are loaded only when requested.
+
+        Args:
+            session: A database session.
+            ids: The IDs of the TransactionLogs.
+            fields: The fields that will be passed to to_json.
+
+        Returns:
+            The TransactionLogs found, in the order of ids.
+        """
+        ids = list(ids)
+        projection = compile_projection(cls, frozenset(fields or ()))
+
+        options = [load_only(*projection.columns)]
+        for key, child in projection.children.items():
+            options.append(selectinload(key).load_only(*child.columns))
+
+        logs = {
+            log.id: log
+            for log in session.query(cls).filter(cls.id.in_(ids)).options(*options)
+        }
+        return [logs[log_id] for log_id in ids if log_id in logs]
 
-        return doc
+    def to_json(self, fields=None):
+        projection = compile_projection(type(self), frozenset(fields or ()))
+        return projection.serialize(self)
 
     id_seq = Sequence("transaction_logs_id_seq", metadata=Base.metadata)
     id = Column(BigInteger, primary_key=True, server_default=id_seq.next_value())
@@ -183,9 +369,10 @@ class TransactionSnapshot(Base):
     def __repr__(self):
         return f"<TransactionSnapshot({self.id}, {self.transaction_id})>"
 
-    def to_json(self, fields=None):
-        fields = set(fields) if fields else set()
-        existing_fields = [c.name for c in self.__table__.c]
+    @classmethod
+    def _compile_projection(cls, fields):
+        fields = set(fields)
+        existing_fields = [c.name for c in cls.__table__.c]
         if not fields:
             fields = existing_fields
         if set(fields) - set(existing_fields):
@@ -194,8 +381,11 @@ class TransactionSnapshot(Base):
                     ", ".join(set(fields) - set(existing_fields))
                 )
             )
-        doc = {key: getattr(self, key) for key in fields}
-        return doc
+        return Projection(fields)
+
+    def to_json(self, fields=None):
+        projection = compile_projection(type(self), frozenset(fields or ()))
+        return projection.serialize(self)
 
     id = Column(
         Text,
@@ -235,10 +425,11 @@ class TransactionDocument(Base):
     def __table_args__(cls):
         return (Index("idx_transaction_document_transactions_id", "transaction_id"),)
 
-    def to_json(self, fields=None):
+    @classmethod
+    def _compile_projection(cls, fields):
         # Source fields
-        fields = set(fields) if fields else set()
-        existing_fields = {c.name for c in self.__table__.c}
+        fields = set(fields)
+        existing_fields = {c.name for c in cls.__table__.c}
 
         # Default fields
         if not fields:
@@ -252,9 +443,11 @@ class TransactionDocument(Base):
                 )
             )
 
-        # Generate doc
-        doc = {key: getattr(self, key) for key in fields}
-        return doc
+        return Projection(fields)
+
+    def to_json(self, fields=None):
+        projection = compile_projection(type(self), frozenset(fields or ()))
+        return projection.serialize(self)
 
     id_seq = Sequence("transaction_documents_id_seq", metadata=Base.metadata)
     id = Column(
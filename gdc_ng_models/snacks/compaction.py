@@ -0,0 +1,70 @@
+"""Compaction of cohort filter histories.
+
+Each change to a cohort filter adds a revision holding a full copy of the
+filters, although consecutive revisions tend to differ in a single value. The
+compaction job rewrites old revisions as JSON patches against their parents
+(see CohortFilter.compact_history), a batch of cohorts per transaction. It is
+opt-in and safe to re-run; cohorts with a single revision are skipped.
+"""
+import time
+from logging import getLogger
+
+import sqlalchemy
+
+from gdc_ng_models.models import cohort
+
+logger = getLogger(__name__)
+
+
+def compact(connection, checkpoint_interval=10, batch_size=100, max_batches=None):
+    # type: (Connection, int, int, int) -> int
+    """Compacts the filter histories of all cohorts.
+
+    Args:
+        connection: A database connection. Each batch runs in a transaction
+            of its own (or a subtransaction, if one is already open).
+        checkpoint_interval: The maximum number of rows read to materialize a
+            revision, see CohortFilter.compact_history.
+        batch_size: The number of cohorts compacted per transaction.
+        max_batches: An optional limit on the number of batches.
+
+    Returns:
+        The number of revisions rewritten.
+    """
+    table = cohort.CohortFilter.__table__
+    select_cohorts = (
+        sqlalchemy.select([table.c.cohort_id])
+        .where(table.c.cohort_id > sqlalchemy.bindparam("last_cohort_id"))
+        .group_by(table.c.cohort_id)
+        .having(sqlalchemy.func.count() > 1)
+        .order_by(table.c.cohort_id)
+        .limit(batch_size)
+    )
+
+    rewritten = batches = 0
+    last_cohort_id = "00000000-0000-0000-0000-000000000000"
+    start = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        with connection.begin():
+            cohort_ids = [
+                row.cohort_id
+                for row in connection.execute(
+                    select_cohorts, last_cohort_id=last_cohort_id
+                )
+            ]
+            if not cohort_ids:
+                break
+            for cohort_id in cohort_ids:
+                rewritten += cohort.CohortFilter.compact_history(
+                    connection, cohort_id, checkpoint_interval
+                )
+
+        last_cohort_id = cohort_ids[-1]
+        batches += 1
+        logger.info(
+            "compacted %d cohort filter revisions in %d batches (%.1f s)",
+            rewritten,
+            batches,
+            time.monotonic() - start,
+        )
+    return rewritten
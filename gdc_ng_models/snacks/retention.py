@@ -0,0 +1,153 @@
+"""Retention sweeps for records that have not been accessed recently.
+
+Models using the AccessedColumnMixin can expire once their accessed_datetime
+is older than a retention period. A sweep deletes expired records in bounded
+batches, each in its own transaction:
+
+    1. Lock up to batch_size expired records with FOR UPDATE SKIP LOCKED, so
+       records in use by concurrent transactions are skipped, not waited on.
+    2. Delete the rows referencing those records, deepest tables first, as
+       found by following the foreign keys of the model's metadata.
+    3. Delete the records themselves.
+"""
+import collections
+import datetime
+import time
+from logging import getLogger
+
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
+
+from gdc_ng_models.models import cohort, entity_set
+
+logger = getLogger(__name__)
+
+SweepResult = collections.namedtuple(
+    "SweepResult", ["deleted", "batches", "elapsed", "rate"]
+)
+
+
+class RetentionPolicy:
+    """Describes which records of a model expire.
+
+    Attributes:
+        model: A data model using AccessedColumnMixin with a single column key
+            named id.
+        criteria: Additional SQL criteria restricting the expiring records.
+    """
+
+    def __init__(self, model, *criteria):
+        self.model = model
+        self.criteria = criteria
+
+    @property
+    def name(self):
+        # type: () -> str
+        return self.model.__tablename__
+
+    def select_expired(self, cutoff, batch_size):
+        # type: (datetime.datetime, int) -> sqlalchemy.sql.Select
+        """Selects and locks a batch of expired record IDs."""
+        table = self.model.__table__
+        query = sqlalchemy.select([table.c.id]).where(
+            table.c.accessed_datetime < cutoff
+        )
+        for criterion in self.criteria:
+            query = query.where(criterion)
+        return (
+            query.order_by(table.c.accessed_datetime)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+
+    def delete_statements(self):
+        # type: () -> list[sqlalchemy.sql.Delete]
+        """Builds the deletes for a batch of record IDs, in cascade order.
+
+        The statements take the record IDs as the ids parameter.
+        """
+        table = self.model.__table__
+        ids = sqlalchemy.select(
+            [
+                sqlalchemy.func.unnest(
+                    sqlalchemy.bindparam("ids", type_=postgresql.ARRAY(table.c.id.type))
+                )
+            ]
+        )
+        return _cascade_deletes(table, table.c.id.in_(ids))
+
+
+def _cascade_deletes(table, whereclause):
+    # type: (sqlalchemy.Table, sqlalchemy.sql.ClauseElement) -> list
+    """Builds deletes for the matching rows of a table and all rows referencing
+    them, ordered so that referencing rows are deleted first.
+
+    Self-referencing foreign keys are not followed; the referencing rows are
+    expected to be matched by the same whereclause.
+    """
+    statements = []
+    for child in table.metadata.sorted_tables:
+        if child is table:
+            continue
+        for fk in child.foreign_keys:
+            if fk.column.table is table:
+                keys = sqlalchemy.select([fk.column]).where(whereclause)
+                statements.extend(_cascade_deletes(child, fk.parent.in_(keys)))
+    statements.append(table.delete().where(whereclause))
+    return statements
+
+
+RETENTION_POLICIES = {
+    "cohort": [RetentionPolicy(cohort.Cohort)],
+    "entity_set": [
+        RetentionPolicy(
+            entity_set.EntitySet,
+            entity_set.EntitySet.type == entity_set.SetType.ephemeral,
+        )
+    ],
+}
+
+
+def sweep(connection, policy, max_age, batch_size=1000, max_batches=None):
+    # type: (Connection, RetentionPolicy, datetime.timedelta, int, int) -> SweepResult
+    """Deletes the records of a policy that have not been accessed recently.
+
+    Args:
+        connection: A database connection. Each batch runs in a transaction
+            of its own (or a subtransaction, if one is already open).
+        policy: The policy describing the expiring records.
+        max_age: Records last accessed longer ago than this are deleted.
+        batch_size: The maximum number of records deleted per transaction.
+        max_batches: An optional limit on the number of batches.
+
+    Returns:
+        The number of records deleted, batches run, elapsed seconds and
+        records deleted per second.
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - max_age
+    select_expired = policy.select_expired(cutoff, batch_size)
+    deletes = policy.delete_statements()
+
+    deleted = batches = 0
+    start = time.monotonic()
+    while max_batches is None or batches < max_batches:
+        with connection.begin():
+            ids = [row.id for row in connection.execute(select_expired)]
+            if not ids:
+                break
+            for delete in deletes:
+                connection.execute(delete, ids=ids)
+
+        deleted += len(ids)
+        batches += 1
+        elapsed = time.monotonic() - start
+        logger.info(
+            "swept %d %s records in %d batches (%.1f records/s)",
+            deleted,
+            policy.name,
+            batches,
+            deleted / elapsed if elapsed else 0.0,
+        )
+
+    elapsed = time.monotonic() - start
+    return SweepResult(deleted, batches, elapsed, deleted / elapsed if elapsed else 0.0)
@@ -89,4 +89,56 @@ def get_parser():
         help="User permission to revoke",
     )
     revoke_parser.set_defaults(action="revoke")
+
+    sweep_parser = sub_parser.add_parser(
+        "sweep", help="Deletes module records that have not been accessed recently"
+    )
+
+    sweep_parser.add_argument(
+        "--days",
+        type=int,
+        required=True,
+        help="Records not accessed for this many days are deleted",
+    )
+
+    sweep_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Maximum number of records deleted per transaction",
+    )
+
+    sweep_parser.add_argument(
+        "--max-batches",
+        type=int,
+        required=False,
+        help="Maximum number of batches to run",
+    )
+    sweep_parser.set_defaults(action="sweep")
+
+    compact_parser = sub_parser.add_parser(
+        "compact", help="Rewrites cohort filter history as deltas against parents"
+    )
+
+    compact_parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=10,
+        help="Maximum number of revisions between full copies of a filter",
+    )
+
+    compact_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="Number of cohorts compacted per transaction",
+    )
+
+    compact_parser.add_argument(
+        "--max-batches",
+        type=int,
+        required=False,
+        help="Maximum number of batches to run",
+    )
+    compact_parser.set_defaults(action="compact")
     return parser
@@ -0,0 +1,136 @@
+"""Minimal JSON patch (RFC 6902) support for storing document deltas.
+
+Only the add, remove and replace operations are produced and understood,
+which is enough to express the difference between any two JSON documents.
+Paths are JSON pointers (RFC 6901).
+"""
+
+import copy
+
+
+def _escape(token):
+    # type: (str | int) -> str
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token):
+    # type: (str) -> str
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def diff(source, target, path=""):
+    # type: (typing.Any, typing.Any, str) -> list[dict]
+    """Computes a patch transforming the source document into the target.
+
+    Objects are compared key by key and arrays element by element, so a
+    small change in a large document results in a small patch.
+
+    Args:
+        source: The original document.
+        target: The changed document.
+        path: The JSON pointer of the documents, used for recursion.
+
+    Returns:
+        A list of patch operations.
+    """
+    if type(source) is not type(target):
+        return [{"op": "replace", "path": path, "value": target}]
+
+    if isinstance(source, dict):
+        operations = []
+        for key in source:
+            if key not in target:
+                operations.append({"op": "remove", "path": path + "/" + _escape(key)})
+        for key, value in target.items():
+            key_path = path + "/" + _escape(key)
+            if key not in source:
+                operations.append({"op": "add", "path": key_path, "value": value})
+            else:
+                operations.extend(diff(source[key], value, key_path))
+        return operations
+
+    if isinstance(source, list):
+        operations = []
+        common = min(len(source), len(target))
+        for index in range(common):
+            operations.extend(
+                diff(source[index], target[index], path + "/" + str(index))
+            )
+        for index in range(common, len(target)):
+            operations.append(
+                {"op": "add", "path": path + "/" + str(index), "value": target[index]}
+            )
+        # removed from the end so that the remaining indexes stay valid
+        for index in reversed(range(common, len(source))):
+            operations.append({"op": "remove", "path": path + "/" + str(index)})
+        return operations
+
+    if source != target:
+        return [{"op": "replace", "path": path, "value": target}]
+    return []
+
+
+def apply(document, patch):
+    # type: (typing.Any, list[dict]) -> typing.Any
+    """Applies a patch to a document.
+
+    Args:
+        document: The document to patch, which is left unchanged.
+        patch: A list of add, remove and replace operations.
+
+    Returns:
+        The patched document.
+
+    Raises:
+        ValueError: If an operation is unsupported or its path does not exist.
+    """
+    document = copy.deepcopy(document)
+    for operation in patch:
+        op = operation.get("op")
+        if op not in ("add", "remove", "replace"):
+            raise ValueError("unsupported patch operation: {}".format(op))
+
+        path = operation["path"]
+        if path == "":
+            if op == "remove":
+                raise ValueError("cannot remove the document root")
+            document = copy.deepcopy(operation["value"])
+            continue
+
+        tokens = [_unescape(token) for token in path.split("/")[1:]]
+        parent = document
+        try:
+            for token in tokens[:-1]:
+                parent = parent[int(token) if isinstance(parent, list) else token]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise ValueError("patch path does not exist: {}".format(path))
+
+        key = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if key == "-" else _list_index(key, path)
+            if op == "add" and index <= len(parent):
+                parent.insert(index, copy.deepcopy(operation["value"]))
+                continue
+            if index >= len(parent):
+                raise ValueError("patch path does not exist: {}".format(path))
+            if op == "remove":
+                del parent[index]
+            else:
+                parent[index] = copy.deepcopy(operation["value"])
+        elif isinstance(parent, dict):
+            if op != "add" and key not in parent:
+                raise ValueError("patch path does not exist: {}".format(path))
+            if op == "remove":
+                del parent[key]
+            else:
+                parent[key] = copy.deepcopy(operation["value"])
+        else:
+            raise ValueError("patch path does not exist: {}".format(path))
+    return document
+
+
+def _list_index(token, path):
+    # type: (str, str) -> int
+    if not token.isdigit():
+        raise ValueError("invalid array index in patch path: {}".format(path))
+    return int(token)
@@ -0,0 +1,185 @@
+"""Compact binary encoding for sets of UUID identifiers.
+
+Large case sets stored as postgresql UUID arrays are expensive to load: every
+element becomes a uuid.UUID object (and later a string) even when the caller
+only needs a count or a single page. The packed format stores the sorted,
+de-duplicated identifiers as consecutive 16 byte values behind a small header:
+
+    byte 0      compression codec (see COMPRESSION_CODECS)
+    bytes 1-4   number of identifiers, unsigned big-endian
+    bytes 5-    identifier payload, optionally compressed
+
+Uncompressed payloads can be sliced directly (including server side with
+substring), while compressed payloads trade random access for size.
+"""
+
+import bisect
+import struct
+import uuid
+import zlib
+from collections import abc
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+HEADER = struct.Struct(">BI")
+ID_SIZE = 16
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+
+COMPRESSION_CODECS = {
+    None: COMPRESSION_NONE,
+    "zlib": COMPRESSION_ZLIB,
+    "zstd": COMPRESSION_ZSTD,
+}
+
+
+def to_bytes(value):
+    # type: (uuid.UUID | str | bytes) -> bytes
+    """Converts a UUID, UUID string or 16 byte value to its binary form."""
+    if isinstance(value, uuid.UUID):
+        return value.bytes
+    if isinstance(value, (bytes, bytearray)) and len(value) == ID_SIZE:
+        return bytes(value)
+    return uuid.UUID(value).bytes
+
+
+def format_uuid(raw):
+    # type: (bytes) -> str
+    """Formats a 16 byte value as a canonical UUID string."""
+    h = raw.hex()
+    return "{}-{}-{}-{}-{}".format(h[:8], h[8:12], h[12:16], h[16:20], h[20:])
+
+
+def pack(ids, compression=None):
+    # type: (typing.Iterable[uuid.UUID | str], str | None) -> bytes
+    """Packs identifiers into the sorted binary format.
+
+    Args:
+        ids: The identifiers to pack. Duplicates are removed.
+        compression: None, "zlib" or "zstd" (requires the zstandard package).
+
+    Returns:
+        The packed representation including the header.
+    """
+    if compression not in COMPRESSION_CODECS:
+        raise ValueError("unsupported compression: {}".format(compression))
+
+    values = sorted({to_bytes(value) for value in ids})
+    payload = b"".join(values)
+
+    codec = COMPRESSION_CODECS[compression]
+    if codec == COMPRESSION_ZLIB:
+        payload = zlib.compress(payload)
+    elif codec == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        payload = zstandard.ZstdCompressor().compress(payload)
+
+    return HEADER.pack(codec, len(values)) + payload
+
+
+def read_header(data):
+    # type: (bytes) -> tuple[int, int]
+    """Returns the (codec, count) pair stored in the header of packed data."""
+    return HEADER.unpack_from(data)
+
+
+class PackedIds(abc.Sequence):
+    """A read only, lazily decoded sequence over packed identifiers.
+
+    The length is read from the header, so counting never decodes anything.
+    The payload is decompressed on first element access and individual
+    uuid.UUID objects are only built for the elements actually requested.
+    """
+
+    def __init__(self, data):
+        # type: (bytes | memoryview) -> None
+        self.data = data
+        self.codec, self.count = read_header(data)
+        self._raw = None
+
+    @property
+    def raw(self):
+        # type: () -> bytes
+        """The uncompressed identifier payload (16 bytes per identifier)."""
+        if self._raw is None:
+            payload = bytes(self.data[HEADER.size :])
+            if self.codec == COMPRESSION_ZLIB:
+                payload = zlib.decompress(payload)
+            elif self.codec == COMPRESSION_ZSTD:
+                if zstandard is None:
+                    raise ValueError(
+                        "zstd decompression requires the zstandard package"
+                    )
+                payload = zstandard.ZstdDecompressor().decompress(
+                    payload, max_output_size=self.count * ID_SIZE
+                )
+            elif self.codec != COMPRESSION_NONE:
+                raise ValueError("unsupported compression codec: {}".format(self.codec))
+            self._raw = payload
+        return self._raw
+
+    def raw_at(self, index):
+        # type: (int) -> bytes
+        """Returns the 16 byte value of the identifier at the given index."""
+        offset = index * ID_SIZE
+        return self.raw[offset : offset + ID_SIZE]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("packed id index out of range")
+        return uuid.UUID(bytes=self.raw_at(index))
+
+    def __iter__(self):
+        raw = self.raw
+        for offset in range(0, len(raw), ID_SIZE):
+            yield uuid.UUID(bytes=raw[offset : offset + ID_SIZE])
+
+    def __contains__(self, value):
+        try:
+            target = to_bytes(value)
+        except (TypeError, ValueError, AttributeError):
+            return False
+        index = bisect.bisect_left(_RawView(self), target)
+        return index < self.count and self.raw_at(index) == target
+
+    def iter_raw(self):
+        # type: () -> typing.Iterator[bytes]
+        """Iterates over the 16 byte values without building UUID objects."""
+        raw = self.raw
+        for offset in range(0, len(raw), ID_SIZE):
+            yield raw[offset : offset + ID_SIZE]
+
+    def iter_strings(self):
+        # type: () -> typing.Iterator[str]
+        """Iterates over the identifiers as canonical UUID strings."""
+        for value in self.iter_raw():
+            yield format_uuid(value)
+
+    def __repr__(self):
+        return "<PackedIds(count={}, codec={})>".format(self.count, self.codec)
+
+
+class _RawView(abc.Sequence):
+    """Exposes the raw 16 byte values of a PackedIds for use with bisect."""
+
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __len__(self):
+        return len(self.packed)
+
+    def __getitem__(self, index):
+        return self.packed.raw_at(index)
@@ -35,6 +35,7 @@ setup(
             "cdisutils",
         ],
         "alembic": ["alembic~=1.4"],
+        "zstd": ["zstandard"],
     },
     packages=find_packages(),
     package_data={"gdc_ng_models": ["alembic/*"]},
@@ -17,6 +17,7 @@ from gdc_ng_models.models import (
     redaction,
     released_data,
     studyrule,
+    submission,
 )
 from gdc_ng_models.snacks import database as db
 
@@ -95,6 +96,13 @@ def create_batch_db(db_engine):
     batch.Base.metadata.drop_all(db_engine)
 
 
+@pytest.fixture(scope="session")
+def create_submission_db(db_engine):
+    submission.Base.metadata.create_all(db_engine)
+    yield
+    submission.Base.metadata.drop_all(db_engine)
+
+
 @pytest.fixture(scope="session")
 def create_cohort_db(db_engine):
     # type: (sqlalchemy.engine.base.Engine) -> None
@@ -142,3 +150,17 @@ def db_module_session(db_engine):
     session.close()
     transaction.rollback()
     connection.close()
+
+
+@pytest.fixture(scope="function")
+def count_queries(db_session):
+    """Collects the statements executed on the connection of db_session."""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    connection = db_session.connection()
+    sqlalchemy.event.listen(connection, "before_cursor_execute", count)
+    yield statements
+    sqlalchemy.event.remove(connection, "before_cursor_execute", count)
@@ -0,0 +1,110 @@
+import datetime
+import uuid
+
+import pytest
+
+from gdc_ng_models.models import accessed, cohort, entity_set
+
+
+@pytest.fixture(scope="function")
+def fixture_cohorts(create_cohort_db, db_session):
+    """Create cohorts for use with test cases."""
+
+    test_context = cohort.AnonymousContext()
+    test_cohorts = [
+        cohort.Cohort(name="cohort_{}".format(i), context=test_context)
+        for i in range(3)
+    ]
+    db_session.add_all(test_cohorts)
+    db_session.commit()
+    return test_cohorts
+
+
+def test_access_touch_buffer__coalesces(create_cohort_db):
+    """Tests accesses to the same record are coalesced to the latest one."""
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    record_id = uuid.uuid4()
+    buffer = accessed.AccessTouchBuffer(cohort.Cohort)
+
+    buffer.touch(record_id, now)
+    buffer.touch(record_id, now - datetime.timedelta(hours=1))
+    buffer.touch(uuid.uuid4(), now)
+
+    assert len(buffer) == 2
+    assert buffer._pending[record_id] == now
+
+
+def test_access_touch_buffer__is_due(create_cohort_db):
+    """Tests a flush is due once the buffer is full or the interval elapsed."""
+
+    buffer = accessed.AccessTouchBuffer(
+        cohort.Cohort, flush_interval=3600, max_pending=2
+    )
+    buffer.touch(uuid.uuid4())
+    assert not buffer.is_due()
+
+    buffer.touch(uuid.uuid4())
+    assert buffer.is_due()
+
+    assert accessed.AccessTouchBuffer(cohort.Cohort, flush_interval=0).is_due()
+
+
+def test_access_touch_buffer__flush(db_session, fixture_cohorts):
+    """Tests a flush only moves accessed_datetime forward."""
+
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    earlier = later - datetime.timedelta(days=30)
+    updated = {c.id: c.updated_datetime for c in fixture_cohorts}
+
+    buffer = accessed.AccessTouchBuffer(cohort.Cohort)
+    buffer.touch(fixture_cohorts[0].id, later)
+    buffer.touch(fixture_cohorts[1].id, earlier)
+    buffer.touch(uuid.uuid4(), later)
+
+    assert buffer.flush(db_session) == 1
+    assert len(buffer) == 0
+    db_session.expire_all()
+
+    assert fixture_cohorts[0].accessed_datetime == later
+    assert fixture_cohorts[1].accessed_datetime > earlier
+    assert {c.id: c.updated_datetime for c in fixture_cohorts} == updated
+    assert buffer.flush(db_session) == 0
+
+
+def test_access_touch_buffer__entity_set(create_entity_set_db, db_session):
+    """Tests the buffer works with string keyed records."""
+
+    test_set = entity_set.EntitySet(
+        id="touched",
+        type=entity_set.SetType.ephemeral,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=[str(uuid.uuid4())],
+    )
+    db_session.add(test_set)
+    db_session.commit()
+
+    later = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    buffer = accessed.AccessTouchBuffer(entity_set.EntitySet)
+    buffer.touch(test_set.id, later)
+
+    assert buffer.flush(db_session) == 1
+    db_session.expire_all()
+    assert test_set.accessed_datetime == later
+
+
+def test_access_touch_buffer__failed_flush(db_session, fixture_cohorts):
+    """Tests buffered accesses are kept when a flush fails."""
+
+    class FailingConnection:
+        def execute(self, *args, **kwargs):
+            raise RuntimeError("connection lost")
+
+    buffer = accessed.AccessTouchBuffer(cohort.Cohort)
+    buffer.touch(fixture_cohorts[0].id)
+
+    with pytest.raises(RuntimeError):
+        buffer.flush(FailingConnection())
+
+    assert len(buffer) == 1
+    assert buffer.flush(db_session) == 1
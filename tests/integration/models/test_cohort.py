@@ -3,9 +3,12 @@ import json
 import uuid
 
 import pytest
-from sqlalchemy import exc
+import sqlalchemy
+from sqlalchemy import exc, inspect, orm
+from sqlalchemy.dialects import postgresql
 
-from gdc_ng_models.models import cohort
+from gdc_ng_models.models import cohort, entity_set
+from gdc_ng_models.utils import packed_ids
 
 
 class CohortType(enum.Enum):
@@ -173,6 +176,85 @@ def test_anonymous_context__to_json(create_cohort_db, db_session):
     assert test_context.to_json() == expected_json
 
 
+def test_anonymous_context__exists(create_cohort_db, db_session, fixture_context):
+    """Tests context existence checks with and without a cache."""
+
+    cache = cohort.AuthorizationCache()
+    assert cohort.AnonymousContext.exists(db_session, fixture_context.id)
+    assert not cohort.AnonymousContext.exists(db_session, uuid.uuid4())
+    assert cohort.AnonymousContext.exists(db_session, fixture_context.id, cache)
+    assert (fixture_context.id, None) in cache
+
+
+def test_anonymous_context__authorize(create_cohort_db, db_session, fixture_cohort):
+    """Tests ownership checks of cohorts against contexts."""
+
+    other_context = cohort.AnonymousContext()
+    db_session.add(other_context)
+    db_session.commit()
+
+    context_id = fixture_cohort.context_id
+    assert cohort.AnonymousContext.authorize(db_session, context_id, fixture_cohort.id)
+    assert not cohort.AnonymousContext.authorize(
+        db_session, other_context.id, fixture_cohort.id
+    )
+    assert not cohort.AnonymousContext.authorize(db_session, context_id, uuid.uuid4())
+
+
+def test_anonymous_context__authorize_cached(
+    create_cohort_db, db_session, fixture_cohort
+):
+    """Tests only successful authorizations are cached and reused."""
+
+    cache = cohort.AuthorizationCache()
+    context_id = fixture_cohort.context_id
+    assert not cohort.AnonymousContext.authorize(
+        db_session, uuid.uuid4(), fixture_cohort.id, cache
+    )
+    assert len(cache) == 0
+
+    assert cohort.AnonymousContext.authorize(
+        db_session, context_id, fixture_cohort.id, cache
+    )
+    assert len(cache) == 1
+
+    # answered from the cache, even though the cohort is gone
+    db_session.delete(fixture_cohort)
+    db_session.flush()
+    assert cohort.AnonymousContext.authorize(
+        db_session, context_id, fixture_cohort.id, cache
+    )
+
+    cache.invalidate(context_id)
+    assert not cohort.AnonymousContext.authorize(
+        db_session, context_id, fixture_cohort.id, cache
+    )
+
+
+def test_authorization_cache__bounded(monkeypatch):
+    """Tests cache entries expire and the least recently used are evicted."""
+
+    now = [100.0]
+    monkeypatch.setattr(cohort.time, "monotonic", lambda: now[0])
+    cache = cohort.AuthorizationCache(max_size=2, ttl=10)
+
+    cache.add(("a", 1))
+    cache.add(("a", 2))
+    assert ("a", 1) in cache
+    cache.add(("b", 1))
+    assert len(cache) == 2
+    assert ("a", 2) not in cache
+    assert ("a", 1) in cache
+
+    now[0] += 10
+    assert ("a", 1) not in cache
+    assert ("b", 1) not in cache
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        cohort.AuthorizationCache(max_size=0)
+
+
 def test_cohort__valid_create(create_cohort_db, db_session, fixture_context):
     """Tests creation of a valid cohort entity."""
 
@@ -438,7 +520,10 @@ def test_cohort_filter__filters_not_nullable(
 ):
     """Tests filters must be defined for cohort filter."""
 
-    with pytest.raises(exc.IntegrityError, match=r"violates not-null constraint"):
+    # only patch and shared revisions have no filters of their own
+    with pytest.raises(
+        exc.IntegrityError, match=r"violates check constraint .*filters_format_check"
+    ):
         db_session.add(
             cohort.CohortFilter(
                 cohort_id=fixture_cohort.id,
@@ -693,7 +778,10 @@ def test_cohort_snapshot__case_ids_not_nullable(
 ):
     """Tests case IDs must be defined for cohort snapshot."""
 
-    with pytest.raises(exc.IntegrityError, match=r"violates not-null constraint"):
+    with pytest.raises(
+        exc.IntegrityError,
+        match=r"violates check constraint.*cohort_snapshot_case_ids_storage_check",
+    ):
         db_session.add(
             cohort.CohortSnapshot(
                 filter_id=fixture_static_filter.id,
@@ -703,6 +791,73 @@ def test_cohort_snapshot__case_ids_not_nullable(
         db_session.commit()
 
 
+def test_cohort_snapshot__case_ids_single_storage(
+    create_cohort_db, db_session, fixture_static_filter
+):
+    """Tests case IDs cannot be stored both as an array and packed."""
+
+    case_ids = [uuid.uuid4() for i in range(10)]
+    test_snapshot = cohort.CohortSnapshot.packed(
+        case_ids,
+        filter_id=fixture_static_filter.id,
+        data_release=uuid.uuid4(),
+    )
+    test_snapshot.case_ids = case_ids
+
+    with pytest.raises(
+        exc.IntegrityError,
+        match=r"violates check constraint.*cohort_snapshot_case_ids_storage_check",
+    ):
+        db_session.add(test_snapshot)
+        db_session.commit()
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_cohort_snapshot__packed_case_ids(
+    create_cohort_db, db_session, fixture_static_filter, compression
+):
+    """Tests packed case IDs round trip through the database sorted and unique."""
+
+    case_ids = [uuid.uuid4() for i in range(100)]
+    test_snapshot = cohort.CohortSnapshot.packed(
+        case_ids + case_ids[:10],
+        compression=compression,
+        filter_id=fixture_static_filter.id,
+        data_release=uuid.uuid4(),
+    )
+    db_session.add(test_snapshot)
+    db_session.commit()
+    db_session.expire_all()
+
+    loaded = db_session.query(cohort.CohortSnapshot).get(test_snapshot.id)
+    loaded_case_ids = loaded.get_case_ids()
+
+    assert loaded.is_packed
+    assert loaded.case_ids is None
+    assert len(loaded_case_ids) == 100
+    assert list(loaded_case_ids) == sorted(case_ids)
+    assert loaded_case_ids[10:20] == sorted(case_ids)[10:20]
+    assert case_ids[42] in loaded_case_ids
+    assert uuid.uuid4() not in loaded_case_ids
+
+
+def test_cohort_snapshot__packed_to_json(
+    create_cohort_db, db_session, fixture_static_filter
+):
+    """Tests json output for a packed cohort snapshot matches the array form."""
+
+    case_ids = sorted(uuid.uuid4() for i in range(10))
+    test_snapshot = cohort.CohortSnapshot.packed(
+        case_ids,
+        filter_id=fixture_static_filter.id,
+        data_release=uuid.uuid4(),
+    )
+    db_session.add(test_snapshot)
+    db_session.commit()
+
+    assert test_snapshot.to_json()["case_ids"] == [str(case_id) for case_id in case_ids]
+
+
 def test_cohort_snapshot__to_json(create_cohort_db, db_session, fixture_static_filter):
     """Tests json output for cohort snapshot is valid."""
 
@@ -765,3 +920,987 @@ def test_cohort_cascade_delete(
         assert db_session.query(cohort.CohortFilter).get(filter_id) is None
     for snapshot_id in snapshot_ids:
         assert db_session.query(cohort.CohortSnapshot).get(snapshot_id) is None
+
+
+@pytest.fixture(scope="function")
+def fixture_snapshots(create_cohort_db, db_session, fixture_cohort):
+    """Create array, packed and compressed packed snapshots of the same cases."""
+
+    case_ids = [uuid.uuid4() for i in range(25)]
+    snapshots = []
+    for kwargs in [
+        {"case_ids": case_ids},
+        {"packed_case_ids": packed_ids.pack(case_ids)},
+        {"packed_case_ids": packed_ids.pack(case_ids, compression="zlib")},
+    ]:
+        test_filter = cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[])
+        test_filter.snapshot = cohort.CohortSnapshot(
+            data_release=uuid.uuid4(), **kwargs
+        )
+        snapshots.append(test_filter.snapshot)
+        db_session.add(test_filter)
+    db_session.commit()
+
+    return case_ids, snapshots
+
+
+def load_deferred_snapshot(db_session, snapshot_id):
+    """Loads a snapshot without its case IDs."""
+
+    db_session.expunge_all()
+    return (
+        db_session.query(cohort.CohortSnapshot)
+        .options(orm.defer("case_ids"), orm.defer("packed_case_ids"))
+        .get(snapshot_id)
+    )
+
+
+def test_cohort_snapshot__case_ids_loaded_by_default(db_session, fixture_snapshots):
+    """Tests snapshots load their case IDs unless deferred, for detached use."""
+
+    _, snapshots = fixture_snapshots
+    expected = [snapshot.to_json() for snapshot in snapshots]
+    snapshot_ids = [snapshot.id for snapshot in snapshots]
+    db_session.expunge_all()
+
+    loaded = [
+        db_session.query(cohort.CohortFilter)
+        .filter(cohort.CohortFilter.snapshot.has(id=snapshot_id))
+        .one()
+        .snapshot
+        for snapshot_id in snapshot_ids
+    ]
+    db_session.close()
+
+    assert [snapshot.to_json() for snapshot in loaded] == expected
+
+
+def test_cohort_snapshot__case_ids_page(db_session, fixture_snapshots):
+    """Tests case ID pages are sliced without loading the full set."""
+
+    case_ids, snapshots = fixture_snapshots
+    expected = [case_ids, sorted(case_ids), sorted(case_ids)]
+
+    snapshot_ids = [snapshot.id for snapshot in snapshots]
+
+    for snapshot_id, expected_ids in zip(snapshot_ids, expected):
+        snapshot = load_deferred_snapshot(db_session, snapshot_id)
+
+        assert snapshot.case_ids_page(0, 10) == expected_ids[:10]
+        assert snapshot.case_ids_page(20, 10) == expected_ids[20:]
+        assert snapshot.case_ids_page(30, 10) == []
+        assert snapshot.case_ids_page(5, 0) == []
+        assert {"case_ids", "packed_case_ids"} <= inspect(snapshot).unloaded
+
+        # once loaded, pages are served from memory
+        snapshot.get_case_ids()
+        assert snapshot.case_ids_page(3, 4) == expected_ids[3:7]
+
+
+def test_cohort_snapshot__case_ids_page_negative(db_session, fixture_snapshots):
+    """Tests negative page bounds are rejected."""
+
+    with pytest.raises(ValueError):
+        fixture_snapshots[1][0].case_ids_page(-1, 10)
+
+
+def test_cohort_snapshot__iter_case_ids(db_session, fixture_snapshots):
+    """Tests case IDs are streamed in batches in storage order."""
+
+    case_ids, snapshots = fixture_snapshots
+    expected = [case_ids, sorted(case_ids), sorted(case_ids)]
+
+    snapshot_ids = [snapshot.id for snapshot in snapshots]
+
+    for snapshot_id, expected_ids in zip(snapshot_ids, expected):
+        snapshot = load_deferred_snapshot(db_session, snapshot_id)
+
+        assert list(snapshot.iter_case_ids(batch_size=7)) == expected_ids
+
+
+@pytest.mark.parametrize("deferred", [False, True])
+def test_cohort_snapshot__iter_json(db_session, fixture_snapshots, deferred):
+    """Tests streamed json matches to_json for every storage, in bounded chunks."""
+
+    case_ids, snapshots = fixture_snapshots
+    expected = [snapshot.to_json() for snapshot in snapshots]
+    snapshot_ids = [snapshot.id for snapshot in snapshots]
+
+    for snapshot_id, expected_json in zip(snapshot_ids, expected):
+        if deferred:
+            snapshot = load_deferred_snapshot(db_session, snapshot_id)
+        else:
+            snapshot = db_session.query(cohort.CohortSnapshot).get(snapshot_id)
+        chunks = list(snapshot.iter_json(chunk_size=200, batch_size=7))
+
+        assert json.loads(b"".join(chunks)) == expected_json
+        assert len(chunks) > 1
+        assert max(len(chunk) for chunk in chunks[:-1]) < 200 + 40
+
+
+def test_cohort__iter_json(
+    create_cohort_db, db_session, fixture_cohort, fixture_static_filter
+):
+    """Tests streamed json of cohorts and filters matches to_json."""
+
+    for record in [fixture_cohort, fixture_static_filter]:
+        assert json.loads(b"".join(record.iter_json())) == record.to_json()
+
+
+@pytest.fixture(scope="function")
+def fixture_context_cohorts(create_cohort_db, db_session, fixture_context):
+    """Create a context with several cohorts, each with a filter history."""
+
+    cohorts = []
+    for i in range(3):
+        test_cohort = cohort.Cohort(
+            name="cohort_{}".format(i), context_id=fixture_context.id
+        )
+        parent_id = None
+        for j in range(3):
+            test_filter = cohort.CohortFilter(
+                cohort=test_cohort,
+                parent_id=parent_id,
+                filters=[{"field": "cases.primary_site", "value": [str(j)]}],
+                snapshot=cohort.CohortSnapshot(
+                    data_release=uuid.uuid4(),
+                    case_ids=[uuid.uuid4() for k in range(5)],
+                ),
+            )
+            db_session.add(test_filter)
+            db_session.flush()
+            parent_id = test_filter.id
+        cohorts.append(test_cohort)
+    db_session.add(cohort.Cohort(name="empty", context_id=fixture_context.id))
+    db_session.commit()
+
+    return fixture_context
+
+
+def test_cohort__list_for_context(db_session, fixture_context_cohorts):
+    """Tests listing a context loads only the current filter of each cohort."""
+
+    context_id = fixture_context_cohorts.id
+    db_session.expunge_all()
+
+    listing = cohort.Cohort.list_for_context(db_session, context_id)
+
+    current_filters = {c.name: f for c, f in listing}
+    assert sorted(current_filters) == ["cohort_0", "cohort_1", "cohort_2", "empty"]
+    assert current_filters.pop("empty") is None
+    for test_cohort, current_filter in listing:
+        if current_filter is None:
+            continue
+        assert {"filters"} <= inspect(test_cohort).unloaded
+        assert {"filters", "snapshot"} <= inspect(current_filter).unloaded
+        assert current_filter.id == max(f.id for f in test_cohort.filters)
+
+
+def test_cohort__list_for_context_include(db_session, fixture_context_cohorts):
+    """Tests optional filters and snapshots are loaded when requested."""
+
+    context_id = fixture_context_cohorts.id
+    db_session.expunge_all()
+
+    listing = cohort.Cohort.list_for_context(
+        db_session, context_id, include=["filters", "snapshot"]
+    )
+
+    for test_cohort, current_filter in listing:
+        if current_filter is None:
+            continue
+        state = inspect(current_filter)
+        assert "filters" not in state.unloaded
+        assert "snapshot" not in state.unloaded
+        assert current_filter.filters == [
+            {"field": "cases.primary_site", "value": ["2"]}
+        ]
+        assert {"case_ids", "packed_case_ids"} <= inspect(
+            current_filter.snapshot
+        ).unloaded
+
+
+def test_cohort__list_for_context_shared_filters(
+    db_session, fixture_context_cohorts, count_queries
+):
+    """Tests shared current filters are listed with their content."""
+
+    context_id = fixture_context_cohorts.id
+    filters = [{"field": "cases.primary_site", "value": ["shared"]}]
+    for test_cohort in fixture_context_cohorts.cohorts:
+        cohort.CohortFilter.find_or_create_by_filters(
+            db_session, test_cohort.id, filters
+        )
+    db_session.commit()
+    db_session.expunge_all()
+
+    listing = cohort.Cohort.list_for_context(
+        db_session, context_id, include=["filters"]
+    )
+    del count_queries[:]
+    materialized = [f.materialize() for _, f in listing]
+
+    assert materialized == [filters] * len(listing)
+    assert count_queries == []
+
+
+def test_cohort__list_for_context_invalid_include(db_session, fixture_context):
+    """Tests unknown include values are rejected."""
+
+    with pytest.raises(ValueError, match="invalid include"):
+        cohort.Cohort.list_for_context(
+            db_session, fixture_context.id, include=["history"]
+        )
+
+
+def test_cohort__current_filter_relationship(db_session, fixture_context_cohorts):
+    """Tests the current filter relationship loads only the latest filter."""
+
+    context_id = fixture_context_cohorts.id
+    db_session.expunge_all()
+
+    for test_cohort in (
+        db_session.query(cohort.Cohort)
+        .filter(cohort.Cohort.context_id == context_id)
+        .options(orm.lazyload(cohort.Cohort.filters))
+    ):
+        current_filter = test_cohort.get_current_filter()
+        assert "filters" in inspect(test_cohort).unloaded
+        if test_cohort.name == "empty":
+            assert current_filter is None
+        else:
+            assert current_filter.filters == [
+                {"field": "cases.primary_site", "value": ["2"]}
+            ]
+            assert current_filter == test_cohort.filters[0]
+
+
+def test_cohort__get_current_filters(db_session, fixture_context_cohorts):
+    """Tests the latest filters of many cohorts are retrieved together."""
+
+    test_cohorts = fixture_context_cohorts.cohorts
+
+    current_filters = cohort.Cohort.get_current_filters(
+        db_session, [c.id for c in test_cohorts]
+    )
+
+    assert current_filters == {c.id: c.filters[0] for c in test_cohorts if c.filters}
+
+
+def test_cohort_filter__filters_hash(create_cohort_db, db_session, fixture_cohort):
+    """Tests the filters hash is independent of key order and tracks changes."""
+
+    filter_1 = cohort.CohortFilter(
+        cohort_id=fixture_cohort.id, filters={"op": "and", "content": []}
+    )
+    filter_2 = cohort.CohortFilter(
+        cohort_id=fixture_cohort.id, filters={"content": [], "op": "and"}
+    )
+    db_session.add_all([filter_1, filter_2])
+    db_session.commit()
+
+    assert len(filter_1.filters_hash) == 64
+    assert filter_1.filters_hash == filter_2.filters_hash
+
+    filter_2.filters = {"content": [], "op": "or"}
+    db_session.commit()
+
+    assert filter_1.filters_hash != filter_2.filters_hash
+    assert filter_2.filters_hash == db_session.scalar(
+        cohort.hash_filters({"op": "or", "content": []})
+    )
+
+
+def test_cohort_filter__filters_hash_backfill(
+    create_cohort_db, db_session, fixture_cohort
+):
+    """Tests rows written without the ORM are hashed, and patches rehashed."""
+
+    table = cohort.CohortFilter.__table__
+    filters = {"op": "and", "content": [{"field": "a", "value": ["é"]}]}
+    db_session.execute(
+        table.insert().values(cohort_id=fixture_cohort.id, filters=filters)
+    )
+    inserted = db_session.query(cohort.CohortFilter).one()
+    assert inserted.filters_hash == db_session.scalar(cohort.hash_filters(filters))
+
+    revisions = create_filter_history(db_session, fixture_cohort.id, 3)
+    cohort.CohortFilter.compact_history(db_session.connection(), fixture_cohort.id)
+    db_session.execute(
+        table.update().where(table.c.id == revisions[1].id).values(filters_hash=None)
+    )
+    expected = db_session.scalar(cohort.hash_filters(revisions[1].materialize()))
+
+    assert (
+        cohort.CohortFilter.compact_history(db_session.connection(), fixture_cohort.id)
+        == 1
+    )
+    db_session.expire_all()
+    assert revisions[1].is_patch
+    assert revisions[1].filters_hash == expected
+
+
+def test_cohort_filter__find_by_filters(
+    create_cohort_db, db_session, fixture_context, fixture_static_filter
+):
+    """Tests filters with identical content are found across cohorts."""
+
+    other_cohort = cohort.Cohort(name="other", context_id=fixture_context.id)
+    other_filter = cohort.CohortFilter(
+        cohort=other_cohort, filters=fixture_static_filter.filters
+    )
+    db_session.add(other_filter)
+    db_session.commit()
+
+    filters = fixture_static_filter.filters
+    assert cohort.CohortFilter.find_by_filters(db_session, filters).all() == [
+        other_filter,
+        fixture_static_filter,
+    ]
+    assert cohort.CohortFilter.find_by_filters(
+        db_session, filters, cohort_id=other_cohort.id
+    ).all() == [other_filter]
+    assert cohort.CohortFilter.find_by_filters(db_session, []).all() == []
+
+
+def test_cohort_filter__find_or_create_by_filters(
+    create_cohort_db, db_session, fixture_cohort
+):
+    """Tests unchanged filters do not create a new revision."""
+
+    filters = [{"field": "cases.primary_site", "value": ["breast"]}]
+
+    filter_1, created_1 = cohort.CohortFilter.find_or_create_by_filters(
+        db_session, fixture_cohort.id, filters
+    )
+    filter_2, created_2 = cohort.CohortFilter.find_or_create_by_filters(
+        db_session, fixture_cohort.id, list(filters)
+    )
+    filter_3, created_3 = cohort.CohortFilter.find_or_create_by_filters(
+        db_session, fixture_cohort.id, filters, cohort_type="dynamic"
+    )
+
+    assert created_1 and not created_2 and created_3
+    assert filter_1 is filter_2
+    assert filter_1.parent_id is None
+    assert filter_3.parent_id == filter_1.id
+    assert fixture_cohort.get_current_filter() == filter_3
+    assert filter_1.filters is None
+    assert filter_3.materialize() == filters
+
+
+def test_cohort_filter__find_or_create_by_filters_stores_content_once(
+    create_cohort_db, db_session, fixture_context, fixture_cohort
+):
+    """Tests reverts and filters shared by cohorts reuse the stored content."""
+
+    default = {"op": "and", "content": []}
+    edited = [{"field": "cases.primary_site", "value": ["breast"]}]
+    cohorts = [fixture_cohort] + [
+        cohort.Cohort(name="other_{}".format(i), context_id=fixture_context.id)
+        for i in range(3)
+    ]
+    db_session.add_all(cohorts)
+    db_session.flush()
+
+    revisions = [
+        cohort.CohortFilter.find_or_create_by_filters(db_session, c.id, default)[0]
+        for c in cohorts
+    ]
+    for filters in [edited, default]:
+        revisions.append(
+            cohort.CohortFilter.find_or_create_by_filters(
+                db_session, fixture_cohort.id, filters
+            )[0]
+        )
+    db_session.commit()
+
+    contents = db_session.query(cohort.CohortFilterContent).all()
+    assert sorted(c.filters_hash for c in contents) == sorted(
+        {revisions[0].filters_hash, revisions[4].filters_hash}
+    )
+    assert len(revisions) == 6 and len(set(r.id for r in revisions)) == 6
+    assert all(r.filters is None for r in revisions)
+    assert revisions[5].parent_id == revisions[4].id
+    assert cohort.CohortFilter.materialize_all(db_session, revisions) == {
+        r.id: edited if r is revisions[4] else default for r in revisions
+    }
+    assert cohort.CohortFilter.find_by_filters(db_session, default).count() == 5
+    assert revisions[5].to_json()["filters"] == default
+
+    # patches of a compacted history apply onto shared revisions
+    large = {"op": "and", "content": [{"field": "a", "value": [i]} for i in range(20)]}
+    parent, _ = cohort.CohortFilter.find_or_create_by_filters(
+        db_session, fixture_cohort.id, large
+    )
+    changed = dict(large, op="or")
+    revision = cohort.CohortFilter(
+        cohort_id=fixture_cohort.id, parent_id=parent.id, filters=changed
+    )
+    db_session.add(revision)
+    db_session.flush()
+    db_session.add(
+        cohort.CohortFilter(
+            cohort_id=fixture_cohort.id, parent_id=revision.id, filters=default
+        )
+    )
+    db_session.flush()
+    assert (
+        cohort.CohortFilter.compact_history(db_session.connection(), fixture_cohort.id)
+        == 1
+    )
+    db_session.expire_all()
+    assert revision.is_patch
+    assert not parent.is_patch
+    assert revision.materialize() == changed
+
+
+def create_filter_history(session, cohort_id, count):
+    """Adds a chain of full filter revisions that differ in a single value."""
+
+    revisions = []
+    for i in range(count):
+        filters = {
+            "op": "and",
+            "content": [
+                {"field": "cases.primary_site", "value": ["site_{}".format(i)]},
+                {
+                    "field": "cases.case_id",
+                    "value": ["case_{}".format(j) for j in range(50)],
+                },
+            ],
+        }
+        revision = cohort.CohortFilter(
+            cohort_id=cohort_id,
+            parent_id=revisions[-1].id if revisions else None,
+            filters=filters,
+        )
+        session.add(revision)
+        session.flush()
+        revisions.append(revision)
+    return revisions
+
+
+def test_cohort_filter__lineage(create_cohort_db, db_session, fixture_cohort):
+    """Tests ancestors are loaded nearest first, optionally limited."""
+
+    revisions = create_filter_history(db_session, fixture_cohort.id, 5)
+    db_session.commit()
+
+    assert cohort.CohortFilter.lineage(db_session, revisions[-1].id) == list(
+        reversed(revisions)
+    )
+    assert cohort.CohortFilter.lineage(db_session, revisions[3].id, max_depth=2) == [
+        revisions[3],
+        revisions[2],
+        revisions[1],
+    ]
+    assert cohort.CohortFilter.lineage(db_session, revisions[0].id) == [revisions[0]]
+    assert cohort.CohortFilter.lineage(db_session, -1) == []
+
+
+def test_cohort_filter__lineage_skips_snapshots(
+    create_cohort_db, db_session, fixture_cohort, count_queries
+):
+    """Tests walking a history does not load the snapshots of its revisions."""
+
+    revisions = create_filter_history(db_session, fixture_cohort.id, 3)
+    for revision in revisions:
+        revision.snapshot = cohort.CohortSnapshot(
+            data_release=uuid.uuid4(), case_ids=[uuid.uuid4() for i in range(10)]
+        )
+    db_session.flush()
+    filter_id = revisions[-1].id
+    db_session.expunge_all()
+
+    del count_queries[:]
+    lineage = cohort.CohortFilter.lineage(db_session, filter_id)
+
+    assert len(lineage) == 3
+    assert len(count_queries) == 1
+    assert all("snapshot" in inspect(f).unloaded for f in lineage)
+
+
+def test_cohort_filter__descendants(create_cohort_db, db_session, fixture_cohort):
+    """Tests descendants are loaded by generation, including branches."""
+
+    revisions = create_filter_history(db_session, fixture_cohort.id, 3)
+    branch = cohort.CohortFilter(
+        cohort_id=fixture_cohort.id, parent_id=revisions[0].id, filters=[]
+    )
+    db_session.add(branch)
+    db_session.commit()
+
+    assert cohort.CohortFilter.descendants(db_session, revisions[0].id) == [
+        revisions[1],
+        branch,
+        revisions[2],
+    ]
+    assert cohort.CohortFilter.descendants(
+        db_session, revisions[0].id, max_depth=1
+    ) == [revisions[1], branch]
+    assert cohort.CohortFilter.descendants(db_session, revisions[2].id) == []
+
+
+def test_cohort_filter__compact_history(create_cohort_db, db_session, fixture_cohort):
+    """Tests old revisions are stored as patches with periodic checkpoints."""
+
+    revisions = create_filter_history(db_session, fixture_cohort.id, 7)
+    expected = {
+        r.id: (r.filters, r.filters_hash, r.updated_datetime) for r in revisions
+    }
+    db_session.commit()
+
+    rewritten = cohort.CohortFilter.compact_history(
+        db_session.connection(), fixture_cohort.id, checkpoint_interval=3
+    )
+    db_session.expire_all()
+
+    assert rewritten == 4
+    assert [r.filters_format for r in revisions] == [
+        "full",
+        "patch",
+        "patch",
+        "full",
+        "patch",
+        "patch",
+        "full",
+    ]
+    for revision in revisions:
+        filters, filters_hash, updated_datetime = expected[revision.id]
+        assert revision.materialize() == filters
+        assert revision.filters_hash == filters_hash
+        assert revision.updated_datetime == updated_datetime
+    assert fixture_cohort.get_current_filter() == revisions[-1]
+    assert cohort.CohortFilter.find_by_filters(
+        db_session, expected[revisions[1].id][0]
+    ).all() == [revisions[1]]
+
+    # re-running is a no-op, an interval of 1 restores every revision in full
+    assert (
+        cohort.CohortFilter.compact_history(
+            db_session.connection(), fixture_cohort.id, checkpoint_interval=3
+        )
+        == 0
+    )
+    assert (
+        cohort.CohortFilter.compact_history(
+            db_session.connection(), fixture_cohort.id, checkpoint_interval=1
+        )
+        == 4
+    )
+    db_session.expire_all()
+    assert all(r.filters == expected[r.id][0] for r in revisions)
+    assert not any(r.is_patch for r in revisions)
+
+
+def test_cohort_filter__compacted_readers(
+    create_cohort_db, db_session, fixture_cohort, count_queries
+):
+    """Tests compacted revisions serialize their full filters, never patches."""
+
+    revisions = create_filter_history(db_session, fixture_cohort.id, 5)
+    expected = {r.id: r.filters for r in revisions}
+    cohort.CohortFilter.compact_history(db_session.connection(), fixture_cohort.id)
+    db_session.expire_all()
+
+    assert [r.is_patch for r in revisions] == [False, True, True, True, False]
+    assert all(r.filters is None for r in revisions[1:4])
+    assert revisions[1].filters_patch[0]["op"] == "replace"
+    for revision in revisions:
+        assert revision.to_json()["filters"] == expected[revision.id]
+        assert json.loads(b"".join(revision.iter_json()))["filters"] == (
+            expected[revision.id]
+        )
+        assert repr(expected[revision.id]) in repr(revision)
+
+    del count_queries[:]
+    assert cohort.CohortFilter.materialize_all(db_session, revisions) == expected
+    assert len(count_queries) == 1
+
+
+def test_cohort_filter__compact_history_keeps_large_patches(
+    create_cohort_db, db_session, fixture_cohort
+):
+    """Tests revisions stay full when a patch would not be smaller."""
+
+    for filters in [{"a": 1}, {"b": 2}, {"c": 3}]:
+        cohort.CohortFilter.find_or_create_by_filters(
+            db_session, fixture_cohort.id, filters
+        )
+
+    assert (
+        cohort.CohortFilter.compact_history(db_session.connection(), fixture_cohort.id)
+        == 0
+    )
+    with pytest.raises(ValueError):
+        cohort.CohortFilter.compact_history(
+            db_session.connection(), fixture_cohort.id, checkpoint_interval=0
+        )
+
+
+@pytest.mark.parametrize(
+    "old_storage, new_storage",
+    [
+        ("array", "array"),
+        ("array", "packed"),
+        ("packed", "packed"),
+        ("zlib", "array"),
+        ("packed", "zlib"),
+    ],
+)
+def test_cohort_snapshot__diff(
+    create_cohort_db, db_session, fixture_cohort, old_storage, new_storage
+):
+    """Tests snapshot diffs are the same for every storage combination."""
+
+    unchanged = [uuid.uuid4() for i in range(20)]
+    removed = [uuid.uuid4() for i in range(5)]
+    added = [uuid.uuid4() for i in range(7)]
+
+    def create_snapshot(storage, case_ids):
+        if storage == "array":
+            snapshot = cohort.CohortSnapshot(case_ids=case_ids)
+        else:
+            compression = None if storage == "packed" else storage
+            snapshot = cohort.CohortSnapshot.packed(case_ids, compression=compression)
+        snapshot.data_release = uuid.uuid4()
+        snapshot.filter = cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[])
+        db_session.add(snapshot)
+        return snapshot
+
+    old = create_snapshot(old_storage, unchanged + removed + removed[:1])
+    new = create_snapshot(new_storage, added + unchanged)
+    db_session.commit()
+
+    counts = old.diff(db_session, new.id)
+    assert counts == cohort.SnapshotDiff(7, 5, 20, None, None)
+
+    changes = old.diff(db_session, new.id, include_ids=True)
+    assert sorted(changes.added_ids) == sorted(added)
+    assert sorted(changes.removed_ids) == sorted(removed)
+
+    assert new.diff(db_session, new.id) == cohort.SnapshotDiff(0, 0, 27, None, None)
+
+
+def test_cohort_snapshot__diff_missing(db_session, fixture_snapshots):
+    """Tests diffing against a missing snapshot is rejected."""
+
+    with pytest.raises(ValueError, match="does not exist"):
+        fixture_snapshots[1][0].diff(db_session, 123456789)
+
+
+def test_cohort__bulk_create(create_cohort_db, db_session, fixture_context):
+    """Tests bulk created cohorts match their specs."""
+
+    case_ids = [uuid.uuid4() for i in range(5)]
+    specs = [
+        {
+            "name": "cohort_{}".format(i),
+            "context_id": fixture_context.id if i % 2 else None,
+            "filters": [{"field": "cases.primary_site", "value": [str(i)]}],
+        }
+        for i in range(7)
+    ]
+    specs[0].update(data_release=uuid.uuid4(), case_ids=case_ids)
+    specs[1].update(
+        data_release=uuid.uuid4(),
+        packed_case_ids=packed_ids.pack(case_ids),
+        cohort_type="dynamic",
+    )
+
+    cohort_ids = cohort.bulk_create(db_session, specs, batch_size=3)
+    db_session.commit()
+
+    assert len(set(cohort_ids)) == 7
+    for spec, cohort_id in zip(specs, cohort_ids):
+        test_cohort = db_session.query(cohort.Cohort).get(cohort_id)
+        assert test_cohort.name == spec["name"]
+        assert test_cohort.context is not None
+        if spec["context_id"]:
+            assert test_cohort.context_id == fixture_context.id
+
+        current_filter = test_cohort.get_current_filter()
+        assert current_filter.filters == spec["filters"]
+        assert current_filter.filters_hash == db_session.scalar(
+            cohort.hash_filters(spec["filters"])
+        )
+        assert current_filter.cohort_type == spec.get("cohort_type", "static")
+
+        if "data_release" in spec:
+            assert current_filter.snapshot.data_release == spec["data_release"]
+            assert sorted(current_filter.snapshot.get_case_ids()) == sorted(case_ids)
+        else:
+            assert current_filter.snapshot is None
+
+    # sequences stay usable by the ORM after pre-allocation
+    db_session.add(cohort.CohortFilter(cohort_id=cohort_ids[0], filters=[]))
+    db_session.commit()
+
+
+@pytest.fixture(scope="function")
+def fixture_overlapping_snapshots(create_cohort_db, db_session, fixture_cohort):
+    """Create array and packed snapshots of overlapping case sets."""
+
+    case_ids = [uuid.uuid4() for i in range(30)]
+    case_sets = [case_ids[:20], case_ids[10:30], case_ids[5:15] + case_ids[25:]]
+    snapshots = []
+    for i, case_set in enumerate(case_sets):
+        test_filter = cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[])
+        if i == 1:
+            test_filter.snapshot = cohort.CohortSnapshot.packed(
+                case_set, data_release=uuid.uuid4()
+            )
+        else:
+            test_filter.snapshot = cohort.CohortSnapshot(
+                data_release=uuid.uuid4(), case_ids=case_set
+            )
+        snapshots.append(test_filter.snapshot)
+        db_session.add(test_filter)
+    db_session.commit()
+
+    return [set(case_set) for case_set in case_sets], [s.id for s in snapshots]
+
+
+@pytest.mark.parametrize(
+    "op, expected",
+    [
+        ("union", lambda a, b, c: a | b | c),
+        ("intersection", lambda a, b, c: a & b & c),
+        ("difference", lambda a, b, c: a - b - c),
+    ],
+)
+def test_combine(db_session, fixture_overlapping_snapshots, op, expected):
+    """Tests set operations over array and packed snapshots."""
+
+    case_sets, snapshot_ids = fixture_overlapping_snapshots
+
+    assert cohort.combine(db_session, op, snapshot_ids) == sorted(expected(*case_sets))
+    assert cohort.combine(db_session, "difference", snapshot_ids[:1] * 2) == []
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_combine__into_snapshot(
+    db_session, fixture_cohort, fixture_overlapping_snapshots, packed
+):
+    """Tests combined case sets are written as a new snapshot."""
+
+    case_sets, snapshot_ids = fixture_overlapping_snapshots
+    test_filter = cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[])
+    db_session.add(test_filter)
+    db_session.flush()
+    data_release = uuid.uuid4()
+
+    snapshot_id = cohort.combine(
+        db_session,
+        "union",
+        snapshot_ids,
+        into=cohort.CohortSnapshot(filter_id=test_filter.id, data_release=data_release),
+        packed=packed,
+    )
+    snapshot = db_session.query(cohort.CohortSnapshot).get(snapshot_id)
+
+    assert snapshot.is_packed == packed
+    assert snapshot.filter_id == test_filter.id
+    assert snapshot.data_release == data_release
+    assert list(snapshot.get_case_ids()) == sorted(set.union(*case_sets))
+
+
+@pytest.mark.parametrize(
+    "set_type", [entity_set.SetType.frozen, entity_set.SetType.mutable]
+)
+def test_combine__into_entity_set(
+    create_entity_set_db, db_session, fixture_overlapping_snapshots, set_type
+):
+    """Tests combined case sets are written as a new entity set."""
+
+    case_sets, snapshot_ids = fixture_overlapping_snapshots
+
+    set_id = cohort.combine(
+        db_session,
+        "intersection",
+        snapshot_ids[:2],
+        into=entity_set.EntitySet(
+            id="combined",
+            type=set_type,
+            entity_type=entity_set.EntityType.case,
+        ),
+    )
+    test_set = db_session.query(entity_set.EntitySet).get(set_id)
+
+    assert set_id == "combined"
+    assert test_set.type == set_type
+    assert test_set.entity_ids == sorted(str(i) for i in case_sets[0] & case_sets[1])
+
+
+def test_combine__into_frozen_entity_set(
+    create_entity_set_db, db_session, fixture_overlapping_snapshots
+):
+    """Tests combined frozen sets are hashed like frozen ones, and not duplicated."""
+
+    case_sets, snapshot_ids = fixture_overlapping_snapshots
+    case_ids = [str(i) for i in case_sets[0] | case_sets[1]]
+
+    set_id = cohort.combine(
+        db_session,
+        "union",
+        snapshot_ids[:2],
+        into=entity_set.EntitySet(
+            id="combined",
+            type=entity_set.SetType.frozen,
+            entity_type=entity_set.EntityType.case,
+        ),
+    )
+    test_set = db_session.query(entity_set.EntitySet).get(set_id)
+
+    assert test_set.content_hash == entity_set.hash_content(
+        entity_set.EntityType.case, case_ids
+    )
+    assert json.loads(test_set.to_json_bytes())["entity_ids"] == sorted(case_ids)
+
+    frozen, created = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, reversed(case_ids)
+    )
+    assert (frozen.id, created) == ("combined", False)
+
+    again = cohort.combine(
+        db_session,
+        "union",
+        snapshot_ids[:2],
+        into=entity_set.EntitySet(
+            id="combined_again",
+            type=entity_set.SetType.frozen,
+            entity_type=entity_set.EntityType.case,
+        ),
+    )
+    assert again == "combined"
+
+
+def test_combine__invalid(db_session, fixture_overlapping_snapshots, fixture_cohort):
+    """Tests unsupported operations and snapshots are rejected."""
+
+    _, snapshot_ids = fixture_overlapping_snapshots
+    compressed = cohort.CohortSnapshot.packed(
+        [uuid.uuid4()],
+        compression="zlib",
+        data_release=uuid.uuid4(),
+        filter=cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[]),
+    )
+    db_session.add(compressed)
+    db_session.commit()
+
+    with pytest.raises(ValueError, match="unsupported"):
+        cohort.combine(db_session, "xor", snapshot_ids)
+    with pytest.raises(ValueError, match="do not exist"):
+        cohort.combine(db_session, "union", snapshot_ids + [-1])
+    with pytest.raises(ValueError, match="compressed"):
+        cohort.combine(db_session, "union", snapshot_ids + [compressed.id])
+
+
+def test_cohort_snapshot__containing_case(
+    db_session, fixture_cohort, fixture_overlapping_snapshots
+):
+    """Tests snapshots containing a case are found, unless compressed."""
+
+    case_sets, snapshot_ids = fixture_overlapping_snapshots
+    compressed = cohort.CohortSnapshot.packed(
+        case_sets[1],
+        compression="zlib",
+        data_release=uuid.uuid4(),
+        filter=cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[]),
+    )
+    db_session.add(compressed)
+    db_session.commit()
+    compressed_id = compressed.id
+
+    in_all = min(case_sets[0] & case_sets[1] & case_sets[2])
+    in_first = min(case_sets[0] - case_sets[1] - case_sets[2])
+    in_second = min(case_sets[1] - case_sets[0] - case_sets[2])
+
+    def find(case_id):
+        db_session.expunge_all()
+        return [
+            s.id for s in cohort.CohortSnapshot.containing_case(db_session, case_id)
+        ]
+
+    assert compressed_id not in find(in_all)
+    assert find(in_all) == snapshot_ids
+    assert find(in_first) == snapshot_ids[:1]
+    assert find(str(in_second)) == [snapshot_ids[1]]
+    assert find(uuid.uuid4()) == []
+
+
+def test_cohort_snapshot__containing_case_index(
+    db_session, fixture_overlapping_snapshots
+):
+    """Tests the array containment lookup can use the GIN index."""
+
+    db_session.execute("SET LOCAL enable_seqscan = off")
+    plan = db_session.execute(
+        "EXPLAIN SELECT id FROM cohort_snapshot WHERE case_ids @> ARRAY[:case_id]::uuid[]",
+        {"case_id": str(uuid.uuid4())},
+    ).fetchall()
+
+    assert "cohort_snapshot_case_ids_idx" in " ".join(row[0] for row in plan)
+
+
+def test_cohort_snapshot__containing_case_packed_index(
+    db_session, fixture_overlapping_snapshots
+):
+    """Tests the lookup is served by the array and packed case ID indexes."""
+
+    db_session.execute("SET LOCAL enable_seqscan = off")
+    plan = " ".join(
+        row[0]
+        for row in db_session.execute(
+            "EXPLAIN SELECT id FROM cohort_snapshot "
+            "WHERE case_ids @> ARRAY[:case_id]::uuid[] "
+            "OR cohort_snapshot_packed_case_ids(packed_case_ids) "
+            "@> ARRAY[:case_id]::uuid[]",
+            {"case_id": str(uuid.uuid4())},
+        )
+    )
+
+    assert "cohort_snapshot_case_ids_idx" in plan
+    assert "cohort_snapshot_packed_case_ids_idx" in plan
+
+    case_ids = sorted(uuid.uuid4() for _ in range(3))
+    for compression, expected in [(None, case_ids), ("zlib", None)]:
+        decoded = db_session.scalar(
+            sqlalchemy.func.cohort_snapshot_packed_case_ids(
+                sqlalchemy.literal(
+                    packed_ids.pack(case_ids, compression=compression),
+                    postgresql.BYTEA,
+                ),
+                type_=cohort.CohortSnapshot.case_ids.type,
+            )
+        )
+        assert decoded == expected
+
+
+def test_cohort_snapshot__case_count(db_session, fixture_snapshots, fixture_cohort):
+    """Tests case_count is maintained for every storage and write path."""
+
+    case_ids, snapshots = fixture_snapshots
+    assert [snapshot.case_count for snapshot in snapshots] == [25, 25, 25]
+
+    snapshots[0].case_ids = case_ids[:3]
+    snapshots[1].packed_case_ids = packed_ids.pack(case_ids[:4])
+    db_session.commit()
+    assert [snapshot.case_count for snapshot in snapshots] == [3, 4, 25]
+
+    test_filter = cohort.CohortFilter(cohort_id=fixture_cohort.id, filters=[])
+    db_session.add(test_filter)
+    db_session.flush()
+    snapshot_id = cohort.combine(
+        db_session,
+        "union",
+        [snapshots[0].id, snapshots[1].id],
+        into=cohort.CohortSnapshot(filter_id=test_filter.id, data_release=uuid.uuid4()),
+    )
+    count = (
+        db_session.query(cohort.CohortSnapshot.case_count)
+        .filter(cohort.CohortSnapshot.id == snapshot_id)
+        .scalar()
+    )
+    assert count == 4
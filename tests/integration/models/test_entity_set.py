@@ -6,9 +6,13 @@ Validations that need to be enforced programmatically as they
   * EntitySet.entity_ids values cannot exceed 36 characters
   * EntitySet.entity_ids should be a unique 'set' not an array of values
 """
+import datetime
+import io
 import json
+import uuid
 
 import pytest
+import sqlalchemy
 
 from gdc_ng_models.models import entity_set
 
@@ -119,3 +123,661 @@ def test_entity_set_to_json(create_entity_set_db, db_session):
         )
     )
     assert objectUnderTest.to_json() == expected_json
+
+
+def test_entity_set_entity_count(create_entity_set_db, db_session):
+    """Tests entity_count follows entity_ids on insert and update"""
+    objectUnderTest = create_nominal_entity_set()
+    db_session.add(objectUnderTest)
+    db_session.commit()
+    assert objectUnderTest.entity_count == 1
+
+    objectUnderTest.entity_ids = [STRING_36_CHAR] * 3
+    db_session.commit()
+    assert objectUnderTest.entity_count == 3
+
+    objectUnderTest.entity_ids = []
+    db_session.commit()
+    assert objectUnderTest.entity_count == 0
+
+
+def test_entity_set_chunked(create_entity_set_db, db_session):
+    """Tests chunked sets expose their ids like inline sets"""
+    entity_ids = [str(uuid.uuid4()) for i in range(25)]
+    objectUnderTest = entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=entity_ids,
+        chunk_size=10,
+    )
+    db_session.commit()
+
+    assert objectUnderTest.entity_ids is None
+    assert objectUnderTest.entity_count == 25
+    assert [c.entity_count for c in objectUnderTest.chunks] == [10, 10, 5]
+    assert {c.encoding for c in objectUnderTest.chunks} == {"uuid"}
+    assert sorted(objectUnderTest.get_entity_ids()) == sorted(entity_ids)
+    assert sorted(objectUnderTest.to_json()["entity_ids"]) == sorted(entity_ids)
+    assert objectUnderTest.contains_id(db_session, entity_ids[17])
+    assert not objectUnderTest.contains_id(db_session, str(uuid.uuid4()))
+
+
+def test_entity_set_chunked_append(create_entity_set_db, db_session):
+    """Tests appends only rewrite the chunk covering the new ids"""
+    objectUnderTest = entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.gene,
+        entity_ids=["ENSG{:011d}".format(i) for i in range(12)],
+        chunk_size=10,
+    )
+    first_chunk = objectUnderTest.chunks[0].data
+
+    appended = objectUnderTest.append_ids(
+        db_session, ["ENSG{:011d}".format(i) for i in range(12, 30)] * 2, chunk_size=10
+    )
+    db_session.commit()
+
+    assert appended == 18
+    assert objectUnderTest.entity_count == 30
+    assert [c.entity_count for c in objectUnderTest.chunks] == [10, 10, 10]
+    assert objectUnderTest.chunks[0].data == first_chunk
+    assert objectUnderTest.chunks[0].encoding == "text"
+    assert objectUnderTest.contains_id(db_session, "ENSG00000000029")
+    assert not objectUnderTest.contains_id(db_session, "ENSG00000000030")
+    assert objectUnderTest.get_entity_ids() == [
+        "ENSG{:011d}".format(i) for i in range(30)
+    ]
+
+    assert (
+        objectUnderTest.append_ids(
+            db_session, ["ENSG{:011d}".format(i) for i in range(5)], chunk_size=10
+        )
+        == 0
+    )
+    db_session.commit()
+    assert objectUnderTest.entity_count == 30
+    assert objectUnderTest.chunks[0].data == first_chunk
+
+    db_session.delete(objectUnderTest)
+    db_session.commit()
+    assert db_session.query(entity_set.EntitySetChunk).count() == 0
+
+
+def test_entity_set_chunked_ranges(create_entity_set_db, db_session):
+    """Tests chunks keep disjoint id ranges as ids are added in any order"""
+    objectUnderTest = entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.gene,
+        entity_ids=["ENSG{:011d}".format(i) for i in range(0, 40, 2)],
+        chunk_size=10,
+    )
+    assert (
+        objectUnderTest.append_ids(
+            db_session,
+            ["ENSG{:011d}".format(i) for i in reversed(range(-3, 43))],
+            chunk_size=10,
+        )
+        == 26
+    )
+    db_session.commit()
+
+    chunks = objectUnderTest.chunks
+    assert objectUnderTest.entity_count == 46
+    assert all(c.entity_count <= 10 for c in chunks)
+    assert all(a.max_id < b.min_id for a, b in zip(chunks, chunks[1:]))
+    assert [i for c in chunks for i in c.get_entity_ids()] == sorted(
+        "ENSG{:011d}".format(i) for i in range(-3, 43)
+    )
+    for i in range(-3, 43):
+        assert objectUnderTest.contains_id(db_session, "ENSG{:011d}".format(i))
+    assert not objectUnderTest.contains_id(db_session, "ENSG00000000043")
+    assert not objectUnderTest.contains_id(db_session, "ENSG")
+
+
+def test_entity_set_rechunk(create_entity_set_db, db_session):
+    """Tests rechunking merges overlapping chunks into full disjoint ones"""
+    objectUnderTest = entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+    )
+    entity_ids = sorted(str(uuid.uuid4()) for i in range(25))
+    db_session.add_all(
+        entity_set.EntitySetChunk(
+            set_id="chunked",
+            chunk_index=chunk_index,
+            **entity_set._encode_chunk(entity_ids[chunk_index::3] + entity_ids[:1]),
+        )
+        for chunk_index in range(3)
+    )
+    db_session.commit()
+    updated_datetime = objectUnderTest.updated_datetime
+
+    assert entity_set.rechunk(db_session, "chunked", chunk_size=10) == 25
+    db_session.commit()
+    db_session.refresh(objectUnderTest)
+
+    assert objectUnderTest.entity_count == 25
+    assert objectUnderTest.updated_datetime == updated_datetime
+    assert [c.chunk_index for c in objectUnderTest.chunks] == [0, 1, 2]
+    assert [c.entity_count for c in objectUnderTest.chunks] == [10, 10, 5]
+    assert objectUnderTest.get_entity_ids() == entity_ids
+
+
+def test_entity_set_inline_append(create_entity_set_db, db_session):
+    """Tests appends to inline sets are concatenated server side"""
+    objectUnderTest = create_nominal_entity_set()
+    db_session.add(objectUnderTest)
+    db_session.commit()
+
+    objectUnderTest.append_ids(db_session, [STRING_37_CHAR])
+    db_session.commit()
+
+    assert objectUnderTest.entity_ids == [STRING_36_CHAR, STRING_37_CHAR]
+    assert objectUnderTest.entity_count == 2
+    assert objectUnderTest.contains_id(db_session, STRING_37_CHAR)
+    assert not objectUnderTest.contains_id(db_session, STRING_128_CHAR)
+
+
+def test_entity_set_add_remove_ids(create_entity_set_db, db_session):
+    """Tests inline sets add and remove ids server side, without duplicates"""
+    objectUnderTest = create_nominal_entity_set()
+    objectUnderTest.type = entity_set.SetType.mutable
+    objectUnderTest.entity_ids = ["a", "b"]
+    db_session.add(objectUnderTest)
+    db_session.commit()
+
+    assert objectUnderTest.add_ids(db_session, ["c", "a", "d", "c"]) == 2
+    db_session.commit()
+    assert objectUnderTest.entity_ids == ["a", "b", "c", "d"]
+    assert objectUnderTest.entity_count == 4
+
+    assert objectUnderTest.remove_ids(db_session, ["b", "d", "x"]) == 2
+    db_session.commit()
+    assert objectUnderTest.entity_ids == ["a", "c"]
+    assert objectUnderTest.entity_count == 2
+
+
+@pytest.mark.parametrize(
+    "statement", [entity_set._INLINE_ADD_IDS, entity_set._INLINE_REMOVE_IDS]
+)
+def test_entity_set_add_remove_ids_anti_join(
+    create_entity_set_db, db_session, statement
+):
+    """Tests inline adds and removes filter ids with an anti-join"""
+    plan = "\n".join(
+        row[0]
+        for row in db_session.execute(
+            sqlalchemy.text("EXPLAIN " + str(statement)),
+            {"set_id": "set", "entity_ids": ["a", "b"]},
+        )
+    )
+
+    assert "Anti Join" in plan
+
+
+@pytest.mark.parametrize(
+    "make_id", [lambda i: "ENSG{:011d}".format(i), lambda i: str(uuid.UUID(int=i))]
+)
+def test_entity_set_chunked_add_remove_ids(create_entity_set_db, db_session, make_id):
+    """Tests chunked sets only rewrite the chunks holding changed ids"""
+    objectUnderTest = entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.gene,
+        entity_ids=[make_id(i) for i in range(30)],
+        chunk_size=10,
+    )
+    db_session.commit()
+    untouched = objectUnderTest.chunks[1].data
+
+    assert (
+        objectUnderTest.add_ids(
+            db_session, [make_id(i) for i in range(25, 35)], chunk_size=10
+        )
+        == 5
+    )
+    assert objectUnderTest.remove_ids(db_session, [make_id(i) for i in range(10)]) == 10
+    assert objectUnderTest.remove_ids(db_session, [make_id(20), make_id(99)]) == 1
+    db_session.commit()
+
+    expected = [make_id(i) for i in range(10, 35) if i != 20]
+    assert objectUnderTest.entity_count == 24
+    assert sorted(objectUnderTest.get_entity_ids()) == sorted(expected)
+    assert [c.chunk_index for c in objectUnderTest.chunks] == [1, 2, 3]
+    assert objectUnderTest.chunks[0].data == untouched
+
+
+def test_entity_set_frozen_is_immutable(create_entity_set_db, db_session):
+    """Tests frozen sets cannot be changed"""
+    objectUnderTest = create_nominal_entity_set()
+    db_session.add(objectUnderTest)
+    db_session.commit()
+
+    with pytest.raises(ValueError, match="frozen"):
+        objectUnderTest.add_ids(db_session, ["a"])
+    with pytest.raises(ValueError, match="frozen"):
+        objectUnderTest.remove_ids(db_session, [STRING_36_CHAR])
+
+
+def test_entity_set_copy_in(create_entity_set_db, db_session):
+    """Tests bulk upserts keep frozen sets and replace the others"""
+    db_session.add_all(
+        [
+            entity_set.EntitySet(
+                id=set_type.name,
+                type=set_type,
+                entity_type=entity_set.EntityType.case,
+                entity_ids=["old"],
+            )
+            for set_type in [entity_set.SetType.frozen, entity_set.SetType.mutable]
+        ]
+    )
+    entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=["old"],
+    )
+    db_session.commit()
+
+    records = [
+        {
+            "id": set_id,
+            "type": "ephemeral",
+            "entity_type": entity_set.EntityType.gene,
+            "entity_ids": ["new", 'quoted "id", with comma'],
+        }
+        for set_id in ["frozen", "mutable", "chunked", "new", "new"]
+    ]
+    records.append(
+        entity_set.EntitySet(
+            id="instance",
+            type=entity_set.SetType.frozen,
+            entity_type=entity_set.EntityType.ssm,
+            entity_ids=[STRING_36_CHAR],
+        )
+    )
+
+    result = entity_set.EntitySet.copy_in(db_session, records)
+    db_session.expire_all()
+
+    assert result == entity_set.CopyResult(inserted=2, updated=2, skipped=1)
+    sets = {s.id: s for s in db_session.query(entity_set.EntitySet)}
+    assert sets["frozen"].entity_ids == ["old"]
+    for set_id in ["mutable", "chunked", "new"]:
+        assert sets[set_id].type == entity_set.SetType.ephemeral
+        assert sets[set_id].entity_ids == ["new", 'quoted "id", with comma']
+        assert sets[set_id].entity_count == 2
+    assert not sets["chunked"].chunked
+    assert sets["chunked"].chunks == []
+    assert sets["instance"].entity_ids == [STRING_36_CHAR]
+
+
+def test_entity_set_copy_in_frozen(create_entity_set_db, db_session):
+    """Tests bulk upserts hash frozen sets and render their payload"""
+    existing, _ = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, ["a", "b"], set_id="existing"
+    )
+    db_session.add(
+        entity_set.EntitySet(
+            id="refrozen",
+            type=entity_set.SetType.mutable,
+            entity_type=entity_set.EntityType.file,
+            entity_ids=["old"],
+        )
+    )
+    db_session.commit()
+
+    records = [
+        {"id": set_id, "type": "frozen", "entity_type": "case", "entity_ids": ids}
+        for set_id, ids in [
+            ("copied", ["d", "c", "d"]),
+            ("copied_again", ["c", "d"]),
+            ("duplicate", ["b", "a"]),
+        ]
+    ]
+    records.append(
+        {"id": "refrozen", "type": "frozen", "entity_type": "file", "entity_ids": ["e"]}
+    )
+    result = entity_set.EntitySet.copy_in(db_session, records, compress_payload=True)
+    db_session.commit()
+
+    assert result == entity_set.CopyResult(inserted=3, updated=1, skipped=0)
+    sets = {s.id: s for s in db_session.query(entity_set.EntitySet)}
+    assert sets["copied"].content_hash == entity_set.hash_content(
+        entity_set.EntityType.case, ["c", "d"]
+    )
+    assert sets["copied_again"].content_hash is None
+    assert sets["duplicate"].content_hash is None
+    assert sets["existing"].content_hash == existing.content_hash
+    assert sets["refrozen"].content_hash == entity_set.hash_content(
+        entity_set.EntityType.file, ["e"]
+    )
+
+    for entity_set_ in sets.values():
+        expected = entity_set_.to_json()
+        del expected["accessed_datetime"]
+        payload = json.loads(entity_set_.to_json_bytes())
+        for key in ("created_datetime", "updated_datetime"):
+            assert datetime.datetime.fromisoformat(
+                payload.pop(key)
+            ) == datetime.datetime.fromisoformat(expected.pop(key))
+        assert payload == expected
+    assert sets["copied"].json_payload[:2] == entity_set.GZIP_MAGIC
+
+    frozen, created = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, ["c", "d"]
+    )
+    assert (frozen.id, created) == ("copied", False)
+
+
+def test_entity_set_copy_out(create_entity_set_db, db_session):
+    """Tests bulk exports can be read back and re-imported"""
+    for set_type in entity_set.SetType:
+        db_session.add(
+            entity_set.EntitySet(
+                id=set_type.name,
+                type=set_type,
+                entity_type=entity_set.EntityType.file,
+                entity_ids=[set_type.name, "a,b", 'c"d', "e\\f", "NULL"],
+            )
+        )
+    db_session.commit()
+
+    out = io.StringIO()
+    written = entity_set.EntitySet.copy_out(
+        db_session,
+        out,
+        entity_set.EntitySet.type != entity_set.SetType.ephemeral,
+    )
+    out.seek(0)
+    records = list(entity_set.EntitySet.read_copy(out))
+
+    assert written == 2
+    assert records == [
+        {
+            "id": set_type.name,
+            "type": set_type,
+            "entity_type": entity_set.EntityType.file,
+            "entity_ids": [set_type.name, "a,b", 'c"d', "e\\f", "NULL"],
+        }
+        for set_type in [entity_set.SetType.frozen, entity_set.SetType.mutable]
+    ]
+    assert entity_set.EntitySet.copy_in(db_session, records).skipped == 1
+
+
+def test_entity_set_copy_out_chunked(create_entity_set_db, db_session):
+    """Tests bulk exports include chunked sets, in binary files too"""
+    entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=["c", "a,b", STRING_36_CHAR],
+        chunk_size=2,
+    )
+    db_session.add(
+        entity_set.EntitySet(
+            id="inline",
+            type=entity_set.SetType.mutable,
+            entity_type=entity_set.EntityType.case,
+            entity_ids=["d"],
+        )
+    )
+    db_session.commit()
+
+    out = io.BytesIO()
+    written = entity_set.EntitySet.copy_out(
+        db_session, out, entity_set.EntitySet.type == entity_set.SetType.mutable
+    )
+    records = list(
+        entity_set.EntitySet.read_copy(io.StringIO(out.getvalue().decode("utf-8")))
+    )
+
+    assert written == 2
+    assert [record["id"] for record in records] == ["inline", "chunked"]
+    assert records[1]["entity_ids"] == sorted(["c", "a,b", STRING_36_CHAR])
+
+
+def test_entity_set_copy_in_chunked_instance(create_entity_set_db, db_session):
+    """Tests bulk upserts reject chunked instances with a clear error"""
+    chunked = entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=["a"],
+    )
+    db_session.commit()
+    db_session.refresh(chunked)
+
+    with pytest.raises(ValueError, match="chunked set chunked"):
+        entity_set.EntitySet.copy_in(db_session, [chunked])
+
+
+def test_entity_set_freeze(create_entity_set_db, db_session):
+    """Tests freezing the same content returns the existing frozen set"""
+    frozen, created = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, ["b", "a", "b"]
+    )
+    again, created_again = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, ["a", "b"], set_id="custom"
+    )
+    other_type, created_other_type = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.gene, ["a", "b"]
+    )
+    custom, created_custom = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, ["c"], set_id="custom"
+    )
+
+    assert created and not created_again and created_other_type and created_custom
+    assert again is frozen
+    assert frozen.id == frozen.content_hash
+    assert frozen.content_hash == entity_set.hash_content(
+        entity_set.EntityType.case, ["a", "b"]
+    )
+    assert frozen.type == entity_set.SetType.frozen
+    assert frozen.entity_ids == ["a", "b"]
+    assert other_type.content_hash != frozen.content_hash
+    assert custom.id == "custom"
+
+    with pytest.raises(ValueError, match="already exists"):
+        entity_set.EntitySet.freeze(
+            db_session, entity_set.EntityType.case, ["d"], set_id="custom"
+        )
+
+
+def test_entity_set_to_json_bytes(create_entity_set_db, db_session):
+    """Tests frozen sets serve their pre-rendered JSON payload"""
+    frozen, _ = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.case, ["b", "a"]
+    )
+    compressed, _ = entity_set.EntitySet.freeze(
+        db_session, entity_set.EntityType.gene, ["g"], compress_payload=True
+    )
+    mutable = create_nominal_entity_set()
+    mutable.type = entity_set.SetType.mutable
+    db_session.add(mutable)
+    db_session.flush()
+    ids = frozen.id, compressed.id, mutable.id
+    db_session.expunge_all()
+
+    frozen, compressed, mutable = [
+        db_session.query(entity_set.EntitySet).get(i) for i in ids
+    ]
+    expected = frozen.to_json()
+    del expected["accessed_datetime"]
+    assert "json_payload" not in frozen.__dict__
+    payload = json.loads(frozen.to_json_bytes())
+    for key in ("created_datetime", "updated_datetime"):
+        assert datetime.datetime.fromisoformat(
+            payload.pop(key)
+        ) == datetime.datetime.fromisoformat(expected.pop(key))
+    assert payload == expected
+
+    assert compressed.json_payload[:2] == entity_set.GZIP_MAGIC
+    assert compressed.to_json_bytes(decompress=False) == compressed.json_payload
+    assert json.loads(compressed.to_json_bytes())["entity_ids"] == ["g"]
+
+    assert mutable.json_payload is None
+    assert json.loads(mutable.to_json_bytes())["entity_ids"] == mutable.entity_ids
+    with pytest.raises(ValueError, match="frozen"):
+        mutable.cache_json()
+
+
+def test_entity_set_cache_json(create_entity_set_db, db_session):
+    """Tests rendering the payload of frozen sets created without freeze"""
+    db_session.add(
+        entity_set.EntitySet(
+            id="copied",
+            type=entity_set.SetType.frozen,
+            entity_type=entity_set.EntityType.case,
+            entity_ids=["x"],
+        )
+    )
+    db_session.flush()
+    copied = db_session.query(entity_set.EntitySet).get("copied")
+    assert copied.json_payload is None
+
+    copied.cache_json(compress=True)
+    db_session.flush()
+    db_session.expire(copied)
+
+    assert copied.json_payload[:2] == entity_set.GZIP_MAGIC
+    payload = json.loads(copied.to_json_bytes())
+    assert payload["entity_ids"] == ["x"]
+    assert (
+        datetime.datetime.fromisoformat(payload["updated_datetime"])
+        == copied.updated_datetime
+    )
+
+
+def test_entity_set_sets_containing(create_entity_set_db, db_session):
+    """Tests membership lookups over inline and chunked sets"""
+    case_ids = [str(uuid.uuid4()) for i in range(30)]
+    for set_id, entity_type, entity_ids in [
+        ("inline_1", entity_set.EntityType.case, case_ids[:10]),
+        ("inline_2", entity_set.EntityType.case, case_ids[5:15]),
+        ("other_type", entity_set.EntityType.file, case_ids),
+    ]:
+        db_session.add(
+            entity_set.EntitySet(
+                id=set_id,
+                type=entity_set.SetType.frozen,
+                entity_type=entity_type,
+                entity_ids=entity_ids,
+            )
+        )
+    entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=case_ids[8:25],
+        chunk_size=4,
+    )
+    db_session.commit()
+
+    found = entity_set.EntitySet.sets_containing_any(
+        db_session, entity_set.EntityType.case, case_ids + ["missing"]
+    )
+
+    assert found[case_ids[0]] == ["inline_1"]
+    assert found[case_ids[9]] == ["chunked", "inline_1", "inline_2"]
+    assert found[case_ids[20]] == ["chunked"]
+    assert case_ids[29] not in found
+    assert "missing" not in found
+    assert [
+        s.id
+        for s in entity_set.EntitySet.sets_containing(
+            db_session, entity_set.EntityType.case, case_ids[12]
+        )
+    ] == ["chunked", "inline_2"]
+    assert (
+        entity_set.EntitySet.sets_containing(
+            db_session, entity_set.EntityType.ssm, case_ids[0]
+        )
+        == []
+    )
+
+
+def test_entity_set_sets_containing_text_chunks(create_entity_set_db, db_session):
+    """Tests membership lookups over text encoded chunks"""
+    entity_set.EntitySet.create_chunked(
+        db_session,
+        id="genes",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.gene,
+        entity_ids=["ENSG{:011d}".format(i) for i in range(0, 40, 2)],
+        chunk_size=5,
+    )
+    db_session.commit()
+
+    found = entity_set.EntitySet.sets_containing_any(
+        db_session,
+        entity_set.EntityType.gene,
+        ["ENSG00000000010", "ENSG00000000011", "ENSG00000000999"],
+    )
+
+    assert found == {"ENSG00000000010": ["genes"]}
+
+
+def test_entity_set_sets_containing_chunk_ranges(create_entity_set_db, db_session):
+    """Tests membership lookups over many chunks and ids outside their ranges"""
+    entity_ids = sorted(str(uuid.UUID(int=i * 7)) for i in range(1, 200))
+    entity_set.EntitySet.create_chunked(
+        db_session,
+        id="chunked",
+        type=entity_set.SetType.mutable,
+        entity_type=entity_set.EntityType.case,
+        entity_ids=entity_ids,
+        chunk_size=10,
+    )
+    db_session.commit()
+
+    lookups = [str(uuid.UUID(int=i)) for i in range(0, 1500)]
+    found = entity_set.EntitySet.sets_containing_any(
+        db_session, entity_set.EntityType.case, lookups
+    )
+
+    assert found == {entity_id: ["chunked"] for entity_id in entity_ids}
+
+
+def test_entity_set_chunked_membership_index(create_entity_set_db, db_session):
+    """Tests chunked membership lookups are served by indexes"""
+    db_session.execute("SET LOCAL enable_seqscan = off")
+    plan = "\n".join(
+        row[0]
+        for row in db_session.execute(
+            sqlalchemy.text("EXPLAIN " + str(entity_set._CHUNKED_MEMBERSHIP)),
+            {
+                "entity_ids": [STRING_36_CHAR],
+                "entity_type": entity_set.EntityType.case.name,
+                "uuid_encoding": entity_set.CHUNK_ENCODING_UUID,
+            },
+        )
+    )
+
+    assert "entity_set_chunked_entity_type_idx" in plan
+    assert "entity_set_chunk_min_id_idx" in plan
+
+
+def test_entity_set_entity_ids_index(create_entity_set_db, db_session):
+    """Tests the inline membership lookup can use the GIN index"""
+    db_session.execute("SET LOCAL enable_seqscan = off")
+    plan = db_session.execute(
+        "EXPLAIN SELECT id FROM entity_set WHERE entity_ids @> ARRAY[:id]::varchar[]",
+        {"id": STRING_36_CHAR},
+    ).fetchall()
+
+    assert "entity_set_entity_ids_idx" in " ".join(row[0] for row in plan)
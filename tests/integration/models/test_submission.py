@@ -0,0 +1,164 @@
+import datetime
+
+import pytest
+from sqlalchemy import inspect
+
+from gdc_ng_models.models import submission
+
+
+@pytest.fixture
+def fake_transaction_logs(create_submission_db, db_session):
+    """Adds 10 transaction logs across two projects, two sharing a timestamp"""
+    start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    logs = []
+    for index in range(10):
+        log = submission.TransactionLog(
+            id=index + 1,
+            role="create",
+            program="TCGA",
+            project="BRCA" if index % 2 else "LUAD",
+            is_dry_run=index % 3 == 0,
+            state="SUCCEEDED" if index < 7 else "FAILED",
+            created_datetime=start + datetime.timedelta(minutes=min(index, 8)),
+        )
+        db_session.add(log)
+        logs.append(log)
+    db_session.flush()
+    return logs
+
+
+def read_pages(db_session, filters=None, limit=3):
+    ids, cursor = [], None
+    while True:
+        page = submission.TransactionLog.page(
+            db_session, filters, after=cursor, limit=limit
+        )
+        ids.append([log.id for log in page.logs])
+        cursor = page.next_cursor
+        if cursor is None:
+            return ids
+
+
+def test_transaction_log_page(fake_transaction_logs, db_session):
+    """Tests pages are newest first and break timestamp ties by id"""
+    assert read_pages(db_session) == [[10, 9, 8], [7, 6, 5], [4, 3, 2], [1]]
+    assert read_pages(db_session, limit=5) == [[10, 9, 8, 7, 6], [5, 4, 3, 2, 1]]
+    assert read_pages(db_session, limit=10) == [list(range(10, 0, -1))]
+
+
+def test_transaction_log_page_filters(fake_transaction_logs, db_session):
+    """Tests pages only hold matching transaction logs"""
+    filters = {"program": "TCGA", "project": "BRCA", "state": "SUCCEEDED"}
+    assert read_pages(db_session, filters, limit=2) == [[6, 4], [2]]
+    assert read_pages(db_session, {"is_dry_run": True}) == [[10, 7, 4], [1]]
+    assert read_pages(db_session, {"project": "OTHER"}) == [[]]
+
+
+def test_transaction_log_page_invalid(fake_transaction_logs, db_session):
+    with pytest.raises(ValueError, match="Filters do not exist: submitter"):
+        submission.TransactionLog.page(db_session, {"submitter": "someone"})
+    with pytest.raises(ValueError, match="cursor"):
+        submission.TransactionLog.page(db_session, after="not-a-cursor")
+    with pytest.raises(ValueError, match="limit"):
+        submission.TransactionLog.page(db_session, limit=0)
+
+
+def test_transaction_log_page_index(create_submission_db, db_session):
+    """Tests a filtered page is read in index order, without sorting"""
+    db_session.execute("SET LOCAL enable_seqscan = off")
+    plan = db_session.execute(
+        "EXPLAIN SELECT * FROM transaction_logs"
+        " WHERE program = :program AND project = :project AND state = :state"
+        " AND (created_datetime, id) < (:created_datetime, :id)"
+        " ORDER BY created_datetime DESC, id DESC LIMIT 10",
+        {
+            "program": "TCGA",
+            "project": "BRCA",
+            "state": "FAILED",
+            "created_datetime": datetime.datetime.now(datetime.timezone.utc),
+            "id": 1,
+        },
+    ).fetchall()
+
+    plan = " ".join(row[0] for row in plan)
+
+    assert "Index Scan Backward using transaction_logs_" in plan
+    assert "Sort" not in plan
+
+
+@pytest.fixture
+def fake_transaction_children(fake_transaction_logs, db_session):
+    """Adds two entities and a document to each transaction log"""
+    for log in fake_transaction_logs:
+        for index in range(2):
+            db_session.add(
+                submission.TransactionSnapshot(
+                    id=f"node-{log.id}-{index}",
+                    transaction_id=log.id,
+                    action="update",
+                    old_props={},
+                    new_props={"index": index},
+                )
+            )
+        document = submission.TransactionDocument(transaction_id=log.id, name="doc")
+        document.json = {"log": log.id}
+        db_session.add(document)
+    db_session.flush()
+    db_session.expunge_all()
+
+
+def test_transaction_log_load_for_json(
+    fake_transaction_children, db_session, count_queries
+):
+    """Tests serializing logs with entities and documents takes three queries"""
+    fields = {"id", "program", "entities.id", "entities.new_props", "documents"}
+    logs = submission.TransactionLog.load_for_json(db_session, [3, 1, 2, 42], fields)
+    docs = [log.to_json(fields) for log in logs]
+
+    assert len(count_queries) == 3
+    assert [doc["id"] for doc in docs] == [3, 1, 2]
+    assert docs[1]["program"] == "TCGA"
+    assert sorted(e["id"] for e in docs[0]["entities"]) == ["node-3-0", "node-3-1"]
+    assert docs[0]["entities"][0].keys() == {"id", "new_props"}
+    assert logs[0].documents[0].json == {"log": 3}
+    assert {"project", "canonical_json"} <= inspect(logs[0]).unloaded
+    assert "old_props" in inspect(logs[0].entities[0]).unloaded
+
+
+def test_transaction_log_load_for_json_defaults(
+    fake_transaction_children, db_session, count_queries
+):
+    """Tests children are only loaded when requested"""
+    logs = submission.TransactionLog.load_for_json(db_session, [1])
+    doc = logs[0].to_json()
+    assert len(count_queries) == 1
+    assert datetime.datetime.fromisoformat(doc.pop("created_datetime")) == (
+        datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    )
+    assert doc == {"id": 1, "submitter": None, "role": "create", "program": "TCGA"}
+    assert {"entities", "documents"} <= inspect(logs[0]).unloaded
+
+    with pytest.raises(RuntimeError, match="Fields do not exist: unknown"):
+        submission.TransactionLog.load_for_json(db_session, [1], {"unknown"})
+
+
+def test_transaction_log_projection(fake_transaction_children, db_session):
+    """Tests to_json projections are compiled once per field set"""
+    fields = frozenset({"id", "created_datetime", "entities.new_props"})
+    projection = submission.compile_projection(submission.TransactionLog, fields)
+
+    assert submission.compile_projection(submission.TransactionLog, fields) is (
+        projection
+    )
+    assert projection.columns == ("id", "created_datetime")
+    assert projection.children["entities"].columns == ("new_props",)
+
+    log = db_session.query(submission.TransactionLog).get(2)
+    assert log.to_json(set(fields)) == projection.serialize(log)
+    entities = projection.serialize(log)["entities"]
+    assert sorted(e["new_props"]["index"] for e in entities) == [0, 1]
+    assert all(e.keys() == {"new_props"} for e in entities)
+    assert log.documents[0].to_json({"name"}) == {"name": "doc"}
+
+    with pytest.raises(RuntimeError, match="Entity fields do not exist: unknown"):
+        log.to_json({"entities.unknown"})
@@ -0,0 +1,43 @@
+import pytest
+
+from gdc_ng_models.models import cohort
+from gdc_ng_models.snacks import compaction
+
+
+@pytest.fixture(scope="function")
+def fixture_filter_histories(create_cohort_db, db_session):
+    """Create cohorts with a history of three filter revisions each."""
+
+    test_context = cohort.AnonymousContext()
+    test_cohorts = [
+        cohort.Cohort(name="cohort_{}".format(i), context=test_context)
+        for i in range(3)
+    ]
+    db_session.add_all(test_cohorts)
+    db_session.flush()
+    for test_cohort in test_cohorts:
+        parent_id = None
+        for j in range(3):
+            revision = cohort.CohortFilter(
+                cohort_id=test_cohort.id,
+                parent_id=parent_id,
+                filters={"values": list(range(50)), "revision": j},
+            )
+            db_session.add(revision)
+            db_session.flush()
+            parent_id = revision.id
+    db_session.commit()
+    return test_cohorts
+
+
+def test_compact(db_session, fixture_filter_histories):
+    """Tests all but the current revision of each cohort are compacted."""
+
+    rewritten = compaction.compact(db_session.connection(), batch_size=2)
+    db_session.expire_all()
+
+    assert rewritten == 3
+    for test_cohort in fixture_filter_histories:
+        revisions = sorted(test_cohort.filters, key=lambda f: f.id)
+        assert [r.filters_format for r in revisions] == ["full", "patch", "full"]
+        assert [r.materialize()["revision"] for r in revisions] == [0, 1, 2]
@@ -0,0 +1,96 @@
+import datetime
+import uuid
+
+import pytest
+
+from gdc_ng_models.models import cohort, entity_set
+from gdc_ng_models.snacks import retention
+
+STALE = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=100)
+
+
+@pytest.fixture(scope="function")
+def fixture_stale_cohorts(create_cohort_db, db_session):
+    """Create stale and fresh cohorts, each with filters and snapshots."""
+
+    test_context = cohort.AnonymousContext()
+    test_cohorts = []
+    for i in range(5):
+        test_cohort = cohort.Cohort(
+            name="cohort_{}".format(i),
+            context=test_context,
+            accessed_datetime=STALE if i < 3 else None,
+        )
+        for j in range(2):
+            cohort.CohortFilter(
+                cohort=test_cohort,
+                filters=[],
+                snapshot=cohort.CohortSnapshot(
+                    data_release=uuid.uuid4(), case_ids=[uuid.uuid4()]
+                ),
+            )
+        test_cohorts.append(test_cohort)
+    db_session.add_all(test_cohorts)
+    db_session.commit()
+    return test_cohorts
+
+
+def test_sweep__cohorts(db_session, fixture_stale_cohorts):
+    """Tests stale cohorts are deleted with their filters and snapshots."""
+
+    result = retention.sweep(
+        db_session.connection(),
+        retention.RETENTION_POLICIES["cohort"][0],
+        datetime.timedelta(days=90),
+        batch_size=2,
+    )
+    db_session.expire_all()
+
+    assert result.deleted == 3
+    assert result.batches == 2
+    assert db_session.query(cohort.Cohort).count() == 2
+    assert db_session.query(cohort.CohortFilter).count() == 4
+    assert db_session.query(cohort.CohortSnapshot).count() == 4
+    assert db_session.query(cohort.AnonymousContext).count() == 1
+
+
+def test_sweep__max_batches(db_session, fixture_stale_cohorts):
+    """Tests a sweep stops after the maximum number of batches."""
+
+    result = retention.sweep(
+        db_session.connection(),
+        retention.RETENTION_POLICIES["cohort"][0],
+        datetime.timedelta(days=90),
+        batch_size=1,
+        max_batches=2,
+    )
+
+    assert result.deleted == 2
+    assert db_session.query(cohort.Cohort).count() == 3
+
+
+def test_sweep__ephemeral_entity_sets(create_entity_set_db, db_session):
+    """Tests only stale ephemeral entity sets are deleted."""
+
+    for set_type in entity_set.SetType:
+        for accessed_datetime in [STALE, None]:
+            db_session.add(
+                entity_set.EntitySet(
+                    id="{}_{}".format(set_type.name, bool(accessed_datetime)),
+                    type=set_type,
+                    entity_type=entity_set.EntityType.case,
+                    entity_ids=[str(uuid.uuid4())],
+                    accessed_datetime=accessed_datetime,
+                )
+            )
+    db_session.commit()
+
+    result = retention.sweep(
+        db_session.connection(),
+        retention.RETENTION_POLICIES["entity_set"][0],
+        datetime.timedelta(days=90),
+    )
+
+    assert result.deleted == 1
+    assert db_session.query(entity_set.EntitySet).get("ephemeral_True") is None
+    assert db_session.query(entity_set.EntitySet).count() == 5
@@ -0,0 +1,55 @@
+import pytest
+
+from gdc_ng_models.utils import json_patch
+
+
+@pytest.mark.parametrize(
+    "source, target",
+    [
+        ({"op": "and", "content": []}, {"op": "and", "content": []}),
+        ({"op": "and", "content": []}, {"op": "or", "content": []}),
+        ({"a": 1, "b": 2}, {"b": 3, "c": 4}),
+        ({"values": [1, 2, 3]}, {"values": [1, 5]}),
+        ({"values": [1]}, {"values": [1, 2, [3]]}),
+        ({"a": {"b": [{"c": "d"}]}}, {"a": {"b": [{"c": "e", "f": None}]}}),
+        ({"a/b": 1, "c~d": 2}, {"a/b": 2}),
+        ({"a": 1}, [1, 2]),
+        (1, True),
+    ],
+)
+def test_diff__round_trip(source, target):
+    patch = json_patch.diff(source, target)
+
+    assert json_patch.apply(source, patch) == target
+
+
+def test_diff__small_change():
+    source = {"op": "and", "content": [{"op": "in", "value": list(range(100))}]}
+    target = {"op": "and", "content": [{"op": "in", "value": list(range(99))}]}
+
+    assert json_patch.diff(source, target) == [
+        {"op": "remove", "path": "/content/0/value/99"}
+    ]
+
+
+def test_apply__leaves_document_unchanged():
+    source = {"values": [1, 2]}
+
+    json_patch.apply(source, [{"op": "add", "path": "/values/-", "value": 3}])
+
+    assert source == {"values": [1, 2]}
+
+
+@pytest.mark.parametrize(
+    "operation",
+    [
+        {"op": "move", "path": "/a", "from": "/b"},
+        {"op": "remove", "path": "/missing"},
+        {"op": "replace", "path": "/a/b", "value": 1},
+        {"op": "remove", "path": "/values/5"},
+        {"op": "remove", "path": ""},
+    ],
+)
+def test_apply__invalid(operation):
+    with pytest.raises(ValueError):
+        json_patch.apply({"a": 1, "values": [1]}, [operation])
@@ -0,0 +1,79 @@
+import uuid
+
+import pytest
+
+from gdc_ng_models.utils import packed_ids
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_pack__sorted_unique(compression):
+    case_ids = [uuid.uuid4() for i in range(50)]
+
+    packed = packed_ids.PackedIds(
+        packed_ids.pack(case_ids + case_ids[:5], compression=compression)
+    )
+
+    assert len(packed) == 50
+    assert list(packed) == sorted(case_ids)
+
+
+def test_pack__accepts_strings():
+    case_id = uuid.uuid4()
+
+    packed = packed_ids.PackedIds(packed_ids.pack([str(case_id)]))
+
+    assert list(packed) == [case_id]
+    assert list(packed.iter_strings()) == [str(case_id)]
+
+
+def test_pack__unsupported_compression():
+    with pytest.raises(ValueError, match="unsupported compression"):
+        packed_ids.pack([uuid.uuid4()], compression="lz4")
+
+
+def test_pack__uncompressed_layout():
+    case_ids = sorted(uuid.uuid4() for i in range(3))
+
+    data = packed_ids.pack(case_ids)
+
+    assert packed_ids.read_header(data) == (packed_ids.COMPRESSION_NONE, 3)
+    assert data[packed_ids.HEADER.size :] == b"".join(c.bytes for c in case_ids)
+
+
+def test_packed_ids__len_does_not_decode():
+    packed = packed_ids.PackedIds(
+        packed_ids.pack([uuid.uuid4() for i in range(10)], compression="zlib")
+    )
+
+    assert len(packed) == 10
+    assert packed._raw is None
+
+
+def test_packed_ids__indexing_and_slicing():
+    case_ids = sorted(uuid.uuid4() for i in range(10))
+    packed = packed_ids.PackedIds(packed_ids.pack(case_ids))
+
+    assert packed[0] == case_ids[0]
+    assert packed[-1] == case_ids[-1]
+    assert packed[2:5] == case_ids[2:5]
+    assert packed[::3] == case_ids[::3]
+    with pytest.raises(IndexError):
+        packed[10]
+
+
+def test_packed_ids__contains():
+    case_ids = [uuid.uuid4() for i in range(100)]
+    packed = packed_ids.PackedIds(packed_ids.pack(case_ids))
+
+    assert all(case_id in packed for case_id in case_ids)
+    assert str(case_ids[0]) in packed
+    assert uuid.uuid4() not in packed
+    assert "not-a-uuid" not in packed
+
+
+def test_packed_ids__empty():
+    packed = packed_ids.PackedIds(packed_ids.pack([]))
+
+    assert len(packed) == 0
+    assert list(packed) == []
+    assert uuid.uuid4() not in packed